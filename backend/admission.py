@@ -0,0 +1,265 @@
+"""
+Admission control for /chat and /ingest.
+
+Two layers:
+
+1. At the door (before the response starts), no waiting:
+   - per-tenant and per-user token buckets (ADMISSION_TENANT_RATE / _BURST, ADMISSION_USER_RATE / _BURST)
+   - a cap on requests already waiting for a slot (ADMISSION_MAX_QUEUE)
+   Either one answers 429 with Retry-After.
+
+2. Concurrency slots per pool: one pool per mode (policies.yaml modes[].max_concurrency),
+   a "prepare" pool for the threadpool stages of /chat before the LLM call (extraction,
+   PII analysis, retrieval; ADMISSION_PREPARE_CONCURRENCY) and an "ingest" pool
+   (ADMISSION_INGEST_CONCURRENCY). When a pool is full, requests wait in
+   a weighted-fair queue: start-time fair queueing over tenants, so a tenant with a burst of
+   HEAVY requests gets its share of the slots instead of all of them. Tenant weights come
+   from ADMISSION_TENANT_WEIGHTS ("tenant-a=2,tenant-b=1", default 1). A request that waits
+   longer than ADMISSION_MAX_WAIT_SECONDS gets a 429.
+
+Per-key state is bounded: idle token buckets (refilled to the burst) are pruned, and a pool
+forgets tenant virtual times when it goes idle or once the pool clock has passed them.
+
+Everything runs on the event loop (async endpoints), so there are no locks.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_TENANT_RATE = float(os.getenv("ADMISSION_TENANT_RATE", "20"))    # requests / second
+ADMISSION_TENANT_BURST = float(os.getenv("ADMISSION_TENANT_BURST", "60"))
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "10"))
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "30"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30"))
+ADMISSION_INGEST_CONCURRENCY = int(os.getenv("ADMISSION_INGEST_CONCURRENCY", "4"))
+# Below the Starlette threadpool size (40), so LLM streaming and other endpoints keep threads
+ADMISSION_PREPARE_CONCURRENCY = int(os.getenv("ADMISSION_PREPARE_CONCURRENCY", "16"))
+# Token buckets kept before idle ones are pruned (least recently used go first if none is idle)
+ADMISSION_MAX_TRACKED_KEYS = int(os.getenv("ADMISSION_MAX_TRACKED_KEYS", "10000"))
+ADMISSION_TENANT_WEIGHTS = os.getenv("ADMISSION_TENANT_WEIGHTS", "")
+# Modes without max_concurrency in policies.yaml
+DEFAULT_MODE_CONCURRENCY = 16
+INGEST_POOL = "ingest"
+PREPARE_POOL = "prepare"
+# FairPool prunes tenant virtual times once it tracks this many
+VTIME_PRUNE_AT = 1024
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in filter(None, (p.strip() for p in spec.split(","))):
+        tenant, _, weight = item.partition("=")
+        weights[tenant.strip()] = float(weight or 1)
+    return weights
+
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class TokenBuckets:
+    """One token bucket per key: `rate` tokens per second, at most `burst` saved up."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = ADMISSION_MAX_TRACKED_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, last refill)
+
+    def take(self, key: str, now: Optional[float] = None) -> float:
+        """Takes one token. Returns 0 on success, otherwise the seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._set(key, tokens, now)
+            return (1 - tokens) / self.rate
+        self._set(key, tokens - 1, now)
+        return 0.0
+
+    def _set(self, key: str, tokens: float, now: float):
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        # A bucket that has refilled to the burst behaves exactly like a missing one
+        idle = [k for k, (tokens, last) in self._buckets.items() if tokens + (now - last) * self.rate >= self.burst]
+        for k in idle:
+            del self._buckets[k]
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class FairPool:
+    """
+    Counting semaphore whose waiters are served weighted-fair across tenants.
+    Each tenant has a virtual time that advances by 1/weight per granted slot; the waiting
+    tenant with the smallest virtual time goes next. A tenant that was idle starts at the
+    pool's current virtual time, so it cannot bank credit while idle.
+    """
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0
+        self.clock = 0.0
+        self._vtime: Dict[str, float] = {}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    def would_wait(self) -> bool:
+        return self.in_use >= self.capacity or self.queued > 0
+
+    def _grant(self, tenant: str, weight: float):
+        start = max(self._vtime.get(tenant, 0.0), self.clock)
+        self.clock = start
+        self._vtime[tenant] = start + 1.0 / weight
+        self.in_use += 1
+
+    def _dispatch(self):
+        while self.in_use < self.capacity:
+            waiting = [t for t, q in self._waiters.items() if q]
+            if not waiting:
+                return
+            tenant = min(waiting, key=lambda t: max(self._vtime.get(t, 0.0), self.clock))
+            future = self._waiters[tenant].popleft()
+            if not self._waiters[tenant]:
+                del self._waiters[tenant]
+            if future.done():
+                continue
+            self._grant(tenant, future.weight)
+            future.set_result(True)
+
+    async def acquire(self, tenant: str, weight: float = 1.0, timeout: float = ADMISSION_MAX_WAIT_SECONDS):
+        if not self.would_wait():
+            self._grant(tenant, weight)
+            return
+        future = asyncio.get_running_loop().create_future()
+        future.weight = weight
+        self._waiters.setdefault(tenant, deque()).append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._forget(tenant, future)
+            raise _too_many(f"Server busy: no free {self.name} slot within {timeout:g}s", timeout)
+        except asyncio.CancelledError:
+            # Client gone: hand back a slot granted in the same loop iteration
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._forget(tenant, future)
+            raise
+
+    def _forget(self, tenant: str, future: asyncio.Future):
+        queue = self._waiters.get(tenant)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self._waiters[tenant]
+
+    def release(self):
+        self.in_use -= 1
+        self._dispatch()
+        if self.in_use == 0 and not self._waiters:
+            # Idle: the busy period is over and nobody is owed anything
+            self._vtime.clear()
+        elif len(self._vtime) >= VTIME_PRUNE_AT:
+            # max(vtime, clock) == clock once the clock has passed a tenant: same as no entry
+            self._vtime = {t: v for t, v in self._vtime.items() if v > self.clock or t in self._waiters}
+
+    def stats(self) -> Dict[str, int]:
+        return {"capacity": self.capacity, "in_use": self.in_use, "queued": self.queued}
+
+
+class AdmissionController:
+    def __init__(self, enabled: bool = ADMISSION_ENABLED,
+                 tenant_rate: float = ADMISSION_TENANT_RATE, tenant_burst: float = ADMISSION_TENANT_BURST,
+                 user_rate: float = ADMISSION_USER_RATE, user_burst: float = ADMISSION_USER_BURST,
+                 max_queue: int = ADMISSION_MAX_QUEUE, max_wait: float = ADMISSION_MAX_WAIT_SECONDS,
+                 weights: Optional[Dict[str, float]] = None):
+        self.enabled = enabled
+        self.tenant_buckets = TokenBuckets(tenant_rate, tenant_burst)
+        self.user_buckets = TokenBuckets(user_rate, user_burst)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.weights = _parse_weights(ADMISSION_TENANT_WEIGHTS) if weights is None else weights
+        self.pools: Dict[str, FairPool] = {
+            INGEST_POOL: FairPool(INGEST_POOL, ADMISSION_INGEST_CONCURRENCY),
+            PREPARE_POOL: FairPool(PREPARE_POOL, ADMISSION_PREPARE_CONCURRENCY),
+        }
+
+    def configure(self, policies: Dict):
+        """Creates / resizes the per-mode pools from policies.yaml (modes[].max_concurrency)."""
+        for mode in policies.get("modes", []):
+            capacity = int(mode.get("max_concurrency") or DEFAULT_MODE_CONCURRENCY)
+            pool = self.pools.get(mode["id"])
+            if pool is None:
+                self.pools[mode["id"]] = FairPool(mode["id"], capacity)
+            else:
+                pool.capacity = capacity
+                pool._dispatch()
+
+    def pool(self, name: str) -> FairPool:
+        if name not in self.pools:
+            self.pools[name] = FairPool(name, DEFAULT_MODE_CONCURRENCY)
+        return self.pools[name]
+
+    def admit(self, tenant_id: str, user_id: str):
+        """Door check: token buckets and queue length. Raises HTTPException(429)."""
+        if not self.enabled:
+            return
+        if sum(p.queued for p in self.pools.values()) >= self.max_queue:
+            raise _too_many("Server busy: too many queued requests", 1)
+        wait = self.tenant_buckets.take(tenant_id)
+        if wait:
+            raise _too_many(f"Rate limit exceeded for tenant {tenant_id}", wait)
+        wait = self.user_buckets.take(f"{tenant_id}/{user_id}")
+        if wait:
+            raise _too_many("Rate limit exceeded for user", wait)
+
+    @asynccontextmanager
+    async def slot(self, pool_name: str, tenant_id: str, waited: Optional[Dict[str, float]] = None):
+        """
+        Holds one slot of the pool. waited["queue_wait_ms"] receives the time spent queued.
+        Raises HTTPException(429) after max_wait.
+        """
+        if not self.enabled:
+            yield
+            return
+        pool = self.pool(pool_name)
+        started = time.perf_counter()
+        await pool.acquire(tenant_id, self.weights.get(tenant_id, 1.0), self.max_wait)
+        if waited is not None:
+            waited["queue_wait_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        try:
+            yield
+        finally:
+            pool.release()
+
+    def would_wait(self, pool_name: str) -> bool:
+        return self.enabled and self.pool(pool_name).would_wait()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+ADMISSION = AdmissionController()
@@ -1,15 +1,100 @@
 from fastapi import HTTPException, Depends, Cookie
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+from collections import OrderedDict
+import os
+import threading
+import time
 import jwt
 from datetime import datetime, timedelta
-from sqlmodel import Session, select
-from logging_db import get_session
-from models import TenantMember, User
+from logging_db import get_membership_async
 
 SECRET_KEY = "mock-secret-key-for-dev-only"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 1 day
 
+# In-process auth caches: verified tokens live until their "exp",
+# memberships for a short TTL so role changes propagate even without invalidation.
+# 0 = no membership cache (every request reads TenantMember)
+MEMBERSHIP_CACHE_TTL_SECONDS = float(os.getenv("AUTH_MEMBERSHIP_CACHE_TTL_SECONDS", "60"))
+MEMBERSHIP_CACHE_MAX_ENTRIES = 4096
+TOKEN_CACHE_MAX_ENTRIES = 4096
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache whose entries expire at a per-entry deadline.
+    FastAPI runs sync dependencies in the threadpool, so access is guarded by a lock.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any, ttl_seconds: float):
+        if ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard_where(self, predicate) -> int:
+        with self._lock:
+            stale = [k for k in self._data if predicate(k)]
+            for k in stale:
+                del self._data[k]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_TOKEN_CACHE = TTLCache(TOKEN_CACHE_MAX_ENTRIES)
+# Nothing in the app edits TenantMember / User rows after seeding, so nothing invalidates this
+# cache: a membership removed or changed in the database (admin tooling, another worker) keeps
+# working with its old role for up to MEMBERSHIP_CACHE_TTL_SECONDS in every worker that cached it.
+# Denials are not cached, so granted access is immediate.
+_MEMBERSHIP_CACHE = TTLCache(MEMBERSHIP_CACHE_MAX_ENTRIES)
+
+
+def invalidate_membership_cache(user_id: Optional[str] = None, tenant_id: Optional[str] = None) -> int:
+    """
+    Drops cached memberships of this process. Code that changes TenantMember/User rows
+    must call it (other workers still see the change only after the TTL).
+    With no arguments the whole cache is cleared.
+    Returns the number of evicted entries.
+    """
+    if user_id is None and tenant_id is None:
+        count = len(_MEMBERSHIP_CACHE)
+        _MEMBERSHIP_CACHE.clear()
+        return count
+    return _MEMBERSHIP_CACHE.discard_where(
+        lambda key: (user_id is None or key[0] == user_id) and (tenant_id is None or key[1] == tenant_id)
+    )
+
+
+def invalidate_token_cache():
+    """Drops all cached token verifications (e.g. after rotating SECRET_KEY)."""
+    _TOKEN_CACHE.clear()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -23,41 +108,48 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 def get_current_user_id(access_token: Optional[str] = Cookie(None)) -> str:
     if not access_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
+
+    # Signature already verified for this exact token -> skip HMAC + JSON decode
+    cached_user_id = _TOKEN_CACHE.get(access_token)
+    if cached_user_id is not None:
+        return cached_user_id
+
     try:
         payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
+        exp = payload.get("exp")
+        if exp is not None:
+            # Cache until the token expires (wall clock -> monotonic TTL)
+            _TOKEN_CACHE.set(access_token, user_id, float(exp) - time.time())
         return user_id
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def get_current_context(
+async def get_current_context(
     tenant_id: str,
-    user_id: str = Depends(get_current_user_id),
-    session: Session = Depends(get_session)
+    user_id: str = Depends(get_current_user_id)
 ) -> Dict[str, Any]:
     """
     Verifies that the authenticated user is a member of the requested tenant.
     Returns context dict with user_id, tenant_id, role, and display_name.
+    Memberships are served from an in-process TTL cache; the DB is only hit on a miss.
     """
-    # Verify membership
-    statement = select(TenantMember).where(
-        TenantMember.tenant_id == tenant_id,
-        TenantMember.user_id == user_id
-    )
-    member = session.exec(statement).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Access to tenant denied")
-    
-    # Get user details for display name
-    user = session.get(User, user_id)
-    
+    key = (user_id, tenant_id)
+    membership = _MEMBERSHIP_CACHE.get(key)
+    if membership is None:
+        membership = await get_membership_async(tenant_id, user_id)
+        if not membership:
+            # Denials are not cached so that newly granted access works immediately
+            raise HTTPException(status_code=403, detail="Access to tenant denied")
+        _MEMBERSHIP_CACHE.set(key, membership, MEMBERSHIP_CACHE_TTL_SECONDS)
+
     return {
         "user_id": user_id,
         "tenant_id": tenant_id,
-        "role": member.role,
-        "display_name": user.display_name if user else user_id
+        "role": membership["role"],
+        "display_name": membership["display_name"]
     }
@@ -0,0 +1,390 @@
+"""
+Asynchronous batch chat jobs (nightly classification / summarization runs).
+
+POST /tenants/{tenant_id}/chat/batch takes a JSONL file, one prompt per line:
+
+    {"id": "ticket-1", "message": "Classify this ticket: ..."}
+    {"message": "Summarize: ..."}                 # id defaults to the line number
+
+and returns a job id right away. Each prompt goes through the same pipeline as /chat
+(PII scan, domain / mode / model routing, RAG retrieval, context packing, output PII
+masking) and is logged as a normal Log row; there is no NDJSON stream per prompt.
+
+- BATCH_WORKERS prompts per job are in flight at once, and BATCH_CONCURRENCY across all
+  jobs: a weighted-fair pool over tenants (admission.FairPool, ADMISSION_TENANT_WEIGHTS),
+  held while a prompt runs (PII analysis and retrieval on the threadpool, then the LLM
+  call), but not while it waits for its model's slot (below). Batch prompts wait in this pool without a time limit and are not counted against
+  ADMISSION_MAX_QUEUE, so a queued nightly run never turns /chat requests into 429s.
+- LLM calls are capped per model across all jobs (BATCH_MODEL_CONCURRENCY,
+  e.g. "google:gemini-2.5-pro=2,google:gemini-2.5-flash=8"; other models get
+  BATCH_DEFAULT_MODEL_CONCURRENCY). Batch traffic does not take slots from the interactive
+  mode pools (admission.py), so a nightly run cannot push /chat users into 429s.
+- A failed prompt is retried BATCH_MAX_RETRIES times with exponential backoff.
+- Results are appended to a JSONL file in BATCH_OUTPUT_DIR as prompts finish (completion
+  order; "line" gives the input position), served by GET .../chat/batch/{job_id}/output.
+
+Job state is kept in memory (bounded history; the output file of an evicted job is deleted)
+and exposed through GET /tenants/{tenant_id}/chat/batch/{job_id}.
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from admission import ADMISSION, FairPool
+from chat_pipeline import build_log_entry, reply_meta, route, stream_reply
+from context_packer import get_context_budget, pack_context
+from governance_kernel import detect_pii
+from logging_db import insert_log_entry_async
+from metrics import StageTimer
+from output_shield import OutputShield
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MODEL_CONCURRENCY = os.getenv("BATCH_MODEL_CONCURRENCY", "")
+BATCH_DEFAULT_MODEL_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_MODEL_CONCURRENCY", "4"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "2"))
+BATCH_RETRY_BACKOFF_SECONDS = float(os.getenv("BATCH_RETRY_BACKOFF_SECONDS", "1.0"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(20 * 1024 * 1024)))
+BATCH_JOB_HISTORY = int(os.getenv("BATCH_JOB_HISTORY", "100"))
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", str(Path(__file__).parent / ".batch_jobs"))
+BATCH_RAG_CANDIDATES = int(os.getenv("RAG_CONTEXT_CANDIDATES", "6"))
+# Only these jobs may be evicted from the history (with their output file) to make room
+FINISHED_STATUSES = ("completed", "failed", "completed_with_errors")
+
+
+class PermanentBatchError(Exception):
+    """A prompt-level failure that retrying cannot fix."""
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in filter(None, (p.strip() for p in spec.split(","))):
+        model, _, limit = item.rpartition("=")
+        limits[model.strip()] = int(limit)
+    return limits
+
+
+def parse_batch_lines(data: bytes) -> Tuple[List[Dict[str, Any]], List[Optional[str]]]:
+    """
+    JSONL -> (items, messages). Blank lines are skipped; a malformed line becomes an
+    item that is already "failed" (message None) instead of rejecting the whole file.
+    """
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Batch file must be UTF-8 JSONL")
+    items, messages = [], []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        item_id, message, error = str(line_no), None, None
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            error = f"Invalid JSON: {e.msg}"
+        else:
+            if not isinstance(record, dict):
+                error = "Line must be a JSON object"
+            else:
+                item_id = str(record.get("id", item_id))
+                message = record.get("message")
+                if not isinstance(message, str) or not message.strip():
+                    message, error = None, "Missing message"
+        items.append({
+            "id": item_id,
+            "line": line_no,
+            "status": "failed" if error else "queued",
+            "attempts": 0,
+            "mode": None,
+            "model": None,
+            "latency_ms": None,
+            "error": error,
+        })
+        messages.append(message)
+        if len(items) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Too many prompts (limit {BATCH_MAX_ITEMS})")
+    return items, messages
+
+
+class BatchJobManager:
+    def __init__(self, policies: Dict, shield_rules: List, retriever=None,
+                 output_dir: str = BATCH_OUTPUT_DIR, workers: int = BATCH_WORKERS,
+                 concurrency: int = BATCH_CONCURRENCY, model_limits: Optional[Dict[str, int]] = None,
+                 max_retries: int = BATCH_MAX_RETRIES):
+        self.policies = policies
+        self.shield_rules = shield_rules
+        self.retriever = retriever
+        self.output_dir = Path(output_dir)
+        self.workers = max(1, workers)
+        # Prompts in flight across all jobs, shared fairly between tenants
+        self.pool = FairPool("batch", max(1, concurrency))
+        self.model_limits = _parse_limits(BATCH_MODEL_CONCURRENCY) if model_limits is None else model_limits
+        self.max_retries = max_retries
+        self._model_slots: Dict[str, asyncio.Semaphore] = {}
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tasks = set()
+
+    # --- Public API ---
+
+    async def submit(self, tenant_id: str, user_id: str, file: UploadFile) -> Dict[str, Any]:
+        data = await file.read(BATCH_MAX_BYTES + 1)
+        if len(data) > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Batch file too large (limit {BATCH_MAX_BYTES} bytes)")
+        items, messages = parse_batch_lines(data)
+        if not items:
+            raise HTTPException(status_code=400, detail="No prompts in batch file")
+        self._make_room()
+
+        job_id = str(uuid.uuid4())
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        job = {
+            "job_id": job_id,
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "status": "queued",
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "started_at": None,
+            "finished_at": None,
+            "started": None,
+            "finished": None,
+            "output_path": self.output_dir / f"{job_id}.jsonl",
+            "items": items,
+        }
+        self._jobs[job_id] = job
+
+        task = asyncio.create_task(self._run(job, messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return self._view(job)
+
+    def _make_room(self):
+        """Evicts the oldest finished jobs down to BATCH_JOB_HISTORY - 1; queued / running jobs are never evicted."""
+        for job_id in [j for j, job in self._jobs.items() if job["status"] in FINISHED_STATUSES]:
+            if len(self._jobs) < BATCH_JOB_HISTORY:
+                break
+            self._jobs.pop(job_id)["output_path"].unlink(missing_ok=True)
+        if len(self._jobs) >= BATCH_JOB_HISTORY:
+            raise HTTPException(
+                status_code=429,
+                detail=f"{len(self._jobs)} batch jobs are still running (limit {BATCH_JOB_HISTORY})",
+                headers={"Retry-After": "60"},
+            )
+
+    def get_job(self, tenant_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is None or job["tenant_id"] != tenant_id:
+            return None
+        return self._view(job, include_items=True)
+
+    def list_jobs(self, tenant_id: str) -> List[Dict[str, Any]]:
+        return [self._view(job) for job in reversed(self._jobs.values()) if job["tenant_id"] == tenant_id]
+
+    def output_path(self, tenant_id: str, job_id: str) -> Optional[Path]:
+        job = self._jobs.get(job_id)
+        if job is None or job["tenant_id"] != tenant_id or not job["output_path"].exists():
+            return None
+        return job["output_path"]
+
+    # --- Internals ---
+
+    def _model_limit(self, model: str) -> int:
+        return self.model_limits.get(model, BATCH_DEFAULT_MODEL_CONCURRENCY)
+
+    @asynccontextmanager
+    async def _batch_slot(self, tenant_id: str):
+        await self.pool.acquire(tenant_id, ADMISSION.weights.get(tenant_id, 1.0), timeout=None)
+        try:
+            yield
+        finally:
+            self.pool.release()
+
+    def _model_slot(self, model: str) -> asyncio.Semaphore:
+        if model not in self._model_slots:
+            self._model_slots[model] = asyncio.Semaphore(self._model_limit(model))
+        return self._model_slots[model]
+
+    async def _run(self, job: Dict[str, Any], messages: List[Optional[str]]):
+        job["status"] = "running"
+        job["started_at"] = datetime.utcnow().isoformat() + "Z"
+        job["started"] = time.monotonic()
+        out = open(job["output_path"], "a", encoding="utf-8")
+        try:
+            # Lines rejected while parsing are in the output too, so it accounts for every input line
+            for entry in job["items"]:
+                if entry["status"] == "failed":
+                    self._write_result(out, entry)
+            pending = iter([(e, m) for e, m in zip(job["items"], messages) if e["status"] != "failed"])
+
+            async def worker():
+                # One shared iterator: each worker takes the next prompt when it is free
+                for entry, message in pending:
+                    await self._process_item(job, entry, message, out)
+
+            await asyncio.gather(*(worker() for _ in range(min(self.workers, len(job["items"])))))
+        finally:
+            out.close()
+            failed = sum(1 for e in job["items"] if e["status"] == "failed")
+            if failed == 0:
+                job["status"] = "completed"
+            elif failed == len(job["items"]):
+                job["status"] = "failed"
+            else:
+                job["status"] = "completed_with_errors"
+            job["finished_at"] = datetime.utcnow().isoformat() + "Z"
+            job["finished"] = time.monotonic()
+
+    async def _process_item(self, job: Dict[str, Any], entry: Dict[str, Any], message: str, out):
+        result = None
+        for attempt in range(1, self.max_retries + 2):
+            entry["attempts"] = attempt
+            try:
+                result = await self._answer(job, entry, message)
+                entry["status"] = "completed"
+                entry["error"] = None
+                break
+            except (PermanentBatchError, HTTPException) as e:
+                entry["error"] = getattr(e, "detail", None) or str(e)
+                break
+            except Exception as e:
+                entry["error"] = str(e)
+                if attempt <= self.max_retries:
+                    entry["status"] = "retrying"
+                    await asyncio.sleep(BATCH_RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+        if entry["status"] != "completed":
+            entry["status"] = "failed"
+            print(f"[WARN] Batch job {job['job_id']}: item {entry['id']} failed: {entry['error']}")
+            await self._log_failure(job, entry, message)
+        self._write_result(out, entry, result)
+
+    async def _answer(self, job: Dict[str, Any], entry: Dict[str, Any], message: str) -> Dict[str, Any]:
+        """One prompt through the /chat pipeline (chat_pipeline.py); returns the fields of its output line."""
+        tenant_id = job["tenant_id"]
+        start = time.time()
+        timer = StageTimer()
+
+        async def retrieve():
+            if not self.retriever:
+                return [], {}
+            timings = {}
+            with timer.span("retrieval"):
+                docs = await run_in_threadpool(
+                    self.retriever.search, tenant_id, message, n_results=BATCH_RAG_CANDIDATES, timings=timings
+                )
+            return docs, timings
+
+        async with self._batch_slot(tenant_id):
+            entry["status"] = "running"
+            rag_task = asyncio.create_task(retrieve())
+            try:
+                with timer.span("pii"):
+                    pii = await run_in_threadpool(detect_pii, message)
+                mode, model, system_prompt = route(message, self.policies, pii)
+                entry["mode"], entry["model"] = mode, model
+                context_docs, retrieval_timings = await rag_task
+            finally:
+                rag_task.cancel()
+
+            with timer.span("pack"):
+                packed = pack_context(system_prompt, message, context_docs, [], get_context_budget(mode, self.policies))
+        packed["stats"]["retrieval_ms"] = retrieval_timings
+        packed["stats"]["batch"] = {"job_id": job["job_id"], "item_id": entry["id"], "attempt": entry["attempts"]}
+
+        # Per-model cap across all jobs, waited for without a batch slot: prompts queued for a saturated
+        # model must not keep prompts for other models out of the pool. The batch slot is taken again
+        # for the call itself; both waits are recorded like the interactive queue wait.
+        waited = time.perf_counter()
+        async with self._model_slot(model), self._batch_slot(tenant_id):
+            queue_wait_ms = (time.perf_counter() - waited) * 1000
+            timer.add("queue_wait", queue_wait_ms)
+            shield = OutputShield(self.shield_rules)
+            reply = "".join([chunk async for chunk in stream_reply(model, packed, shield, timer, raise_on_error=True)])
+        output_masked = shield.stats()
+        total_ms = int((time.time() - start) * 1000)
+        entry["latency_ms"] = total_ms
+
+        await insert_log_entry_async(build_log_entry(
+            job["user_id"], tenant_id, mode, model, self.policies, pii, total_ms, message, reply,
+            packed=packed, output_masked=output_masked, timer=timer, queue_wait_ms=queue_wait_ms,
+        ))
+        return reply_meta(reply, mode, model, self.policies, pii, total_ms, packed, round(queue_wait_ms, 3), output_masked, timer)
+
+    async def _log_failure(self, job: Dict[str, Any], entry: Dict[str, Any], message: str):
+        # Failed prompts are logged too (empty output), so the audit log covers the whole batch
+        try:
+            log_entry = build_log_entry(
+                job["user_id"], job["tenant_id"], entry["mode"] or "UNKNOWN", entry["model"] or "", self.policies, {},
+                0, message, "", extra_flags=["batch_failed"],
+            )
+            log_entry.context_stats = {"batch": {"job_id": job["job_id"], "item_id": entry["id"], "error": entry["error"]}}
+            await insert_log_entry_async(log_entry)
+        except Exception as e:
+            print(f"[WARN] Batch job {job['job_id']}: could not log item {entry['id']}: {e}")
+
+    @staticmethod
+    def _write_result(out, entry: Dict[str, Any], result: Optional[Dict[str, Any]] = None):
+        record = {
+            "id": entry["id"],
+            "line": entry["line"],
+            "status": entry["status"],
+            "mode": entry["mode"],
+            "model": entry["model"],
+            "attempts": entry["attempts"],
+            "latency_ms": entry["latency_ms"],
+        }
+        if result is not None:
+            record.update(result)
+        else:
+            record["error"] = entry["error"]
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    def _view(self, job: Dict[str, Any], include_items: bool = False) -> Dict[str, Any]:
+        items = job["items"]
+        total = len(items)
+        statuses = Counter(e["status"] for e in items)
+        done = statuses["completed"] + statuses["failed"]
+        elapsed = 0.0
+        if job["started"] is not None:
+            elapsed = (job["finished"] or time.monotonic()) - job["started"]
+        latencies = [e["latency_ms"] for e in items if e["latency_ms"] is not None]
+        view = {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "progress": {
+                "total": total,
+                "completed": statuses["completed"],
+                "failed": statuses["failed"],
+                "running": statuses["running"] + statuses["retrying"],
+                "pending": total - done,
+                "retries": sum(max(e["attempts"] - 1, 0) for e in items),
+                "percent": round(100.0 * done / total, 1) if total else 100.0,
+            },
+            "throughput": {
+                "elapsed_seconds": round(elapsed, 3),
+                "items_per_second": round(done / elapsed, 2) if elapsed > 0 else 0.0,
+                "avg_latency_ms": round(sum(latencies) / len(latencies)) if latencies else None,
+            },
+            "models": dict(Counter(e["model"] for e in items if e["model"])),
+        }
+        if include_items:
+            view["items"] = [dict(e) for e in items]
+        else:
+            view["errors"] = [
+                {"id": e["id"], "line": e["line"], "error": e["error"]} for e in items if e["status"] == "failed"
+            ]
+        return view
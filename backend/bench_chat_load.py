@@ -0,0 +1,362 @@
+"""
+Load test for the streaming chat endpoint (POST /tenants/{tenant_id}/chat).
+
+By default a stubbed server is started as a subprocess (uvicorn, one worker, temp working dir):
+- the LLM is replaced by a fake stream (--llm-ttft-ms before the first chunk,
+  --llm-chunks chunks, --llm-delay-ms between them)
+- embeddings use the local backend and vectors the mmap index, so no API key is needed
+- the SQLite DB, keyword index and vector index live in the temp dir; tests/test_data
+  is ingested first so retrieval has something to search
+Use --url to load an already running server instead (real providers, real data).
+
+Clients log in through /auth/mock-login (one cookie jar per --users entry) and send
+a weighted mix of message kinds:
+    plain  a question only
+    pii    a question containing a name, phone number and e-mail address
+    file   a question with a text attachment (--attachment-kb)
+
+    python bench_chat_load.py --concurrency 16 --requests 400
+    python bench_chat_load.py --mix plain=6,pii=2,file=2 --json > chat_load.json
+    python bench_chat_load.py --url http://localhost:8000 --concurrency 4 --requests 40
+
+Reported per kind and overall: throughput, time to the first NDJSON line (status event),
+time to the first "chunk" event, total latency (p50 / p95 / p99), errors, and the
+server-side stage timings from the "complete" event (JSON output only).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+BASE_DIR = Path(__file__).parent
+TEST_DATA_DIR = BASE_DIR / "tests" / "test_data"
+
+PLAIN_MESSAGES = [
+    "交通費の上限はいくらですか？",
+    "パスワードのルールを教えてください。",
+    "デプロイ失敗時のエラーコードは何ですか？",
+    "接待費の申請手順を簡単にまとめてください。",
+    "What is the travel expense limit for sales staff?",
+]
+PII_MESSAGE = "私の名前は山田太郎です。電話番号は090-1234-5678、メールは taro.yamada@example.com です。経費精算の締め日を教えてください。"
+FILE_MESSAGE = "添付した議事録の要点を3つにまとめてください。"
+MESSAGE_KINDS = ("plain", "pii", "file")
+
+
+# --- Stubbed server (subprocess) ---
+
+def serve(port: int, llm_ttft_ms: float, llm_chunks: int, llm_delay_ms: float):
+    """Runs main.app under uvicorn with a fake LLM; data goes to the current directory."""
+    workdir = Path.cwd()
+    os.environ["GEMINI_API_KEY"] = os.environ.get("GEMINI_API_KEY") or "bench-dummy-key"
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'bench_governance.db'}"
+    os.environ["RAG_EMBEDDING_BACKEND"] = "local"
+    os.environ["RAG_VECTOR_BACKEND"] = "mmap"
+    os.environ["RAG_VECTOR_INDEX_DIR"] = str(workdir / "vector_index")
+    os.environ["RAG_LOCAL_EMBEDDING_STATS"] = str(workdir / "local_embedding_df.npz")
+    os.environ["EXTRACTION_CACHE_DIR"] = str(workdir / "extraction_cache")
+    # Few bench users send far more than a real user would: keep the concurrency caps, drop the rate limits
+    os.environ.setdefault("ADMISSION_TENANT_RATE", "0")
+    os.environ.setdefault("ADMISSION_USER_RATE", "0")
+    sys.path.insert(0, str(BASE_DIR))
+
+    import uvicorn
+    import chat_pipeline
+    import main
+
+    async def fake_llm_stream(model_id: str, system_prompt: str, user_message: str):
+        if llm_ttft_ms:
+            await asyncio.sleep(llm_ttft_ms / 1000)
+        for i in range(llm_chunks):
+            if i and llm_delay_ms:
+                await asyncio.sleep(llm_delay_ms / 1000)
+            yield f"[stub {model_id}] chunk {i}. "
+
+    chat_pipeline.call_llm_stream = fake_llm_stream
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub_server(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench_chat_")
+    port = free_port()
+    log = open(os.path.join(workdir, "server.log"), "w")
+    proc = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "--serve", "--port", str(port),
+         "--llm-ttft-ms", str(args.llm_ttft_ms), "--llm-chunks", str(args.llm_chunks),
+         "--llm-delay-ms", str(args.llm_delay_ms)],
+        cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+    )
+    return {"proc": proc, "workdir": workdir, "log": log, "url": f"http://127.0.0.1:{port}"}
+
+
+def stop_stub_server(server: Dict[str, Any]):
+    server["proc"].terminate()
+    try:
+        server["proc"].wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server["proc"].kill()
+    server["log"].close()
+    shutil.rmtree(server["workdir"], ignore_errors=True)
+
+
+async def wait_ready(client, url: str, timeout: float, server: Optional[Dict[str, Any]] = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server and server["proc"].poll() is not None:
+            break
+        try:
+            if (await client.get(f"{url}/openapi.json")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    if server:
+        server["log"].flush()
+        print(Path(server["workdir"], "server.log").read_text()[-4000:], file=sys.stderr)
+    raise RuntimeError(f"server at {url} did not become ready")
+
+
+# --- Load generation ---
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in MESSAGE_KINDS:
+            raise SystemExit(f"unknown message kind '{kind}' (choose from {', '.join(MESSAGE_KINDS)})")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def make_attachment(kb: int) -> bytes:
+    line = "議事録: 来期の営業経費は交通費の上限を見直し、接待費は事前申請を必須とする。セキュリティ研修は年2回実施。\n"
+    text = ""
+    while len(text.encode("utf-8")) < kb * 1024:
+        text += line
+    return text.encode("utf-8")
+
+
+def build_request(kind: str, n: int, attachment: bytes) -> Dict[str, Any]:
+    if kind == "pii":
+        return {"data": {"message": PII_MESSAGE}}
+    if kind == "file":
+        return {"data": {"message": FILE_MESSAGE}, "files": [("files", ("minutes.txt", attachment, "text/plain"))]}
+    return {"data": {"message": PLAIN_MESSAGES[n % len(PLAIN_MESSAGES)]}}
+
+
+async def login(httpx, url: str, user_id: str, tenant_id: str, timeout: float):
+    client = httpx.AsyncClient(base_url=url, timeout=timeout)
+    resp = await client.post("/auth/mock-login", json={"user_id": user_id, "tenant_id": tenant_id})
+    resp.raise_for_status()
+    return client
+
+
+async def seed_documents(client, tenant_id: str):
+    for path in sorted(TEST_DATA_DIR.iterdir()):
+        resp = await client.post(f"/tenants/{tenant_id}/ingest", files={"file": (path.name, path.read_bytes())})
+        if resp.status_code != 200 or "error" in resp.json():
+            print(f"WARNING: seeding {path.name} failed: {resp.status_code} {resp.text[:200]}", file=sys.stderr)
+
+
+async def one_request(client, tenant_id: str, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    result = {"kind": kind, "ok": False, "status": None, "ttfl_ms": None, "ttfc_ms": None, "total_ms": None,
+              "error": None, "server_timings": None}
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", f"/tenants/{tenant_id}/chat", **request) as resp:
+            result["status"] = resp.status_code
+            if resp.status_code != 200:
+                await resp.aread()
+                result["error"] = f"HTTP {resp.status_code}"
+                return result
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                elapsed = (time.perf_counter() - started) * 1000
+                if result["ttfl_ms"] is None:
+                    result["ttfl_ms"] = elapsed
+                event = json.loads(line)
+                if event.get("type") == "chunk" and result["ttfc_ms"] is None:
+                    result["ttfc_ms"] = elapsed
+                elif event.get("type") == "error":
+                    result["error"] = event.get("content", "error event")
+                elif event.get("type") == "complete":
+                    result["ok"] = result["error"] is None
+                    # Per-stage server timings (metrics.StageTimer), absent when METRICS_ENABLED=0
+                    result["server_timings"] = event.get("meta", {}).get("timings")
+        if not result["ok"] and result["error"] is None:
+            result["error"] = "stream ended without a complete event"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        result["total_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
+
+
+def summarize(results: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    ok = [r for r in results if r["ok"]]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"][:120]] = errors.get(r["error"][:120], 0) + 1
+    stages: Dict[str, List[float]] = {}
+    for r in ok:
+        for stage, ms in (r["server_timings"] or {}).items():
+            stages.setdefault(stage, []).append(ms)
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        "throughput_rps": round(len(ok) / wall_s, 2) if wall_s else None,
+        "ttfl_ms": percentiles([r["ttfl_ms"] for r in ok]),
+        "ttfc_ms": percentiles([r["ttfc_ms"] for r in ok if r["ttfc_ms"] is not None]),
+        "total_ms": percentiles([r["total_ms"] for r in ok]),
+        "server_stage_ms": {stage: percentiles(values) for stage, values in stages.items()},
+        "error_samples": errors,
+    }
+
+
+async def run_load(args) -> Dict[str, Any]:
+    import httpx
+
+    server = None if args.url else start_stub_server(args)
+    url = args.url or server["url"]
+    clients = []
+    try:
+        async with httpx.AsyncClient(timeout=5) as probe:
+            await wait_ready(probe, url, args.startup_timeout, server)
+
+        users = [u.strip() for u in args.users.split(",") if u.strip()]
+        clients = [await login(httpx, url, u, args.tenant, args.timeout) for u in users]
+        if server and not args.no_seed:
+            await seed_documents(clients[0], args.tenant)
+
+        mix = parse_mix(args.mix)
+        rng = random.Random(args.seed)
+        attachment = make_attachment(args.attachment_kb)
+        kinds = rng.choices(list(mix), weights=list(mix.values()), k=args.warmup + args.requests)
+        plan = [(kind, build_request(kind, n, attachment)) for n, kind in enumerate(kinds)]
+
+        async def drive(items) -> List[Dict[str, Any]]:
+            queue: asyncio.Queue = asyncio.Queue()
+            for n, item in enumerate(items):
+                queue.put_nowait((n, item))
+            results: List[Dict[str, Any]] = []
+
+            async def worker():
+                while True:
+                    try:
+                        n, (kind, request) = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    results.append(await one_request(clients[n % len(clients)], args.tenant, kind, request))
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            return results
+
+        # Warm-up: model loading, first mmap, connection setup
+        await drive(plan[:args.warmup])
+        started = time.perf_counter()
+        results = await drive(plan[args.warmup:])
+        wall_s = time.perf_counter() - started
+    finally:
+        for c in clients:
+            await c.aclose()
+        if server:
+            stop_stub_server(server)
+
+    return {
+        "config": {
+            "url": args.url or "stub",
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "mix": mix,
+            "users": users,
+            "tenant": args.tenant,
+            "attachment_kb": args.attachment_kb,
+            "llm": None if args.url else {
+                "ttft_ms": args.llm_ttft_ms, "chunks": args.llm_chunks, "chunk_delay_ms": args.llm_delay_ms
+            },
+        },
+        "wall_seconds": round(wall_s, 3),
+        "overall": summarize(results, wall_s),
+        "by_kind": {k: summarize([r for r in results if r["kind"] == k], wall_s) for k in mix},
+    }
+
+
+def print_table(report: Dict[str, Any]):
+    print(f"concurrency={report['config']['concurrency']} requests={report['config']['requests']} "
+          f"wall={report['wall_seconds']}s")
+    print("kind | ok | errors | rps | ttfl p50/p95/p99 ms | ttfc p50/p95/p99 ms | total p50/p95/p99 ms")
+    rows = [("overall", report["overall"])] + list(report["by_kind"].items())
+    for name, s in rows:
+        fmt = lambda p: "/".join(str(p[k]) for k in ("p50", "p95", "p99"))
+        print(f"{name} | {s['ok']} | {s['errors']} | {s['throughput_rps']} | "
+              f"{fmt(s['ttfl_ms'])} | {fmt(s['ttfc_ms'])} | {fmt(s['total_ms'])}")
+    for error, count in report["overall"]["error_samples"].items():
+        print(f"  error x{count}: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="target a running server instead of starting the stubbed one")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=8)
+    parser.add_argument("--mix", default="plain=6,pii=2,file=2", help="weighted message kinds, e.g. plain=6,pii=2,file=2")
+    parser.add_argument("--users", default="user-1,user-2", help="comma-separated mock-login user ids")
+    parser.add_argument("--tenant", default="tenant-a")
+    parser.add_argument("--attachment-kb", type=int, default=8)
+    parser.add_argument("--llm-ttft-ms", type=float, default=200.0, help="stub LLM: delay before the first chunk")
+    parser.add_argument("--llm-chunks", type=int, default=20, help="stub LLM: chunks per reply")
+    parser.add_argument("--llm-delay-ms", type=float, default=20.0, help="stub LLM: delay between chunks")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout (seconds)")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--no-seed", action="store_true", help="do not ingest tests/test_data into the stub server")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the message mix")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.llm_ttft_ms, args.llm_chunks, args.llm_delay_ms)
+        return
+
+    report = asyncio.run(run_load(args))
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Retrieval benchmark: quality and latency of HybridRetriever.search on tests/test_data.
+
+The fixtures (D1-D4 in tests/rag_test_documents.md) are ingested with the local
+embedder and the mmap vector index, so no network or API key is needed. The queries
+and expected documents are parsed from tests/rag_test_cases.md; negative cases
+(no relevant document) are listed but not scored.
+
+For each retrieval configuration it reports:
+- recall@k: share of the expected documents found in the top-k passages
+- MRR: 1 / rank of the first passage from an expected document
+- ingest throughput (chunks/s, chars/s) and per-query latency (p50 / p95, mean per stage)
+
+    python bench_retrieval.py
+    python bench_retrieval.py --configs default no-mmr chunk-400 --json
+    python bench_retrieval.py --configs "default" "custom:chunk_size=600,mmr_lambda=0.7"
+    python bench_retrieval.py --min-mrr 0.8      # exit 1 if any configuration scores lower
+
+Configuration keys: chunk_size, chunk_overlap, mmr (0/1), mmr_lambda, embedding_dim,
+vector_dtype (float32/int8), coarse_dim. "name:key=value,..." overrides the default preset.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+import file_parser
+import rag_kernel
+from extraction_cache import ExtractionCache
+from file_parser import extract_text_from_path, shutdown_process_pool
+from local_embeddings import LOCAL_EMBEDDING_DIM, LocalEmbeddingService
+from rag_kernel import HybridRetriever, chunk_text
+from vector_index import VECTOR_COARSE_DIM, VECTOR_DTYPE, MmapVectorStore
+
+BASE_DIR = Path(__file__).parent
+TESTS_DIR = BASE_DIR / "tests"
+TENANT = "bench"
+
+# The "default" preset is whatever the environment configures (RAG_CHUNK_SIZE, RAG_MMR_*, ...)
+DEFAULT_CONFIG = {
+    "chunk_size": rag_kernel.CHUNK_SIZE,
+    "chunk_overlap": rag_kernel.CHUNK_OVERLAP,
+    "mmr": int(rag_kernel.RAG_MMR_ENABLED),
+    "mmr_lambda": rag_kernel.RAG_MMR_LAMBDA,
+    "embedding_dim": LOCAL_EMBEDDING_DIM,
+    "vector_dtype": VECTOR_DTYPE,
+    "coarse_dim": VECTOR_COARSE_DIM,
+}
+PRESETS = {
+    "default": {},
+    "no-mmr": {"mmr": 0},
+    "mmr-0.7": {"mmr": 1, "mmr_lambda": 0.7},
+    "chunk-400": {"chunk_size": 400, "chunk_overlap": 50},
+    "chunk-1200": {"chunk_size": 1200, "chunk_overlap": 150},
+    "dim-512": {"embedding_dim": 512},
+    "int8": {"vector_dtype": "int8"},
+    "coarse-128": {"coarse_dim": 128},
+}
+
+
+# --- Fixtures ---
+
+def load_documents() -> Dict[str, str]:
+    """D1..D4 -> fixture filename, from the table in rag_test_documents.md."""
+    docs = {}
+    for line in (TESTS_DIR / "rag_test_documents.md").read_text(encoding="utf-8").splitlines():
+        m = re.match(r"\|\s*(D\d+)\s*\|\s*`([^`]+)`", line)
+        if m:
+            docs[m.group(1)] = m.group(2)
+    return docs
+
+
+def load_cases() -> List[Dict[str, Any]]:
+    """Test cases from the detail sections of rag_test_cases.md (### 2.x T-...)."""
+    text = (TESTS_DIR / "rag_test_cases.md").read_text(encoding="utf-8")
+    cases = []
+    for section in re.split(r"^### ", text, flags=re.M)[1:]:
+        case_id = re.match(r"[\d.]+\s+(T-[A-Z0-9-]+)", section)
+        query = re.search(r"入力クエリ:\s*\n\s*-\s*「(.+?)」", section)
+        if not case_id or not query:
+            continue
+        kind = re.search(r"種別:\s*(.+)", section).group(1)
+        expected = re.search(r"期待される挙動:\s*\n\s*1\.\s*(.+)", section).group(1)
+        negative = "ネガティブ" in kind
+        cases.append({
+            "id": case_id.group(1),
+            "query": query.group(1),
+            "relevant": [] if negative else re.findall(r"D\d+", expected)[:1],
+        })
+    return cases
+
+
+def extract_fixtures(documents: Dict[str, str]) -> Dict[str, str]:
+    async def extract_all():
+        texts = {}
+        for label, filename in documents.items():
+            path = TESTS_DIR / "test_data" / filename
+            if path.exists():
+                texts[label] = await extract_text_from_path(str(path), filename)
+            else:
+                print(f"WARNING: fixture {filename} not found", file=sys.stderr)
+        return texts
+    # Memory-only cache for the run: the fixtures are parsed every time and nothing is written
+    # to the server's EXTRACTION_CACHE_DIR
+    saved = file_parser.EXTRACTION_CACHE
+    file_parser.EXTRACTION_CACHE = ExtractionCache(None, memory_bytes=64 * 1024 * 1024, disk_bytes=0)
+    try:
+        return asyncio.run(extract_all())
+    finally:
+        file_parser.EXTRACTION_CACHE = saved
+        shutdown_process_pool()
+
+
+# --- Benchmark ---
+
+def parse_config(spec: str) -> Dict[str, Any]:
+    name, _, overrides = spec.partition(":")
+    if name not in PRESETS and not overrides:
+        raise SystemExit(f"unknown configuration '{name}' (presets: {', '.join(PRESETS)})")
+    config = {**DEFAULT_CONFIG, **PRESETS.get(name, {}), "name": name}
+    for item in filter(None, overrides.split(",")):
+        key, _, value = item.partition("=")
+        if key not in DEFAULT_CONFIG:
+            raise SystemExit(f"unknown configuration key '{key}'")
+        config[key] = type(DEFAULT_CONFIG[key])(value)
+    return config
+
+
+def build_retriever(config: Dict[str, Any], workdir: str) -> HybridRetriever:
+    # KeywordStore / DocumentCatalog / DedupIndex use relative paths: the caller chdirs into workdir
+    embedder = LocalEmbeddingService(dim=config["embedding_dim"], stats_path=os.path.join(workdir, "local_embedding_df.npz"))
+    store = MmapVectorStore(os.path.join(workdir, "vector_index"), dtype=config["vector_dtype"], coarse_dim=config["coarse_dim"])
+    saved = (rag_kernel.create_embedding_service, rag_kernel.create_vector_store)
+    rag_kernel.create_embedding_service = lambda api_key=None: embedder
+    rag_kernel.create_vector_store = lambda: store
+    try:
+        retriever = HybridRetriever()
+    finally:
+        rag_kernel.create_embedding_service, rag_kernel.create_vector_store = saved
+    retriever.chunk_document = lambda text: chunk_text(text, config["chunk_size"], config["chunk_overlap"])
+    return retriever
+
+
+def run_config(config: Dict[str, Any], fixtures: Dict[str, str], cases: List[Dict[str, Any]],
+               k_values: List[int], rounds: int) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    cwd = os.getcwd()
+    saved = (rag_kernel.RAG_MMR_ENABLED, rag_kernel.RAG_MMR_LAMBDA)
+    try:
+        os.chdir(workdir)
+        rag_kernel.RAG_MMR_ENABLED = bool(config["mmr"])
+        rag_kernel.RAG_MMR_LAMBDA = config["mmr_lambda"]
+        retriever = build_retriever(config, workdir)
+
+        # Passage text -> fixture labels (identical chunks may belong to several documents)
+        owners: Dict[str, set] = {}
+        chunks = 0
+        for label, text in fixtures.items():
+            for chunk in retriever.chunk_document(text):
+                owners.setdefault(chunk, set()).add(label)
+                chunks += 1
+
+        started = time.perf_counter()
+        for label, text in fixtures.items():
+            retriever.ingest_document(TENANT, text, metadata={"filename": label})
+        ingest_s = time.perf_counter() - started
+
+        n_results = max(k_values)
+        latencies: List[float] = []
+        stages: Dict[str, List[float]] = {}
+        per_case = []
+        for case in cases:
+            for _ in range(rounds):
+                timings: Dict[str, float] = {}
+                t = time.perf_counter()
+                passages = retriever.search(TENANT, case["query"], n_results=n_results, timings=timings)
+                latencies.append((time.perf_counter() - t) * 1000)
+                for stage, ms in timings.items():
+                    stages.setdefault(stage, []).append(ms)
+            ranked = [sorted(owners.get(p, {"?"})) for p in passages]
+            relevant = set(case["relevant"])
+            first_hit = next((i + 1 for i, labels in enumerate(ranked) if relevant & set(labels)), None)
+            per_case.append({
+                "id": case["id"],
+                "relevant": case["relevant"],
+                "ranked_docs": ["/".join(labels) for labels in ranked],
+                "reciprocal_rank": (1.0 / first_hit if first_hit else 0.0) if relevant else None,
+                **{f"recall_at_{k}": (len(relevant & {l for labels in ranked[:k] for l in labels}) / len(relevant)
+                                      if relevant else None) for k in k_values},
+            })
+
+        scored = [c for c in per_case if c["reciprocal_rank"] is not None]
+        return {
+            "config": config,
+            "chunks": chunks,
+            "ingest_seconds": round(ingest_s, 4),
+            "ingest_chunks_per_second": round(chunks / ingest_s, 1),
+            "ingest_chars_per_second": round(sum(map(len, fixtures.values())) / ingest_s, 1),
+            "queries_scored": len(scored),
+            "mrr": round(float(np.mean([c["reciprocal_rank"] for c in scored])), 4) if scored else None,
+            **{f"recall_at_{k}": round(float(np.mean([c[f"recall_at_{k}"] for c in scored])), 4) if scored else None
+               for k in k_values},
+            "search_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "search_p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            "stage_mean_ms": {s: round(float(np.mean(v)), 3) for s, v in stages.items()},
+            "cases": per_case,
+        }
+    finally:
+        rag_kernel.RAG_MMR_ENABLED, rag_kernel.RAG_MMR_LAMBDA = saved
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(configs: List[str], k_values: List[int], rounds: int) -> List[Dict[str, Any]]:
+    fixtures = extract_fixtures(load_documents())
+    cases = load_cases()
+    return [run_config(parse_config(spec), fixtures, cases, k_values, rounds) for spec in configs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", nargs="+", default=list(PRESETS))
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--rounds", type=int, default=20, help="searches per query (latency samples)")
+    parser.add_argument("--min-recall", type=float, help="fail if recall@<largest k> is below this")
+    parser.add_argument("--min-mrr", type=float, help="fail if MRR is below this")
+    parser.add_argument("--cases", action="store_true", help="also print the ranked documents per query")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.configs, sorted(args.k), args.rounds)
+    recall_key = f"recall_at_{max(args.k)}"
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        columns = ["chunks", "ingest_chunks_per_second", "mrr", *[f"recall_at_{k}" for k in sorted(args.k)],
+                   "search_p50_ms", "search_p95_ms"]
+        print(" | ".join(["config"] + columns))
+        for r in results:
+            print(" | ".join([r["config"]["name"]] + [str(r[c]) for c in columns]))
+            if args.cases:
+                for c in r["cases"]:
+                    print(f"    {c['id']}: expected {c['relevant'] or '-'} got {c['ranked_docs']}")
+
+    failed = [r["config"]["name"] for r in results
+              if (args.min_mrr is not None and (r["mrr"] or 0) < args.min_mrr)
+              or (args.min_recall is not None and (r[recall_key] or 0) < args.min_recall)]
+    if failed:
+        print(f"FAILED quality threshold: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark: ChromaVectorStore vs MmapVectorStore (float32 / int8, optionally two-stage).
+
+Synthetic clustered unit vectors stand in for embeddings (no API key needed).
+Their variance decays over the dimensions, like Matryoshka embeddings, so the
+truncated-prefix first pass of the two-stage search behaves realistically.
+Reports ingest time, search latency (p50 / p95) and recall@k against exact
+brute-force cosine search, plus on-disk size and the bytes scanned per query.
+
+    python bench_vector_store.py --rows 5000 --dim 768 --queries 200
+    python bench_vector_store.py --backends mmap-float32 mmap-float32@128 mmap-float32@256 --rows 50000
+    python bench_vector_store.py --backends mmap-float32 mmap-int8 --json
+
+Backend names: chroma, mmap-<float32|int8>[@<coarse dim>].
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import vector_index
+from vector_index import MmapVectorStore
+
+TENANT = "bench"
+
+
+def make_data(rows: int, dim: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    decay = np.geomspace(1.0, 0.1, dim)
+    centers = rng.normal(size=(max(rows // 50, 1), dim)) * decay
+    vectors = centers[rng.integers(len(centers), size=rows)] + 0.5 * rng.normal(size=(rows, dim)) * decay
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vecs = centers[rng.integers(len(centers), size=queries)] + 0.5 * rng.normal(size=(queries, dim)) * decay
+    query_vecs /= np.linalg.norm(query_vecs, axis=1, keepdims=True)
+    return vectors.astype(np.float32), query_vecs.astype(np.float32)
+
+
+def make_store(backend: str, path: str):
+    if backend == "chroma":
+        from rag_kernel import ChromaVectorStore
+        return ChromaVectorStore(path)
+    kind, _, coarse = backend.partition("@")
+    return MmapVectorStore(path, dtype=kind.split("-", 1)[1], coarse_dim=int(coarse or 0))
+
+
+def scanned_bytes_per_query(backend: str, rows: int, dim: int, k: int) -> int:
+    """Matrix bytes touched by one mmap search (page-cache footprint when hot)."""
+    if backend == "chroma":
+        return 0
+    kind, _, coarse = backend.partition("@")
+    full_row = dim * (1 if kind.endswith("int8") else 4)
+    if not coarse:
+        return rows * full_row
+    pool = min(rows, max(k * vector_index.VECTOR_RERANK_FACTOR, vector_index.VECTOR_RERANK_MIN))
+    return rows * int(coarse) * 4 + pool * full_row
+
+
+def dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def run_backend(backend: str, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, batch: int):
+    path = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+    try:
+        store = make_store(backend, path)
+        ids = [f"c{i}" for i in range(len(vectors))]
+
+        started = time.perf_counter()
+        for start in range(0, len(vectors), batch):
+            end = start + batch
+            store.add_documents(
+                TENANT, [f"doc {i}" for i in range(start, min(end, len(vectors)))],
+                [{"n": i} for i in range(start, min(end, len(vectors)))],
+                ids[start:end], vectors[start:end].tolist()
+            )
+        ingest_s = time.perf_counter() - started
+
+        # Warm-up (index load / first mmap)
+        store.search_similarity(TENANT, queries[0].tolist(), k)
+
+        latencies = []
+        hits = 0
+        for q, expected in zip(queries, truth):
+            t = time.perf_counter()
+            result = store.search_similarity(TENANT, q.tolist(), k)
+            latencies.append((time.perf_counter() - t) * 1000)
+            found = {int(i[1:]) for i in result["ids"][0]}
+            hits += len(found & set(expected.tolist()))
+
+        return {
+            "backend": backend,
+            "rows": len(vectors),
+            "ingest_seconds": round(ingest_s, 3),
+            "ingest_rows_per_second": round(len(vectors) / ingest_s, 1),
+            "search_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "search_p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            f"recall_at_{k}": round(hits / (len(queries) * k), 4),
+            "disk_bytes": dir_bytes(path),
+            "scanned_bytes_per_query": scanned_bytes_per_query(backend, len(vectors), vectors.shape[1], k),
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--backends", nargs="+", default=["chroma", "mmap-float32", "mmap-int8"])
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    vectors, queries = make_data(args.rows, args.dim, args.queries)
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k]
+
+    results = [run_backend(b, vectors, queries, truth, args.k, args.batch) for b in args.backends]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = list(results[0])
+    print(" | ".join(columns))
+    for r in results:
+        print(" | ".join(str(r[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Governance steps shared by interactive /chat (main.chat_endpoint) and batch jobs (batch_jobs.py).
+
+    mode, model, system_prompt = route(governed_text, POLICIES, pii, has_attachments)
+    packed = pack_context(system_prompt, ...)                      # context_packer
+    shield = OutputShield(OUTPUT_SHIELD_RULES)
+    async for chunk in stream_reply(model, packed, shield, timer):  # masked, never empty
+        ...
+    meta = reply_meta(...)                                          # complete event / batch output line
+    await insert_log_entry_async(build_log_entry(...))
+
+The callers only differ in what surrounds these steps (NDJSON events, sessions, retries).
+"""
+
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from governance_kernel import decide_mode, detect_domain, select_model
+from metrics import StageTimer
+from models import Log
+from output_shield import OutputShield
+from policy_compiler import build_system_prompt
+from providers import call_llm_stream
+
+# providers.call_llm_stream does not raise: a failed call yields this prefix as its last chunk
+LLM_ERROR_PREFIX = "Error: "
+
+
+class LLMCallError(Exception):
+    """The provider reported a failed call (see LLM_ERROR_PREFIX)."""
+
+
+def route(governed_text: str, policies: Dict, pii: Dict, has_attachments: bool = False) -> Tuple[str, str, str]:
+    """(mode, model, system prompt) for the text; requests with attachments never run in FAST."""
+    domain = detect_domain(governed_text)
+    mode = decide_mode(governed_text, policies, domain, pii)
+    if has_attachments and mode == "FAST":
+        mode = "HEAVY"
+    return mode, select_model(mode, policies), build_system_prompt(mode, policies)
+
+
+async def stream_reply(model: str, packed: Dict[str, Any], shield: OutputShield, timer: StageTimer,
+                       raise_on_error: bool = False) -> AsyncIterator[str]:
+    """
+    Calls the LLM with the packed prompt and yields the reply masked by the shield (policies.yaml:
+    pii_shield), including the held-back tail. Time to first token and the rest of the generation
+    are recorded as llm_ttft / llm_generate. raise_on_error raises LLMCallError after the stream
+    when the provider reported a failure (batch retries); /chat shows the message as the reply.
+    """
+    llm_started = time.perf_counter()
+    first_chunk_at = None
+    last_chunk = ""
+    async for chunk in call_llm_stream(model, packed["system_prompt"], packed["message"]):
+        if first_chunk_at is None:
+            first_chunk_at = time.perf_counter()
+            timer.add("llm_ttft", (first_chunk_at - llm_started) * 1000)
+        last_chunk = chunk
+        chunk = shield.feed(chunk)
+        if chunk:
+            yield chunk
+    tail = shield.flush()
+    if tail:
+        yield tail
+    timer.add("llm_generate", (time.perf_counter() - (first_chunk_at or llm_started)) * 1000)
+    if raise_on_error and last_chunk.startswith(LLM_ERROR_PREFIX):
+        raise LLMCallError(last_chunk)
+
+
+def reply_meta(reply: str, mode: str, model: str, policies: Dict, pii: Dict, latency_ms: int,
+               packed: Dict[str, Any], queue_wait_ms: float, output_masked: Dict[str, int],
+               timer: StageTimer) -> Dict[str, Any]:
+    """The "meta" of the /chat complete event (also one line of a batch output file)."""
+    return {
+        "reply": reply,
+        "mode": mode,
+        "model": model,
+        "policy_version": policies.get("version", "0.0"),
+        "safety_flags": ["pii"] if pii.get("pii_detected") else [],
+        "tools_used": [],
+        "latency_ms": latency_ms,
+        "prompt_tokens": packed["stats"]["estimated_tokens"],
+        "context_truncated": packed["stats"]["truncated"],
+        "queue_wait_ms": queue_wait_ms,
+        "output_pii_masked": output_masked,
+        "timings": timer.snapshot(),
+    }
+
+
+def build_log_entry(user_id: str, tenant_id: str, mode: str, model: str, policies: Dict, pii: Dict,
+                    latency_ms: int, input_text: str, output_text: str, packed: Optional[Dict[str, Any]] = None,
+                    output_masked: Optional[Dict[str, int]] = None, timer: Optional[StageTimer] = None,
+                    queue_wait_ms: Optional[float] = None, extra_flags: Optional[List[str]] = None) -> Log:
+    output_masked = output_masked or {}
+    return Log(
+        timestamp=datetime.utcnow().isoformat() + "Z",
+        user_id=user_id,
+        tenant_id=tenant_id,
+        mode=mode,
+        model=model,
+        policy_version=policies.get("version", "0.0"),
+        pii_mask_applied=pii.get("pii_detected", False) or bool(output_masked),
+        # Input PII types, plus output_<category> for what was masked in the reply
+        safety_flags=pii.get("detected_types", []) + [f"output_{c}" for c in output_masked] + (extra_flags or []),
+        tools_used=[],
+        latency_ms=latency_ms,
+        input_text=input_text,
+        output_text=output_text,
+        prompt_tokens=packed["stats"]["estimated_tokens"] if packed else None,
+        context_stats=packed["stats"] if packed else None,
+        stage_timings=timer.snapshot() if timer else None,
+        queue_wait_ms=int(queue_wait_ms) if queue_wait_ms is not None else None,
+    )
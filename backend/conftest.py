@@ -0,0 +1,69 @@
+"""
+Shared fixtures: a real HybridRetriever on a temp SQLite file, with an in-memory
+vector store and a fake embedder injected through its constructor.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from rag_kernel import HybridRetriever
+
+
+class FakeEmbeddingService:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("embedding backend unavailable")
+        self.embedded += len(texts)
+        return [[float(len(t))] for t in texts]
+
+
+class FakeVectorStore:
+    """In-memory stand-in for the Chroma-backed VectorStore."""
+
+    def __init__(self):
+        self.rows = {}
+        self.fail_adds = 0
+
+    def add_documents(self, tenant_id, documents, metadatas, ids, embeddings):
+        if self.fail_adds > 0:
+            self.fail_adds -= 1
+            raise RuntimeError("vector store unavailable")
+        for doc, meta, chunk_id, emb in zip(documents, metadatas, ids, embeddings):
+            self.rows[(tenant_id, chunk_id)] = (doc, meta, emb)
+
+    def delete_documents(self, tenant_id, ids):
+        for chunk_id in ids:
+            self.rows.pop((tenant_id, chunk_id), None)
+
+    def list_ids(self, tenant_id):
+        return [c for t, c in self.rows if t == tenant_id]
+
+    def get_documents(self, tenant_id, ids):
+        return {
+            c: {"document": self.rows[(tenant_id, c)][0], "metadata": self.rows[(tenant_id, c)][1]}
+            for c in ids if (tenant_id, c) in self.rows
+        }
+
+    def count(self, tenant_id):
+        return len(self.list_ids(tenant_id))
+
+
+@pytest.fixture
+def make_retriever(tmp_path):
+    """Factory: make_retriever(embed_failures=0) -> HybridRetriever (one SQLite file per test)."""
+    def make(embed_failures: int = 0) -> HybridRetriever:
+        return HybridRetriever(
+            embedding_service=FakeEmbeddingService(embed_failures),
+            vector_store=FakeVectorStore(),
+            db_path=str(tmp_path / "rag.db"),
+        )
+    return make
@@ -0,0 +1,223 @@
+"""
+Token-budget-aware prompt assembly for /chat.
+
+Retrieved passages and attached files are packed into the per-mode budget
+configured in policies.yaml (modes[].context_budget):
+
+    context_budget:
+      max_input_tokens: 8000   # system prompt + passages + user message + attachments
+      attachment_share: 0.6    # part of the remaining budget reserved for attachments
+
+Token counts come from a local estimator (no provider round trip), so the
+numbers are approximate but cheap enough to run on every request.
+- Passages are kept in retrieval rank order; the first one that does not fit is truncated, the rest dropped.
+- Attachments are split into excerpts, ranked by overlap with the user's question,
+  and the best ones are kept in their original order.
+Whatever one side does not use is given to the other.
+"""
+
+import bisect
+import math
+import re
+from typing import Any, Dict, List, Sequence, Tuple
+
+from dedup import normalize
+from rag_kernel import chunk_text
+
+DEFAULT_MAX_INPUT_TOKENS = 8000
+DEFAULT_ATTACHMENT_SHARE = 0.6
+# A truncated passage shorter than this is more noise than help
+MIN_PASSAGE_TOKENS = 50
+EXCERPT_CHARS = 800
+EXCERPT_GAP = "\n[...]\n"
+
+HISTORY_HEADER = "\n\n[Conversation So Far]\n"
+REFERENCE_HEADER = "\n\n[Reference Information]\nUse the following information to answer the user's request if relevant:\n"
+ATTACHMENT_HEADER = "\n\n[Attached Files]\n"
+ATTACHMENT_SEPARATOR = "\n---\n"
+
+# Hiragana, katakana, CJK ideographs, half-width katakana: roughly one token per character.
+# Everything else (Latin text, digits, punctuation, whitespace) averages about four characters per token.
+_WIDE_CHARS = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f]")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of text whose estimate fits in max_tokens."""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Cumulative cost per character, then one bisect instead of re-estimating prefixes
+    costs = []
+    total = 0.0
+    for ch in text:
+        total += 1.0 if _WIDE_CHARS.match(ch) else 0.25
+        costs.append(total)
+    return text[:bisect.bisect_right(costs, max_tokens)]
+
+
+def get_context_budget(mode: str, policies: Dict) -> Dict[str, Any]:
+    budget = {"max_input_tokens": DEFAULT_MAX_INPUT_TOKENS, "attachment_share": DEFAULT_ATTACHMENT_SHARE}
+    for m in policies.get("modes", []):
+        if m.get("id") == mode:
+            budget.update(m.get("context_budget") or {})
+            break
+    return budget
+
+
+def _bigrams(text: str) -> set:
+    norm = normalize(text)
+    return {norm[i:i + 2] for i in range(len(norm) - 1)} or {norm}
+
+
+def rank_excerpts(query: str, excerpts: Sequence[str]) -> List[int]:
+    """Excerpt indices ordered by character-bigram overlap with the query (ties: earlier first)."""
+    query_grams = _bigrams(query)
+    scores = [len(query_grams & _bigrams(e)) / len(query_grams) for e in excerpts]
+    return sorted(range(len(excerpts)), key=lambda i: (-scores[i], i))
+
+
+def _pack_passages(passages: Sequence[str], budget: int) -> Tuple[List[str], Dict[str, Any]]:
+    kept: List[str] = []
+    used = 0
+    truncated = 0
+    for passage in passages:
+        remaining = budget - used
+        # +1 for the blank line joining passages
+        cost = estimate_tokens(passage) + 1
+        if cost <= remaining:
+            kept.append(passage)
+            used += cost
+            continue
+        if remaining >= MIN_PASSAGE_TOKENS:
+            kept.append(truncate_to_tokens(passage, remaining - 1))
+            used += estimate_tokens(kept[-1]) + 1
+            truncated = 1
+        break
+    stats = {
+        "candidates": len(passages),
+        "included": len(kept),
+        "truncated": truncated,
+        "dropped": len(passages) - len(kept),
+        "tokens": used,
+    }
+    return kept, stats
+
+
+def _attachment_header(filename: str) -> str:
+    return f"Filename: {filename}\nContent:\n"
+
+
+def _select_excerpts(query: str, text: str, budget: int) -> Tuple[str, int, int, int]:
+    """(excerpt text, included tokens, excerpts kept, excerpts total) for a text that does not fit in budget."""
+    excerpts = chunk_text(text, chunk_size=EXCERPT_CHARS, overlap=0)
+    gap_cost = estimate_tokens(EXCERPT_GAP)
+    ranked = rank_excerpts(query, excerpts)
+    chosen = []
+    used = 0
+    for i in ranked:
+        cost = estimate_tokens(excerpts[i]) + gap_cost
+        if used + cost <= budget:
+            chosen.append(i)
+            used += cost
+    if not chosen:
+        if budget < MIN_PASSAGE_TOKENS:
+            return "", 0, 0, len(excerpts)
+        # Not even one excerpt fits: keep the head of the best one
+        best = truncate_to_tokens(excerpts[ranked[0]], budget)
+        return best, estimate_tokens(best), 1, len(excerpts)
+    chosen.sort()
+    return EXCERPT_GAP.join(excerpts[i] for i in chosen), used, len(chosen), len(excerpts)
+
+
+def excerpt_text(query: str, text: str, max_tokens: int) -> str:
+    """text if it fits in max_tokens, else its excerpts most related to the query (in original order)."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return _select_excerpts(query, text, max_tokens)[0]
+
+
+def _pack_attachment(query: str, filename: str, text: str, budget: int) -> Tuple[str, Dict[str, Any]]:
+    header = _attachment_header(filename)
+    tokens = estimate_tokens(text)
+    stats = {"filename": filename, "tokens": tokens, "included_tokens": 0, "excerpts": 0, "excerpts_total": 0, "truncated": False}
+    budget -= estimate_tokens(header)
+    if tokens <= budget:
+        stats.update(included_tokens=tokens, excerpts=1, excerpts_total=1)
+        return header + text, stats
+
+    selected, used, kept, total = _select_excerpts(query, text, budget)
+    stats.update(included_tokens=used, excerpts=kept, excerpts_total=total, truncated=True)
+    if not selected:
+        return "", stats
+    return header + selected, stats
+
+
+def pack_context(system_prompt: str, message: str, passages: Sequence[str],
+                 attachments: Sequence[Tuple[str, str]], budget: Dict[str, Any], history: str = "") -> Dict[str, Any]:
+    """
+    Builds the final prompts within budget["max_input_tokens"].
+    attachments: (filename, extracted text).
+    history: earlier turns of a conversation session (already bounded by sessions.py), kept whole.
+    Returns {"system_prompt", "message", "stats"}; stats is stored in the Log row.
+    """
+    max_tokens = int(budget.get("max_input_tokens", DEFAULT_MAX_INPUT_TOKENS))
+    share = float(budget.get("attachment_share", DEFAULT_ATTACHMENT_SHARE))
+
+    fixed = estimate_tokens(system_prompt) + estimate_tokens(message)
+    if history:
+        fixed += estimate_tokens(HISTORY_HEADER) + estimate_tokens(history)
+    if passages:
+        fixed += estimate_tokens(REFERENCE_HEADER)
+    if attachments:
+        fixed += estimate_tokens(ATTACHMENT_HEADER)
+    available = max(0, max_tokens - fixed)
+
+    # Passages may use what the attachments do not need, and vice versa
+    attachment_need = sum(
+        estimate_tokens(_attachment_header(filename)) + estimate_tokens(text) + estimate_tokens(ATTACHMENT_SEPARATOR)
+        for filename, text in attachments
+    )
+    reserved = min(attachment_need, int(available * share)) if passages else attachment_need
+    kept_passages, passage_stats = _pack_passages(passages, max(0, available - reserved))
+
+    remaining = available - passage_stats["tokens"]
+    parts = []
+    attachment_stats = []
+    for n, (filename, text) in enumerate(attachments):
+        # Split what is left evenly over the attachments still to come
+        part, stats = _pack_attachment(message, filename, text, remaining // (len(attachments) - n))
+        if part:
+            parts.append(part)
+            remaining -= estimate_tokens(part) + estimate_tokens(ATTACHMENT_SEPARATOR)
+        attachment_stats.append(stats)
+
+    final_system = system_prompt
+    if history:
+        final_system += HISTORY_HEADER + history
+    if kept_passages:
+        final_system += REFERENCE_HEADER + "\n\n".join(kept_passages) + "\n"
+    final_message = message
+    if parts:
+        final_message += ATTACHMENT_HEADER + ATTACHMENT_SEPARATOR.join(parts)
+
+    total = estimate_tokens(final_system) + estimate_tokens(final_message)
+    stats = {
+        "budget": max_tokens,
+        "estimated_tokens": total,
+        "system_tokens": estimate_tokens(system_prompt),
+        "message_tokens": estimate_tokens(message),
+        "history_tokens": estimate_tokens(history),
+        "passages": passage_stats,
+        "attachments": attachment_stats,
+        "truncated": passage_stats["dropped"] > 0 or passage_stats["truncated"] > 0
+        or any(a["truncated"] for a in attachment_stats),
+    }
+    return {"system_prompt": final_system, "message": final_message, "stats": stats}
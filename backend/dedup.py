@@ -0,0 +1,232 @@
+"""
+Exact and near-duplicate detection for RAG chunks.
+
+- Exact duplicates: SHA-256 of the normalized chunk text.
+- Near duplicates: MinHash over character shingles (character-based because the
+  corpus is mostly Japanese) with LSH banding so candidates are found by an
+  indexed SQLite lookup instead of comparing against every stored chunk.
+
+Fingerprints are stored per tenant next to keyword_docs in the same SQLite file.
+"""
+
+import hashlib
+import os
+import sqlite3
+import unicodedata
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+# Estimated Jaccard similarity above which two chunks count as near duplicates
+NEAR_DUP_THRESHOLD = float(os.getenv("RAG_NEAR_DUP_THRESHOLD", "0.8"))
+
+# Universal hashing h(x) = (a*x + b) mod p over 32-bit shingle hashes.
+# p < 2^31 and x < 2^32 keep a*x + b inside uint64. Fixed seed -> stable signatures across restarts.
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(20251115)
+_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+
+
+def normalize(text: str) -> str:
+    """
+    NFKC + lowercase + all whitespace removed, so formatting-only changes hash identically.
+    (pypdf often emits Japanese PDFs with a line break after every character.)
+    """
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    norm = normalize(text)
+    if len(norm) <= SHINGLE_SIZE:
+        shingles = {norm}
+    else:
+        shingles = {norm[i:i + SHINGLE_SIZE] for i in range(len(norm) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash(text: str) -> np.ndarray:
+    """Returns a NUM_PERM-long uint64 MinHash signature."""
+    x = _shingle_hashes(text)
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def minhash_many(texts: Sequence[str]) -> np.ndarray:
+    """Signatures for several texts as a (len(texts), NUM_PERM) matrix."""
+    if not texts:
+        return np.empty((0, NUM_PERM), dtype=np.uint64)
+    return np.stack([minhash(t) for t in texts])
+
+
+def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(sig_a == sig_b))
+
+
+def band_keys(sig: np.ndarray) -> List[Tuple[int, int]]:
+    bands = sig.reshape(LSH_BANDS, LSH_ROWS)
+    return [(i, zlib.crc32(band.tobytes())) for i, band in enumerate(bands)]
+
+
+def collapse_near_duplicates(texts: List[str], threshold: float = NEAR_DUP_THRESHOLD) -> List[str]:
+    """
+    Drops texts that are exact or near duplicates of an earlier (higher ranked) one.
+    All pairwise similarities are computed in one broadcasted comparison.
+    """
+    if len(texts) < 2:
+        return list(texts)
+    sigs = minhash_many(texts)
+    sim = (sigs[:, None, :] == sigs[None, :, :]).mean(axis=2)
+    kept: List[int] = []
+    for i in range(len(texts)):
+        if all(sim[i, j] < threshold for j in kept):
+            kept.append(i)
+    return [texts[i] for i in kept]
+
+
+class DedupIndex:
+    def __init__(self, db_path: str = "governance_logs.db"):
+        self.db_path = db_path
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def _init_db(self):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_fingerprints (
+                tenant_id TEXT,
+                chunk_id TEXT,
+                doc_id TEXT,
+                content_hash TEXT,
+                minhash BLOB,
+                PRIMARY KEY (tenant_id, chunk_id)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_fp_hash ON chunk_fingerprints (tenant_id, content_hash)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_lsh (
+                tenant_id TEXT,
+                band INTEGER,
+                bucket INTEGER,
+                chunk_id TEXT
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_lsh ON chunk_lsh (tenant_id, band, bucket)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_lsh_chunk ON chunk_lsh (tenant_id, chunk_id)")
+        conn.commit()
+        conn.close()
+
+    def find_exact(self, tenant_id: str, hashes: Sequence[str]) -> Dict[str, Tuple[str, str]]:
+        """Maps each already-stored content hash to (chunk_id, doc_id)."""
+        if not hashes:
+            return {}
+        conn = self._connect()
+        placeholders = ",".join("?" for _ in hashes)
+        rows = conn.execute(
+            f"SELECT content_hash, chunk_id, doc_id FROM chunk_fingerprints WHERE tenant_id = ? AND content_hash IN ({placeholders})",
+            [tenant_id, *hashes]
+        ).fetchall()
+        conn.close()
+        found = {}
+        for h, chunk_id, doc_id in rows:
+            found.setdefault(h, (chunk_id, doc_id))
+        return found
+
+    def existing_ids(self, tenant_id: str, chunk_ids: Sequence[str], conn: Optional[sqlite3.Connection] = None) -> List[str]:
+        """The subset of chunk_ids that currently have a fingerprint (i.e. are stored)."""
+        if not chunk_ids:
+            return []
+        own_conn = conn is None
+        if own_conn:
+            conn = self._connect()
+        placeholders = ",".join("?" for _ in chunk_ids)
+        rows = conn.execute(
+            f"SELECT chunk_id FROM chunk_fingerprints WHERE tenant_id = ? AND chunk_id IN ({placeholders})",
+            [tenant_id, *chunk_ids]
+        ).fetchall()
+        if own_conn:
+            conn.close()
+        return [r[0] for r in rows]
+
+    def find_near(self, tenant_id: str, sig: np.ndarray, threshold: float = NEAR_DUP_THRESHOLD,
+                  exclude_doc_id: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        """
+        Returns (chunk_id, similarity) of the most similar stored chunk above threshold.
+        exclude_doc_id skips chunks of that document (e.g. the previous version being replaced).
+        """
+        keys = band_keys(sig)
+        conn = self._connect()
+        clauses = " OR ".join("(band = ? AND bucket = ?)" for _ in keys)
+        params: List = [tenant_id]
+        for band, bucket in keys:
+            params.extend([band, bucket])
+        candidates = [r[0] for r in conn.execute(
+            f"SELECT DISTINCT chunk_id FROM chunk_lsh WHERE tenant_id = ? AND ({clauses})", params
+        ).fetchall()]
+        if not candidates:
+            conn.close()
+            return None
+        placeholders = ",".join("?" for _ in candidates)
+        rows = conn.execute(
+            f"SELECT chunk_id, minhash, doc_id FROM chunk_fingerprints WHERE tenant_id = ? AND chunk_id IN ({placeholders})",
+            [tenant_id, *candidates]
+        ).fetchall()
+        conn.close()
+        rows = [r for r in rows if exclude_doc_id is None or r[2] != exclude_doc_id]
+        if not rows:
+            return None
+
+        ids = [r[0] for r in rows]
+        sigs = np.stack([np.frombuffer(r[1], dtype=np.uint64) for r in rows])
+        sims = (sigs == sig[None, :]).mean(axis=1)
+        best = int(np.argmax(sims))
+        if sims[best] < threshold:
+            return None
+        return ids[best], float(sims[best])
+
+    def add(self, tenant_id: str, entries: Sequence[Tuple[str, str, str, np.ndarray]], conn: Optional[sqlite3.Connection] = None):
+        """
+        entries: (chunk_id, doc_id, content_hash, minhash signature).
+        When conn is given the caller owns the transaction.
+        """
+        if not entries:
+            return
+        own_conn = conn is None
+        if own_conn:
+            conn = self._connect()
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_fingerprints (tenant_id, chunk_id, doc_id, content_hash, minhash) VALUES (?, ?, ?, ?, ?)",
+            [(tenant_id, chunk_id, doc_id, h, sig.astype(np.uint64).tobytes()) for chunk_id, doc_id, h, sig in entries]
+        )
+        conn.executemany(
+            "INSERT INTO chunk_lsh (tenant_id, band, bucket, chunk_id) VALUES (?, ?, ?, ?)",
+            [(tenant_id, band, bucket, chunk_id) for chunk_id, _, _, sig in entries for band, bucket in band_keys(sig)]
+        )
+        if own_conn:
+            conn.commit()
+            conn.close()
+
+    def delete(self, tenant_id: str, chunk_ids: Sequence[str], conn: Optional[sqlite3.Connection] = None):
+        if not chunk_ids:
+            return
+        own_conn = conn is None
+        if own_conn:
+            conn = self._connect()
+        params = [(tenant_id, chunk_id) for chunk_id in chunk_ids]
+        conn.executemany("DELETE FROM chunk_fingerprints WHERE tenant_id = ? AND chunk_id = ?", params)
+        conn.executemany("DELETE FROM chunk_lsh WHERE tenant_id = ? AND chunk_id = ?", params)
+        if own_conn:
+            conn.commit()
+            conn.close()
@@ -0,0 +1,388 @@
+"""
+Document catalog for the RAG knowledge base.
+
+Tracks, per tenant:
+- rag_documents:       one row per logical document (keyed by filename or external id) with its version
+- rag_document_chunks: the manifest of chunk ids that make up the current version of each document
+                       (a chunk id may belong to another document when an identical chunk was linked)
+- rag_pending_ops:     a small journal that makes document writes atomic across Chroma and SQLite
+
+Everything lives in the same SQLite file as keyword_docs, so the keyword index,
+the dedup fingerprints and the catalog change in a single transaction.
+That transaction is the commit point; Chroma is brought in line with it
+(before: adds are journaled as "pending", after: deletes are journaled as "committed").
+
+Each journal row names its owner (host:pid) and carries a heartbeat. Recovery only touches
+ops whose owner is gone: a row of a live ingest in another worker looks exactly like a
+crashed one otherwise. An op is treated as dead when its owner is this process but no call
+of this process is running it any more, when its owner pid on this host no longer exists, or
+when its heartbeat is older than RAG_OP_LEASE_SECONDS (other hosts, reused pids).
+"""
+
+import base64
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+
+# An op whose owner cannot be checked (other host, reused pid) is considered dead this long after its last heartbeat
+RAG_OP_LEASE_SECONDS = float(os.getenv("RAG_OP_LEASE_SECONDS", "600"))
+
+# Ops begun by this process whose call has not returned yet (shared by every catalog instance)
+_ACTIVE_OPS = set()
+_ACTIVE_OPS_LOCK = threading.Lock()
+
+
+def _op_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+
+class VersionConflictError(Exception):
+    """The document changed between planning and committing (concurrent re-ingest)."""
+
+
+class DocumentCatalog:
+    def __init__(self, db_path: str = "governance_logs.db"):
+        self.db_path = db_path
+        self._init_db()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rag_documents (
+                tenant_id TEXT,
+                doc_id TEXT,
+                doc_key TEXT,
+                version INTEGER,
+                filename TEXT,
+                uploader TEXT,
+                timestamp TEXT,
+                chunk_count INTEGER,
+                metadata TEXT,
+                PRIMARY KEY (tenant_id, doc_id)
+            )
+        """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_rag_documents_key ON rag_documents (tenant_id, doc_key)")
+        # Serves the paginated knowledge listing (newest first) without a sort step
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_rag_documents_list ON rag_documents (tenant_id, timestamp DESC, doc_id)")
+        # Keyset pagination compares timestamps, so they must never be NULL
+        cursor.execute("UPDATE rag_documents SET timestamp = '' WHERE timestamp IS NULL")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rag_document_chunks (
+                tenant_id TEXT,
+                doc_id TEXT,
+                chunk_index INTEGER,
+                chunk_id TEXT,
+                content_hash TEXT,
+                PRIMARY KEY (tenant_id, doc_id, chunk_index)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_rag_document_chunks_id ON rag_document_chunks (tenant_id, chunk_id)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rag_pending_ops (
+                op_id TEXT PRIMARY KEY,
+                tenant_id TEXT,
+                doc_id TEXT,
+                status TEXT,
+                add_ids TEXT,
+                delete_ids TEXT,
+                created_at TEXT,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+        """)
+        # Journals created before ops had owners
+        columns = {r["name"] for r in cursor.execute("PRAGMA table_info(rag_pending_ops)")}
+        if "owner" not in columns:
+            cursor.execute("ALTER TABLE rag_pending_ops ADD COLUMN owner TEXT")
+        if "heartbeat_at" not in columns:
+            cursor.execute("ALTER TABLE rag_pending_ops ADD COLUMN heartbeat_at REAL")
+        conn.commit()
+        conn.close()
+
+    # --- Documents ---
+
+    def get_by_key(self, tenant_id: str, doc_key: str) -> Optional[Dict[str, Any]]:
+        conn = self.connect()
+        row = conn.execute(
+            "SELECT * FROM rag_documents WHERE tenant_id = ? AND doc_key = ?", (tenant_id, doc_key)
+        ).fetchone()
+        conn.close()
+        return self._row_to_doc(row) if row else None
+
+    def get(self, tenant_id: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        conn = self.connect()
+        row = conn.execute(
+            "SELECT * FROM rag_documents WHERE tenant_id = ? AND doc_id = ?", (tenant_id, doc_id)
+        ).fetchone()
+        conn.close()
+        return self._row_to_doc(row) if row else None
+
+    @staticmethod
+    def _row_to_doc(row: sqlite3.Row) -> Dict[str, Any]:
+        doc = dict(row)
+        doc["metadata"] = json.loads(doc["metadata"] or "{}")
+        return doc
+
+    def upsert_document(self, conn: sqlite3.Connection, tenant_id: str, doc_id: str, doc_key: str,
+                        expected_version: int, chunk_count: int, metadata: Dict[str, Any]) -> int:
+        """
+        Writes version expected_version + 1. Raises VersionConflictError if someone else
+        committed a version in between (optimistic concurrency).
+        """
+        new_version = expected_version + 1
+        values = (
+            doc_key, new_version, metadata.get("filename"), metadata.get("uploader"),
+            metadata.get("timestamp") or "", chunk_count, json.dumps(metadata, ensure_ascii=False),
+        )
+        if expected_version == 0:
+            try:
+                conn.execute(
+                    "INSERT INTO rag_documents (doc_key, version, filename, uploader, timestamp, chunk_count, metadata, tenant_id, doc_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*values, tenant_id, doc_id)
+                )
+            except sqlite3.IntegrityError:
+                raise VersionConflictError(f"document {doc_key} was created concurrently")
+        else:
+            cursor = conn.execute(
+                "UPDATE rag_documents SET doc_key = ?, version = ?, filename = ?, uploader = ?, timestamp = ?, chunk_count = ?, metadata = ? "
+                "WHERE tenant_id = ? AND doc_id = ? AND version = ?",
+                (*values, tenant_id, doc_id, expected_version)
+            )
+            if cursor.rowcount != 1:
+                raise VersionConflictError(f"document {doc_key} changed concurrently")
+        return new_version
+
+    def list_documents(self, tenant_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                       offset: int = 0, filename: Optional[str] = None, uploader: Optional[str] = None,
+                       since: Optional[str] = None, until: Optional[str] = None) -> Dict[str, Any]:
+        """
+        One page of the knowledge-base listing, newest first:
+        {"items": [{"id", "version", "chunk_count", "metadata": {filename, uploader, timestamp}}], "next_cursor"}
+
+        Only the indexed columns are read (the metadata JSON blob is not), so large corpora stay cheap.
+        cursor (keyset, the next_cursor of the previous page) is preferred over offset for deep pages.
+        filename matches as a case-insensitive substring, uploader exactly,
+        since/until are inclusive bounds on the ISO timestamp.
+        """
+        where = ["tenant_id = ?"]
+        params: List[Any] = [tenant_id]
+        if filename:
+            escaped = filename.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("filename LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if uploader:
+            where.append("uploader = ?")
+            params.append(uploader)
+        if since:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            where.append("timestamp <= ?")
+            params.append(until)
+        if cursor:
+            last_timestamp, last_doc_id = self._decode_cursor(cursor)
+            where.append("(timestamp < ? OR (timestamp = ? AND doc_id > ?))")
+            params.extend([last_timestamp, last_timestamp, last_doc_id])
+
+        sql = (
+            "SELECT doc_id, version, filename, uploader, timestamp, chunk_count FROM rag_documents "
+            f"WHERE {' AND '.join(where)} ORDER BY timestamp DESC, doc_id"
+        )
+        if limit is not None:
+            # One extra row tells us whether there is a next page
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit + 1, 0 if cursor else offset])
+
+        conn = self.connect()
+        rows = conn.execute(sql, params).fetchall()
+        conn.close()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1]["timestamp"], rows[-1]["doc_id"])
+        items = [
+            {
+                "id": r["doc_id"],
+                "version": r["version"],
+                "chunk_count": r["chunk_count"],
+                "metadata": {"filename": r["filename"], "uploader": r["uploader"], "timestamp": r["timestamp"]},
+            }
+            for r in rows
+        ]
+        return {"items": items, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _encode_cursor(timestamp: Optional[str], doc_id: str) -> str:
+        raw = json.dumps([timestamp or "", doc_id]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            timestamp, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return str(timestamp), str(doc_id)
+        except Exception:
+            raise ValueError("invalid cursor")
+
+    def delete_document(self, conn: sqlite3.Connection, tenant_id: str, doc_id: str):
+        conn.execute("DELETE FROM rag_documents WHERE tenant_id = ? AND doc_id = ?", (tenant_id, doc_id))
+        conn.execute("DELETE FROM rag_document_chunks WHERE tenant_id = ? AND doc_id = ?", (tenant_id, doc_id))
+
+    # --- Chunk manifest ---
+
+    def get_manifest(self, tenant_id: str, doc_id: str) -> List[Dict[str, Any]]:
+        conn = self.connect()
+        rows = conn.execute(
+            "SELECT chunk_index, chunk_id, content_hash FROM rag_document_chunks WHERE tenant_id = ? AND doc_id = ? ORDER BY chunk_index",
+            (tenant_id, doc_id)
+        ).fetchall()
+        conn.close()
+        return [dict(r) for r in rows]
+
+    def replace_manifest(self, conn: sqlite3.Connection, tenant_id: str, doc_id: str, chunks: Sequence[Dict[str, Any]]):
+        """chunks: dicts with chunk_index, chunk_id, content_hash."""
+        conn.execute("DELETE FROM rag_document_chunks WHERE tenant_id = ? AND doc_id = ?", (tenant_id, doc_id))
+        conn.executemany(
+            "INSERT INTO rag_document_chunks (tenant_id, doc_id, chunk_index, chunk_id, content_hash) VALUES (?, ?, ?, ?, ?)",
+            [(tenant_id, doc_id, c["chunk_index"], c["chunk_id"], c["content_hash"]) for c in chunks]
+        )
+
+    @staticmethod
+    def unreferenced(conn: sqlite3.Connection, tenant_id: str, chunk_ids: Sequence[str]) -> List[str]:
+        """The subset of chunk_ids no manifest refers to any more (safe to delete from the stores)."""
+        if not chunk_ids:
+            return []
+        placeholders = ",".join("?" for _ in chunk_ids)
+        still_used = {r[0] for r in conn.execute(
+            f"SELECT DISTINCT chunk_id FROM rag_document_chunks WHERE tenant_id = ? AND chunk_id IN ({placeholders})",
+            [tenant_id, *chunk_ids]
+        ).fetchall()}
+        return [c for c in dict.fromkeys(chunk_ids) if c not in still_used]
+
+    def all_chunk_ids(self, tenant_id: str) -> set:
+        conn = self.connect()
+        ids = {r[0] for r in conn.execute(
+            "SELECT DISTINCT chunk_id FROM rag_document_chunks WHERE tenant_id = ?", (tenant_id,)
+        ).fetchall()}
+        conn.close()
+        return ids
+
+    def sample_chunk_ids(self) -> Dict[str, str]:
+        """tenant_id -> one chunk id of that tenant (e.g. to check the stored embedding dimension)."""
+        conn = self.connect()
+        rows = conn.execute("SELECT tenant_id, MIN(chunk_id) FROM rag_document_chunks GROUP BY tenant_id").fetchall()
+        conn.close()
+        return {r[0]: r[1] for r in rows}
+
+    # --- Journal ---
+
+    def begin_op(self, tenant_id: str, doc_id: str, add_ids: Sequence[str]) -> str:
+        """
+        Journals the Chroma ids about to be added, before touching Chroma.
+        The caller must release_op() when its call returns, whatever the outcome (see op()).
+        """
+        op_id = str(uuid.uuid4())
+        with _ACTIVE_OPS_LOCK:
+            _ACTIVE_OPS.add(op_id)
+        conn = self.connect()
+        conn.execute(
+            "INSERT INTO rag_pending_ops (op_id, tenant_id, doc_id, status, add_ids, delete_ids, created_at, owner, heartbeat_at) "
+            "VALUES (?, ?, ?, 'pending', ?, '[]', ?, ?, ?)",
+            (op_id, tenant_id, doc_id, json.dumps(list(add_ids)), datetime.utcnow().isoformat() + "Z", _op_owner(), time.time())
+        )
+        conn.commit()
+        conn.close()
+        return op_id
+
+    @contextmanager
+    def op(self, tenant_id: str, doc_id: str, add_ids: Sequence[str]) -> Iterator[str]:
+        """begin_op() for the duration of the block: the op counts as live until the block exits."""
+        op_id = self.begin_op(tenant_id, doc_id, add_ids)
+        try:
+            yield op_id
+        finally:
+            self.release_op(op_id)
+
+    def touch_op(self, op_id: str):
+        """Renews the op's lease (e.g. after a slow Chroma upsert, right before the commit)."""
+        conn = self.connect()
+        conn.execute("UPDATE rag_pending_ops SET heartbeat_at = ? WHERE op_id = ?", (time.time(), op_id))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def release_op(op_id: str):
+        """The call that began op_id has returned: a journal row left behind is now recoverable."""
+        with _ACTIVE_OPS_LOCK:
+            _ACTIVE_OPS.discard(op_id)
+
+    @staticmethod
+    def is_live(op: Dict[str, Any]) -> bool:
+        """Whether the op's owner may still be working on it (recovery must leave it alone)."""
+        owner = op.get("owner")
+        if not owner:
+            return False  # journaled before ops had owners: only left behind by a crash
+        if owner == _op_owner():
+            with _ACTIVE_OPS_LOCK:
+                return op["op_id"] in _ACTIVE_OPS
+        host, _, pid = owner.rpartition(":")
+        if host == socket.gethostname() and pid.isdigit() and not _pid_alive(int(pid)):
+            return False
+        return time.time() - (op.get("heartbeat_at") or 0) < RAG_OP_LEASE_SECONDS
+
+    @staticmethod
+    def mark_committed(conn: sqlite3.Connection, op_id: str, delete_ids: Sequence[str]):
+        """Inside the commit transaction: the op can no longer be rolled back, only finished."""
+        conn.execute(
+            "UPDATE rag_pending_ops SET status = 'committed', delete_ids = ? WHERE op_id = ?",
+            (json.dumps(list(delete_ids)), op_id)
+        )
+
+    def finish_op(self, op_id: str):
+        conn = self.connect()
+        conn.execute("DELETE FROM rag_pending_ops WHERE op_id = ?", (op_id,))
+        conn.commit()
+        conn.close()
+
+    def pending_ops(self, tenant_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        conn = self.connect()
+        if tenant_id is None:
+            rows = conn.execute("SELECT * FROM rag_pending_ops ORDER BY created_at").fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM rag_pending_ops WHERE tenant_id = ? ORDER BY created_at", (tenant_id,)
+            ).fetchall()
+        conn.close()
+        ops = []
+        for r in rows:
+            op = dict(r)
+            op["add_ids"] = json.loads(op["add_ids"])
+            op["delete_ids"] = json.loads(op["delete_ids"])
+            ops.append(op)
+        return ops
@@ -0,0 +1,206 @@
+"""
+Content-addressed cache for text extracted from uploaded files.
+
+Keys are the SHA-256 of the raw file bytes (plus the parser kind), so the same
+PDF attached to /chat and later sent to /ingest is parsed only once.
+Two tiers, each bounded by total bytes with LRU eviction:
+- memory: OrderedDict of key -> text
+- disk:   one UTF-8 file per key under EXTRACTION_CACHE_DIR (survives restarts, shared by uvicorn
+  workers: a key another worker wrote is read from its file).
+  EXTRACTION_CACHE_DISK_BYTES caps the directory, not one worker's writes: each worker re-reads the
+  directory sizes every EXTRACTION_CACHE_DISK_RESCAN_SECONDS (and whenever its own count goes over
+  the limit) and evicts the least recently used files, so the total can overshoot by what the
+  other workers wrote since the last rescan.
+get() / put() do blocking file I/O: call them from a thread (file_parser uses run_in_threadpool).
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from metrics import EXTRACTION_CACHE_LOOKUPS
+
+if os.path.exists("/app/data"):
+    # Docker環境 (永続ボリューム)
+    _DEFAULT_CACHE_DIR = Path("/app/data/extraction_cache")
+else:
+    # ローカル開発環境
+    _DEFAULT_CACHE_DIR = Path(__file__).parent / ".extraction_cache"
+
+EXTRACTION_CACHE_DIR = Path(os.getenv("EXTRACTION_CACHE_DIR", str(_DEFAULT_CACHE_DIR)))
+EXTRACTION_CACHE_MEMORY_BYTES = int(os.getenv("EXTRACTION_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+EXTRACTION_CACHE_DISK_BYTES = int(os.getenv("EXTRACTION_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+EXTRACTION_CACHE_DISK_RESCAN_SECONDS = float(os.getenv("EXTRACTION_CACHE_DISK_RESCAN_SECONDS", "60"))
+
+
+class ExtractionCache:
+    def __init__(self, cache_dir: Optional[Path], memory_bytes: int, disk_bytes: int,
+                 rescan_seconds: float = EXTRACTION_CACHE_DISK_RESCAN_SECONDS):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.rescan_seconds = rescan_seconds
+        self._scanned_at = 0.0
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._memory_size = 0
+        # key -> size on disk, in LRU order (oldest first)
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir and self.disk_bytes > 0:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        """(Re)builds the disk index from the directory, which other workers write to as well."""
+        # LRU order from mtimes (touched on every disk hit)
+        self._disk.clear()
+        self._disk_size = 0
+        self._scanned_at = time.monotonic()
+        entries = []
+        for path in self.cache_dir.glob("*.txt"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path.stem, st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.txt"
+
+    @staticmethod
+    def _text_size(text: str) -> int:
+        return len(text.encode("utf-8"))
+
+    def _put_memory(self, key: str, text: str):
+        size = self._text_size(text)
+        if size > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= self._text_size(old)
+        self._memory[key] = text
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= self._text_size(evicted)
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                self._disk_path(key).unlink()
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                EXTRACTION_CACHE_LOOKUPS.inc(("memory_hit",))
+                return text
+
+            # 索引にないキーも他のワーカーが書いたファイルがあれば使う
+            if self.cache_dir and self.disk_bytes > 0:
+                path = self._disk_path(key)
+                try:
+                    text = path.read_text(encoding="utf-8")
+                    os.utime(path)
+                except OSError:
+                    if key in self._disk:
+                        self._disk_size -= self._disk.pop(key)
+                    text = None
+                if text is not None:
+                    if key not in self._disk:
+                        self._disk[key] = self._text_size(text)
+                        self._disk_size += self._disk[key]
+                    self._disk.move_to_end(key)
+                    self._put_memory(key, text)
+                    self.disk_hits += 1
+                    EXTRACTION_CACHE_LOOKUPS.inc(("disk_hit",))
+                    return text
+
+            self.misses += 1
+            EXTRACTION_CACHE_LOOKUPS.inc(("miss",))
+            return None
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._put_memory(key, text)
+
+            if not self.cache_dir or self.disk_bytes <= 0 or key in self._disk:
+                return
+            size = self._text_size(text)
+            if size > self.disk_bytes:
+                return
+            path = self._disk_path(key)
+            # 一時ファイル名はワーカーごとに一意 (同じキーを同時に書いても互いの途中書きを rename しない)
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=f"{key}.", suffix=".tmp",
+                                                 delete=False) as f:
+                    tmp_path = f.name
+                    f.write(text.encode("utf-8"))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"[WARN] extraction cache write failed: {e}")
+                if tmp_path:
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+                return
+            self._disk[key] = size
+            self._disk_size += size
+            if self._disk_size > self.disk_bytes or time.monotonic() - self._scanned_at > self.rescan_seconds:
+                self._load_disk_index()
+            self._evict_disk()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            for key in list(self._disk):
+                try:
+                    self._disk_path(key).unlink()
+                except OSError:
+                    pass
+            self._disk.clear()
+            self._disk_size = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+        }
+
+
+EXTRACTION_CACHE = ExtractionCache(
+    EXTRACTION_CACHE_DIR,
+    memory_bytes=EXTRACTION_CACHE_MEMORY_BYTES,
+    disk_bytes=EXTRACTION_CACHE_DISK_BYTES,
+)
@@ -1,6 +1,169 @@
-import io
-from fastapi import UploadFile
+import asyncio
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
 from pypdf import PdfReader
+from starlette.concurrency import run_in_threadpool
+
+from extraction_cache import EXTRACTION_CACHE
+from singleflight import SingleFlight
+
+# ===== 抽出の上限・並列度の設定 =====
+# 巨大なファイルでメモリやCPUを使い切らないように、サイズとページ数に上限を設けます
+MAX_FILE_BYTES = int(os.getenv("FILE_MAX_BYTES", str(50 * 1024 * 1024)))  # 50MB
+MAX_PDF_PAGES = int(os.getenv("FILE_MAX_PDF_PAGES", "1000"))
+# 1プロセスに渡すページ数。これより少ないPDFは1回のワーカー呼び出しで処理します
+PDF_PAGES_PER_TASK = int(os.getenv("FILE_PDF_PAGES_PER_TASK", "16"))
+PDF_WORKERS = int(os.getenv("FILE_PARSER_WORKERS", str(os.cpu_count() or 2)))
+READ_CHUNK_BYTES = 1024 * 1024
+
+_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+# 同じファイルが同時にアップロードされた場合は、抽出を1回だけ行い結果を共有します (キーは抽出キャッシュと同じ)
+_EXTRACT_FLIGHT = SingleFlight("extract")
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """
+    PDF解析用のプロセスプールを遅延生成して使い回します。
+    pypdf の解析は純粋なCPU処理なので、イベントループ(やGIL)を塞がないよう別プロセスで実行します。
+    """
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None:
+        _PROCESS_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _PROCESS_POOL
+
+
+def shutdown_process_pool():
+    global _PROCESS_POOL
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.shutdown(cancel_futures=True)
+        _PROCESS_POOL = None
+
+
+# ----- ワーカープロセス側で動く関数 (pickle できるようにトップレベルに置きます) -----
+
+def _count_pdf_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+
+def _extract_pdf_pages(path: str, start: int, end: int) -> List[str]:
+    """path の PDF から [start, end) ページのテキストを抽出します。"""
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+# ----- 読み込み -----
+
+async def spool_upload(file: UploadFile) -> Tuple[str, str]:
+    """
+    アップロードを少しずつ読みながら一時ファイルに書き出し、(パス, SHA-256) を返します。
+    ファイル全体をメモリに載せず、上限サイズを超えた時点で 413 を返します。
+    ハッシュは読み込みと同時に計算するので、抽出キャッシュのキーを追加コストなしで得られます。
+    一時ファイルの削除は呼び出し側の責任です。
+    """
+    size = 0
+    digest = hashlib.sha256()
+    tmp = tempfile.NamedTemporaryFile(prefix="prism_upload_", delete=False)
+    try:
+        while True:
+            chunk = await file.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_FILE_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"{file.filename}: file exceeds {MAX_FILE_BYTES} bytes"
+                )
+            digest.update(chunk)
+            tmp.write(chunk)
+        tmp.close()
+        return tmp.name, digest.hexdigest()
+    except BaseException:
+        tmp.close()
+        os.unlink(tmp.name)
+        raise
+
+
+async def iter_pdf_pages(path: str) -> AsyncIterator[str]:
+    """
+    PDF をページ単位で抽出し、ページ順に yield する非同期ジェネレータです。
+    ページ範囲ごとにプロセスプールへ投げて並列に解析し、先頭から順に返すので、
+    呼び出し側は全ページの解析完了を待たずに後続処理(チャンク分割・PII検知など)を始められます。
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_process_pool()
+
+    page_count = await loop.run_in_executor(pool, _count_pdf_pages, path)
+    if page_count > MAX_PDF_PAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"PDF has {page_count} pages (limit {MAX_PDF_PAGES})"
+        )
+
+    futures = [
+        loop.run_in_executor(pool, _extract_pdf_pages, path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+    try:
+        for future in futures:
+            for page_text in await future:
+                yield page_text
+    finally:
+        # 途中で打ち切られた場合、まだ始まっていない解析はキャンセルします
+        for future in futures:
+            future.cancel()
+
+
+async def _iter_spooled_pages(path: str, is_pdf: bool) -> AsyncIterator[str]:
+    if is_pdf:
+        async for page_text in iter_pdf_pages(path):
+            yield page_text
+    else:
+        # その他のファイル(主にテキスト)は UTF-8 として読みます
+        # errors="ignore" は、変換できない文字があってもエラーにせず無視する設定です
+        with open(path, "rb") as f:
+            yield f.read().decode("utf-8", errors="ignore")
+
+
+async def extract_text_from_path(path: str, filename: str, sha256: Optional[str] = None) -> str:
+    """
+    ディスク上のファイルからテキストを抽出します (一括取り込みジョブ用)。
+    sha256 が分かっていれば抽出キャッシュを使い、同じ内容の同時抽出は1回にまとめます。
+    """
+    is_pdf = filename.lower().endswith(".pdf")
+    # 同じバイト列でも PDF として読むかテキストとして読むかで結果が変わるのでキーに含めます
+    cache_key = f"{sha256}-{'pdf' if is_pdf else 'text'}" if sha256 else None
+    if not cache_key:
+        return await _extract_spooled(path, is_pdf)
+    # キャッシュはディスク(数MBのテキスト)を読み書きするので、イベントループを塞がないようスレッドで実行します
+    cached = await run_in_threadpool(EXTRACTION_CACHE.get, cache_key)
+    if cached is not None:
+        return cached
+
+    async def extract_and_cache() -> str:
+        text = await _extract_spooled(path, is_pdf)
+        await run_in_threadpool(EXTRACTION_CACHE.put, cache_key, text)
+        return text
+
+    return await _EXTRACT_FLIGHT.do_async(cache_key, extract_and_cache)
+
+
+async def _extract_spooled(path: str, is_pdf: bool) -> str:
+    parts = []
+    async for page_text in _iter_spooled_pages(path, is_pdf):
+        if is_pdf:
+            if page_text:
+                parts.append(page_text + "\n")
+        else:
+            parts.append(page_text)
+    # 文字列の += は毎回コピーが発生するので、最後に1回だけ join します
+    return "".join(parts)
+
 
 # [NEW CODE] なぜこの関数が必要か:
 # アップロードされたファイル (PDFやテキスト) から、LLMが理解できる「テキストデータ」を取り出すためです。
@@ -8,35 +171,14 @@ async def extract_text_from_file(file: UploadFile) -> str:
     """
     アップロードされたファイルからテキストを抽出する関数です。
     対応形式: PDF, Text
+    PDF は1ページごとに末尾へ改行を付けて結合します。
+    同じ内容のファイルは SHA-256 をキーに抽出結果をキャッシュし、/chat と /ingest で共有します。
     """
-    
-    # [NEW CODE] ファイル名がない場合は空文字を返して終了します
     if not file.filename:
         return ""
 
-    # [NEW CODE] ファイルの中身を非同期で読み込みます (バイト列として取得)
-    # awaitを使うことで、読み込み中に他の処理をブロックしません
-    content = await file.read()
-
-    # [NEW CODE] ファイル名の末尾(拡張子)を見て処理を分岐します
-    filename = file.filename.lower()
-
-    if filename.endswith(".pdf"):
-        # [NEW CODE] PDFファイルの処理:
-        # pypdfのPdfReaderを使って、バイト列からPDFを読み込みます
-        # io.BytesIOは、メモリ上のバイト列をファイルのように扱うためのクラスです
-        reader = PdfReader(io.BytesIO(content))
-        text = ""
-        
-        # [NEW CODE] 全ページをループしてテキストを抽出・結合します
-        for page in reader.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
-        return text
-
-    else:
-        # [NEW CODE] その他のファイル(主にテキスト)の処理:
-        # 単純にバイト列をUTF-8文字列に変換します
-        # errors="ignore" は、変換できない文字があってもエラーにせず無視する設定です
-        return content.decode("utf-8", errors="ignore")
+    path, sha256 = await spool_upload(file)
+    try:
+        return await extract_text_from_path(path, file.filename, sha256)
+    finally:
+        os.unlink(path)
@@ -1,11 +1,34 @@
 import re
-from typing import Dict
-from presidio_analyzer import AnalyzerEngine
+from typing import Dict, List
+from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine
 from presidio_analyzer.nlp_engine import NlpEngineProvider
 
+from pii_sidecar import PII_CLIENT
+
 # ===== Presidio Analyzer Initialization (Global Scope) =====
 # This is initialized once at module load time to avoid repeated model loading
 # Uses ja_core_news_lg for high-accuracy Japanese NLP
+# With PII_SIDECAR_SOCKET set, API workers never load it: pii_sidecar.py holds the only copy
+
+# Entity types to detect
+# PERSON: 人名
+# PHONE_NUMBER: 電話番号
+# EMAIL_ADDRESS: メールアドレス
+# LOCATION: 住所・地名
+# CREDIT_CARD: クレジットカード番号
+PII_ENTITIES = [
+    "PERSON",
+    "PHONE_NUMBER",
+    "EMAIL_ADDRESS",
+    "LOCATION",
+    "CREDIT_CARD"
+]
+PII_SCORE_THRESHOLD = 0.4  # Confidence threshold: 40%以上のみ検知
+# Regex fallback when Presidio (or the sidecar) is unavailable
+_PII_PATTERNS = {
+    "email": r"[\w\.-]+@[\w\.-]+\.[a-zA-Z]{2,}",
+    "phone": r"(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?)?\d{3,4}[-.\s]?\d{3,4}",
+}
 
 _ANALYZER_ENGINE = None
 
@@ -64,52 +87,59 @@ def detect_pii(message: str) -> Dict:
     Example:
         >>> detect_pii("私の名前は山田太郎です。電話番号は090-1234-5678です。")
         {'pii_detected': True, 'detected_types': ['PERSON', 'PHONE_NUMBER']}
+
+    With PII_SIDECAR_SOCKET set, the analysis runs in the shared sidecar process
+    (pii_sidecar.py); if it is unreachable, the regex fallback is used instead of
+    loading spaCy in this worker.
+    """
+    if PII_CLIENT is not None:
+        try:
+            return PII_CLIENT.analyze([message])[0]
+        except Exception:
+            # The client already warned (once per outage)
+            return detect_pii_regex(message)
+    return detect_pii_batch([message])[0]
+
+
+def detect_pii_batch(messages: List[str]) -> List[Dict]:
+    """
+    detect_pii() for several texts with the in-process Presidio analyzer.
+    The texts go through spaCy in one nlp.pipe() pass (used by the sidecar to batch requests).
     """
     try:
-        analyzer = _get_analyzer_engine()
-        
-        # Entity types to detect
-        # PERSON: 人名
-        # PHONE_NUMBER: 電話番号
-        # EMAIL_ADDRESS: メールアドレス
-        # LOCATION: 住所・地名
-        # CREDIT_CARD: クレジットカード番号
-        entities_to_detect = [
-            "PERSON",
-            "PHONE_NUMBER", 
-            "EMAIL_ADDRESS",
-            "LOCATION",
-            "CREDIT_CARD"
-        ]
-        
+        analyzer = BatchAnalyzerEngine(analyzer_engine=_get_analyzer_engine())
+
         # Analyze text (auto-detect language: ja or en)
-        results = analyzer.analyze(
-            text=message,
+        batch_results = analyzer.analyze_iterator(
+            messages,
             language="ja",  # Primary language
-            entities=entities_to_detect,
-            score_threshold=0.4  # Confidence threshold: 40%以上のみ検知
+            batch_size=max(1, len(messages)),
+            entities=PII_ENTITIES,
+            score_threshold=PII_SCORE_THRESHOLD
         )
-        
+
         # Extract unique entity types
-        detected_types = list(set([result.entity_type for result in results]))
-        
-        return {
-            "pii_detected": len(detected_types) > 0,
-            "detected_types": detected_types
-        }
-        
+        detected = []
+        for results in batch_results:
+            detected_types = list(set([result.entity_type for result in results]))
+            detected.append({
+                "pii_detected": len(detected_types) > 0,
+                "detected_types": detected_types
+            })
+        return detected
+
     except Exception as e:
         # Fallback to regex-based detection if Presidio fails
         print(f"[WARN] Presidio PII detection failed: {e}. Falling back to regex.")
-        patterns = {
-            "email": r"[\w\.-]+@[\w\.-]+\.[a-zA-Z]{2,}",
-            "phone": r"(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?)?\d{3,4}[-.\s]?\d{3,4}",
-        }
-        detected = []
-        for name, pat in patterns.items():
-            if re.search(pat, message):
-                detected.append(name)
-        return {"pii_detected": len(detected) > 0, "detected_types": detected}
+        return [detect_pii_regex(message) for message in messages]
+
+
+def detect_pii_regex(message: str) -> Dict:
+    detected = []
+    for name, pat in _PII_PATTERNS.items():
+        if re.search(pat, message):
+            detected.append(name)
+    return {"pii_detected": len(detected) > 0, "detected_types": detected}
 
 
 def decide_mode(message: str, policies: Dict, domain: str, pii_flags: Dict) -> str:
@@ -154,3 +184,12 @@ def select_model(mode: str, policies: Dict) -> str:
 
     # Final fallback
     return "openai:gpt4_mini"
+
+def merge_pii_results(results: List[Dict]) -> Dict:
+    """Combines detect_pii() results of several texts (e.g. the message and each attachment)."""
+    detected_types = []
+    for result in results:
+        for entity_type in result.get("detected_types", []):
+            if entity_type not in detected_types:
+                detected_types.append(entity_type)
+    return {"pii_detected": len(detected_types) > 0, "detected_types": detected_types}
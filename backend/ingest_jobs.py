@@ -0,0 +1,333 @@
+"""
+Background bulk ingestion for the knowledge base.
+
+POST /tenants/{tenant_id}/ingest/bulk spools the uploaded files (or the members
+of a zip archive) to temp files and returns a job id right away. Each file then
+goes through extract -> chunk -> embed -> index on the event loop / threadpool
+(files are keyed by name, so re-uploading a corpus only re-embeds what changed),
+with at most INGEST_CONCURRENCY files in flight across all jobs.
+Job state is kept in memory (bounded history) and exposed through
+GET /tenants/{tenant_id}/ingest/jobs/{job_id}.
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from file_parser import MAX_FILE_BYTES, extract_text_from_path, spool_upload
+from metrics import INGEST_STAGE_FILES, INGEST_STAGE_ITEMS, INGEST_STAGE_SECONDS
+from rag_kernel import summarize_plan
+
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "2"))
+INGEST_RETRY_BACKOFF_SECONDS = float(os.getenv("INGEST_RETRY_BACKOFF_SECONDS", "1.0"))
+INGEST_MAX_FILES_PER_JOB = int(os.getenv("INGEST_MAX_FILES_PER_JOB", "5000"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+# Total bytes a zip archive may expand to (zip bombs of many members each under FILE_MAX_BYTES)
+MAX_ZIP_EXPANDED_BYTES = int(os.getenv("INGEST_MAX_ZIP_EXPANDED_BYTES", str(2 * 1024 * 1024 * 1024)))  # 2GB
+
+STAGES = ("extract", "chunk", "embed", "index")
+
+# (filename, temp path or None, sha256 or None, error or None)
+SpooledItem = Tuple[str, Optional[str], Optional[str], Optional[str]]
+
+
+class PermanentIngestError(Exception):
+    """A file-level failure that retrying cannot fix (unreadable / empty / too large)."""
+
+
+def _new_stage_counters() -> Dict[str, Dict[str, float]]:
+    return {stage: {"files": 0, "items": 0, "seconds": 0.0} for stage in STAGES}
+
+
+def _stage_view(counters: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    view = {}
+    for stage, c in counters.items():
+        view[stage] = {
+            "files": c["files"],
+            "items": c["items"],
+            "seconds": round(c["seconds"], 3),
+            "items_per_second": round(c["items"] / c["seconds"], 2) if c["seconds"] > 0 else 0.0,
+        }
+    return view
+
+
+def _expand_zip(zip_path: str) -> List[SpooledItem]:
+    """
+    Extracts every regular member of a zip archive to its own temp file.
+    Member sizes and the running total are checked against the actual bytes read
+    (not the headers), so a crafted archive cannot bypass FILE_MAX_BYTES or
+    INGEST_MAX_ZIP_EXPANDED_BYTES.
+    """
+    items: List[SpooledItem] = []
+    try:
+        archive = zipfile.ZipFile(zip_path)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid zip archive")
+
+    expanded = 0
+    try:
+        with archive:
+            for info in archive.infolist():
+                name = info.filename
+                basename = os.path.basename(name)
+                if info.is_dir() or name.startswith("__MACOSX/") or not basename or basename.startswith("."):
+                    continue
+                if len(items) >= INGEST_MAX_FILES_PER_JOB:
+                    raise HTTPException(status_code=413, detail=f"Too many files (limit {INGEST_MAX_FILES_PER_JOB})")
+                if info.file_size > MAX_FILE_BYTES:
+                    items.append((name, None, None, f"file exceeds {MAX_FILE_BYTES} bytes"))
+                    continue
+
+                digest = hashlib.sha256()
+                size = 0
+                too_large = False
+                tmp = tempfile.NamedTemporaryFile(prefix="prism_ingest_", delete=False)
+                # 先に登録しておき、途中で 413 になっても一時ファイルを消せるようにする
+                items.append((name, tmp.name, None, None))
+                with tmp, archive.open(info) as src:
+                    while True:
+                        chunk = src.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        expanded += len(chunk)
+                        if expanded > MAX_ZIP_EXPANDED_BYTES:
+                            raise HTTPException(
+                                status_code=413,
+                                detail=f"Zip archive expands to more than {MAX_ZIP_EXPANDED_BYTES} bytes",
+                            )
+                        if size > MAX_FILE_BYTES:
+                            too_large = True
+                            break
+                        digest.update(chunk)
+                        tmp.write(chunk)
+                if too_large:
+                    os.unlink(tmp.name)
+                    items[-1] = (name, None, None, f"file exceeds {MAX_FILE_BYTES} bytes")
+                else:
+                    items[-1] = (name, tmp.name, digest.hexdigest(), None)
+    except BaseException:
+        IngestJobManager._cleanup(items)
+        raise
+    return items
+
+
+class IngestJobManager:
+    def __init__(self, retriever, concurrency: int = INGEST_CONCURRENCY, max_retries: int = INGEST_MAX_RETRIES):
+        self.retriever = retriever
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Strong refs so running jobs aren't garbage-collected
+        self._tasks = set()
+
+    # --- Public API ---
+
+    async def submit(self, tenant_id: str, uploader: str, files: List[UploadFile]) -> Dict[str, Any]:
+        items = await self._spool(files)
+        if not items:
+            raise HTTPException(status_code=400, detail="No files to ingest")
+
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "tenant_id": tenant_id,
+            "uploader": uploader,
+            "status": "queued",
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "started_at": None,
+            "finished_at": None,
+            "files": [
+                {
+                    "filename": name,
+                    "status": "failed" if error else "queued",
+                    "doc_id": None,
+                    "chunks": 0,
+                    "duplicate_chunks": 0,
+                    "near_duplicate_chunks": 0,
+                    "attempts": 0,
+                    "error": error,
+                }
+                for name, _, _, error in items
+            ],
+            "stages": _new_stage_counters(),
+        }
+        self._jobs[job_id] = job
+        while len(self._jobs) > INGEST_JOB_HISTORY:
+            self._jobs.popitem(last=False)
+
+        task = asyncio.create_task(self._run(job, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return self._view(job)
+
+    def get_job(self, tenant_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is None or job["tenant_id"] != tenant_id:
+            return None
+        return self._view(job, include_files=True)
+
+    def list_jobs(self, tenant_id: str) -> List[Dict[str, Any]]:
+        return [self._view(job) for job in reversed(self._jobs.values()) if job["tenant_id"] == tenant_id]
+
+    def stats(self) -> Dict[str, int]:
+        """Jobs kept in memory by status (/metrics: prism_ingest_jobs)."""
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
+
+    # --- Internals ---
+
+    async def _spool(self, files: List[UploadFile]) -> List[SpooledItem]:
+        # UploadFile objects are closed when the request ends, so everything is copied
+        # to temp files before the job id is returned.
+        items: List[SpooledItem] = []
+        try:
+            for file in files:
+                if not file.filename:
+                    continue
+                path, sha256 = await spool_upload(file)
+                if file.filename.lower().endswith(".zip"):
+                    try:
+                        items.extend(await run_in_threadpool(_expand_zip, path))
+                    finally:
+                        os.unlink(path)
+                else:
+                    items.append((file.filename, path, sha256, None))
+                if len(items) > INGEST_MAX_FILES_PER_JOB:
+                    raise HTTPException(status_code=413, detail=f"Too many files (limit {INGEST_MAX_FILES_PER_JOB})")
+        except BaseException:
+            self._cleanup(items)
+            raise
+        return items
+
+    @staticmethod
+    def _cleanup(items: List[SpooledItem]):
+        for _, path, _, _ in items:
+            if path and os.path.exists(path):
+                os.unlink(path)
+
+    def _record(self, job: Dict[str, Any], stage: str, seconds: float, items: int = 1):
+        counters = job["stages"][stage]
+        counters["files"] += 1
+        counters["items"] += items
+        counters["seconds"] += seconds
+        INGEST_STAGE_FILES.inc((stage,))
+        INGEST_STAGE_ITEMS.inc((stage,), items)
+        INGEST_STAGE_SECONDS.inc((stage,), seconds)
+
+    async def _run(self, job: Dict[str, Any], items: List[SpooledItem]):
+        job["status"] = "running"
+        job["started_at"] = datetime.utcnow().isoformat() + "Z"
+        try:
+            await asyncio.gather(*(
+                self._process_file(job, entry, path, sha256)
+                for entry, (_, path, sha256, error) in zip(job["files"], items)
+                if not error
+            ))
+        finally:
+            self._cleanup(items)
+            failed = sum(1 for f in job["files"] if f["status"] == "failed")
+            if failed == 0:
+                job["status"] = "completed"
+            elif failed == len(job["files"]):
+                job["status"] = "failed"
+            else:
+                job["status"] = "completed_with_errors"
+            job["finished_at"] = datetime.utcnow().isoformat() + "Z"
+
+    async def _process_file(self, job: Dict[str, Any], entry: Dict[str, Any], path: str, sha256: str):
+        async with self._semaphore:
+            entry["status"] = "running"
+            for attempt in range(1, self.max_retries + 2):
+                entry["attempts"] = attempt
+                try:
+                    entry["doc_id"] = await self._ingest_one(job, entry, path, sha256)
+                    entry["status"] = "completed"
+                    entry["error"] = None
+                    return
+                except (PermanentIngestError, HTTPException) as e:
+                    entry["error"] = getattr(e, "detail", None) or str(e)
+                    break
+                except Exception as e:
+                    entry["error"] = str(e)
+                    if attempt <= self.max_retries:
+                        entry["status"] = "retrying"
+                        await asyncio.sleep(INGEST_RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+            entry["status"] = "failed"
+            print(f"[WARN] Ingest job {job['job_id']}: {entry['filename']} failed: {entry['error']}")
+
+    async def _ingest_one(self, job: Dict[str, Any], entry: Dict[str, Any], path: str, sha256: str) -> str:
+        """Runs one file through the pipeline and returns the doc_id it ended up under."""
+        t = time.perf_counter()
+        text = await extract_text_from_path(path, entry["filename"], sha256)
+        self._record(job, "extract", time.perf_counter() - t)
+        if not text.strip():
+            raise PermanentIngestError("Could not extract text from file")
+
+        # Re-ingesting a file with the same name updates that document (only changed chunks are embedded)
+        t = time.perf_counter()
+        chunks = await run_in_threadpool(self.retriever.chunk_document, text)
+        doc_plan = await run_in_threadpool(self.retriever.plan_document, job["tenant_id"], entry["filename"], chunks)
+        self._record(job, "chunk", time.perf_counter() - t, len(chunks))
+        entry.update(summarize_plan(doc_plan))
+        if doc_plan["unchanged"]:
+            return doc_plan["doc_id"]
+
+        new_chunks = [p["text"] for p in doc_plan["chunks"] if p["duplicate_of"] is None]
+        t = time.perf_counter()
+        embeddings = await run_in_threadpool(self.retriever.embed_chunks, new_chunks)
+        self._record(job, "embed", time.perf_counter() - t, len(new_chunks))
+
+        metadata = {
+            "filename": entry["filename"],
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "uploader": job["uploader"],
+            "job_id": job["job_id"],
+        }
+        t = time.perf_counter()
+        summary = await run_in_threadpool(self.retriever.commit_document, job["tenant_id"], doc_plan, embeddings, metadata)
+        self._record(job, "index", time.perf_counter() - t, len(new_chunks))
+        entry.update(summary)
+        return doc_plan["doc_id"]
+
+    def _view(self, job: Dict[str, Any], include_files: bool = False) -> Dict[str, Any]:
+        files = job["files"]
+        total = len(files)
+        completed = sum(1 for f in files if f["status"] == "completed")
+        failed = sum(1 for f in files if f["status"] == "failed")
+        view = {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "progress": {
+                "total": total,
+                "completed": completed,
+                "failed": failed,
+                "pending": total - completed - failed,
+                "retries": sum(max(f["attempts"] - 1, 0) for f in files),
+                "percent": round(100.0 * (completed + failed) / total, 1) if total else 100.0,
+            },
+            "stages": _stage_view(job["stages"]),
+        }
+        if include_files:
+            view["files"] = [dict(f) for f in files]
+        else:
+            view["errors"] = [
+                {"filename": f["filename"], "error": f["error"]} for f in files if f["status"] == "failed"
+            ]
+        return view
@@ -0,0 +1,183 @@
+"""
+Fully local embedding backend (no API key, no model download).
+
+text -> normalized characters -> hashed character n-grams (2..3) -> sublinear TF x IDF
+     -> sparse random projection to RAG_LOCAL_EMBEDDING_DIM dims -> L2 normalized
+
+- Hashing is vectorized over the code points with NumPy (no per-n-gram Python loop),
+  so a query embeds in well under a millisecond and an 800-character chunk in about one.
+- Each of the 2^18 hash buckets is projected onto PROJECTION_NNZ random signed
+  coordinates (Achlioptas-style sparse projection): the projection tables (int32
+  indices + float32 signs) take about 8 MB instead of a dense 2^18 x dim matrix.
+- IDF comes from document frequencies of the chunks the catalog committed
+  (HybridRetriever.commit_document calls observe(); retries and reconcile re-embeds are
+  not counted again). Early chunks are embedded with fewer statistics than later ones;
+  the effect on ranking is small because the weights change slowly, and a fixed ingest
+  order gives bit-identical vectors (benchmarks / CI).
+- The counts are saved to RAG_LOCAL_EMBEDDING_STATS every
+  RAG_LOCAL_EMBEDDING_STATS_FLUSH_DOCS chunks and at shutdown. A save adds this worker's
+  new counts to the file under a lock and adopts the file's totals, so workers pick up
+  each other's counts instead of overwriting them (a crash loses the unsaved counts).
+
+Vectors from this backend are not comparable with Gemini vectors: switching
+RAG_EMBEDDING_BACKEND needs a fresh vector store (POST /knowledge/reconcile re-embeds
+every chunk from keyword_docs into an empty store).
+"""
+
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from dedup import normalize
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Projection noise on cosine scores is about 1/sqrt(dim); 1024 keeps it well below typical n-gram overlap
+LOCAL_EMBEDDING_DIM = int(os.getenv("RAG_LOCAL_EMBEDDING_DIM", "1024"))
+if os.path.exists("/app/data"):
+    # Docker環境 (永続ボリューム): the learned IDF must survive rebuilds along with the vectors built from it
+    _DEFAULT_STATS_PATH = "/app/data/local_embedding_df.npz"
+else:
+    # ローカル開発環境
+    _DEFAULT_STATS_PATH = "local_embedding_df.npz"
+LOCAL_EMBEDDING_STATS = os.getenv("RAG_LOCAL_EMBEDDING_STATS", _DEFAULT_STATS_PATH)
+LOCAL_EMBEDDING_STATS_FLUSH_DOCS = int(os.getenv("RAG_LOCAL_EMBEDDING_STATS_FLUSH_DOCS", "500"))
+NGRAM_SIZES = (2, 3)
+HASH_BITS = 18
+PROJECTION_NNZ = 4
+_SEED = 20251201
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+
+def _ngram_buckets(text: str) -> np.ndarray:
+    """Hash bucket of every character n-gram of the normalized text."""
+    codes = np.frombuffer(normalize(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return np.empty(0, dtype=np.int64)
+    sizes = [n for n in NGRAM_SIZES if n <= len(codes)] or [len(codes)]
+    parts = []
+    for n in sizes:
+        # Polynomial hash of each window, then a multiplicative mix so nearby n-grams spread out
+        h = np.full(len(codes) - n + 1, n, dtype=np.uint64)
+        for i in range(n):
+            h = (h * np.uint64(1000003)) ^ codes[i:len(codes) - n + 1 + i]
+        h = ((h * _MIX) & _MASK32) ^ (h >> np.uint64(29))
+        parts.append((h & np.uint64((1 << HASH_BITS) - 1)).astype(np.int64))
+    return np.concatenate(parts)
+
+
+@contextmanager
+def _locked(path: str):
+    """Exclusive flock on <path>.lock, held by one worker's read-modify-write of the stats file."""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class LocalEmbeddingService:
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM, stats_path: Optional[str] = LOCAL_EMBEDDING_STATS,
+                 flush_docs: int = LOCAL_EMBEDDING_STATS_FLUSH_DOCS):
+        self.dim = dim
+        self.stats_path = stats_path
+        self.flush_docs = flush_docs
+        rng = np.random.RandomState(_SEED)
+        buckets = 1 << HASH_BITS
+        self._proj_index = rng.randint(0, dim, size=(buckets, PROJECTION_NNZ)).astype(np.int32)
+        self._proj_sign = np.where(rng.rand(buckets, PROJECTION_NNZ) < 0.5, -1.0, 1.0).astype(np.float32)
+
+        self._lock = threading.Lock()
+        self._df, self._docs = self._read_stats()
+        # Counted since the last save (added to the file by save_stats)
+        self._unsaved_df = np.zeros(buckets, dtype=np.float64)
+        self._unsaved_docs = 0
+
+    def _read_stats(self) -> Tuple[np.ndarray, int]:
+        df = np.zeros(1 << HASH_BITS, dtype=np.float64)
+        if self.stats_path and os.path.exists(self.stats_path):
+            with np.load(self.stats_path) as stats:
+                if stats["df"].shape == df.shape:
+                    return stats["df"].astype(np.float64), int(stats["docs"])
+        return df, 0
+
+    @property
+    def observed_docs(self) -> int:
+        return self._docs
+
+    def _idf(self, buckets: np.ndarray) -> np.ndarray:
+        # Smoothed IDF; 1.0 everywhere until statistics exist
+        return np.log((1.0 + self._docs) / (1.0 + self._df[buckets])) + 1.0
+
+    def _embed(self, text: str) -> np.ndarray:
+        buckets, counts = np.unique(_ngram_buckets(text), return_counts=True)
+        out = np.zeros(self.dim, dtype=np.float32)
+        if len(buckets) == 0:
+            return out
+        weights = ((1.0 + np.log(counts)) * self._idf(buckets)).astype(np.float32)
+        np.add.at(out, self._proj_index[buckets].ravel(), (self._proj_sign[buckets] * weights[:, None]).ravel())
+        norm = np.linalg.norm(out)
+        return out / norm if norm > 0 else out
+
+    def observe(self, texts: List[str]):
+        """Adds committed chunks to the document-frequency statistics used for IDF."""
+        with self._lock:
+            for text in texts:
+                buckets = np.unique(_ngram_buckets(text))
+                self._df[buckets] += 1
+                self._unsaved_df[buckets] += 1
+            self._docs += len(texts)
+            self._unsaved_docs += len(texts)
+            flush = self._unsaved_docs >= self.flush_docs
+        if flush:
+            self.save_stats()
+
+    def save_stats(self):
+        """Adds the counts observed since the last save to the stats file and adopts its totals."""
+        if not self.stats_path:
+            return
+        with self._lock:
+            if not self._unsaved_docs:
+                return
+            tmp_path = None
+            try:
+                with _locked(self.stats_path):
+                    df, docs = self._read_stats()
+                    df += self._unsaved_df
+                    docs += self._unsaved_docs
+                    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(self.stats_path)),
+                                                     suffix=".tmp.npz", delete=False) as f:
+                        tmp_path = f.name
+                        np.savez(f, df=df.astype(np.float32), docs=docs)
+                    os.replace(tmp_path, self.stats_path)
+            except OSError as e:
+                print(f"[WARN] local embedding stats save failed: {e}")
+                if tmp_path:
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+                return
+            self._df, self._docs = df, docs
+            self._unsaved_df[:] = 0
+            self._unsaved_docs = 0
+
+    def embed_text(self, text: str) -> List[float]:
+        return self._embed(text).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return [self._embed(t).tolist() for t in texts]
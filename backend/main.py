@@ -1,30 +1,59 @@
+import asyncio
 import time
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, Form, Response, Depends, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Response, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from starlette.concurrency import run_in_threadpool
 from datetime import datetime
 import json
 import os
-from typing import List
+from typing import List, Optional
 
 from dotenv import load_dotenv
 
 from policy_store import load_policies
-from logging_db import init_db, insert_log_entry, get_recent_logs_for_tenant
-from governance_kernel import detect_domain, detect_pii, decide_mode, select_model
-from policy_compiler import build_system_prompt
-from providers import call_llm_stream
-from models import ChatResponse, LoginRequest, Log
-from file_parser import extract_text_from_file
+from logging_db import init_db, insert_log_entry_async, get_recent_logs_for_tenant_async
+from governance_kernel import detect_pii, merge_pii_results
+from chat_pipeline import build_log_entry, reply_meta, route, stream_reply
+from context_packer import excerpt_text, get_context_budget, pack_context
+from admission import ADMISSION, INGEST_POOL, PREPARE_POOL
+from output_shield import OutputShield, compile_pii_shield
+from metrics import (
+    ADMISSION_SLOTS, INGEST_JOBS_ACTIVE, METRICS_ENABLED, STORE_BYTES, STORE_ENTRIES, StageTimer, render_metrics,
+)
+from extraction_cache import EXTRACTION_CACHE
+from profiler import PROFILER, ProfilingMiddleware, annotate as annotate_profile
+from models import ChatResponse, LoginRequest
+from file_parser import extract_text_from_file, extract_text_from_path, shutdown_process_pool, spool_upload
 from rag_kernel import HybridRetriever
+from document_catalog import VersionConflictError
+from ingest_jobs import IngestJobManager
+from batch_jobs import BatchJobManager
+from sessions import (
+    SESSION_ATTACHMENT_TOKENS, SESSIONS, SessionNotFoundError,
+    add_attachment, attachment_id, describe as describe_session, find_attachment, history_text, record_turn, select_attachments,
+)
 from auth import create_access_token, get_current_context
 
 load_dotenv()
 
 BASE_DIR = Path(__file__).parent
 
+# ナレッジ一覧のページサイズ (大量の文書を持つテナントでも一覧が重くならないように)
+KNOWLEDGE_PAGE_SIZE = int(os.getenv("KNOWLEDGE_PAGE_SIZE", "50"))
+KNOWLEDGE_MAX_PAGE_SIZE = int(os.getenv("KNOWLEDGE_MAX_PAGE_SIZE", "500"))
+# RAG から取得する候補パッセージ数 (実際に使う数はトークン予算で決まります)
+RAG_CONTEXT_CANDIDATES = int(os.getenv("RAG_CONTEXT_CANDIDATES", "6"))
+# HybridRetriever.search のステージ名 -> /metrics のステージ名
+RETRIEVAL_STAGES = {
+    "embed_ms": "embed",
+    "vector_ms": "vector_search",
+    "keyword_ms": "keyword_search",
+    "collapse_ms": "collapse",
+    "mmr_ms": "mmr",
+}
+
 app = FastAPI(title="Governance Kernel v0.1")
 
 # [REFAC] CORS Update for Cookie Auth
@@ -39,23 +68,79 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Opt-in sampling profiler (PROFILER_ENABLED=1); a no-op pass-through otherwise
+app.add_middleware(ProfilingMiddleware)
 
 # Global State
 POLICIES = {}
+# safety.pii_shield compiled for the output stream (output_shield.py)
+OUTPUT_SHIELD_RULES = []
 RAG_ENGINE = None
+INGEST_JOBS = None
+BATCH_JOBS = None
 
 @app.on_event("startup")
 def startup_event():
-    global POLICIES, RAG_ENGINE
+    global POLICIES, OUTPUT_SHIELD_RULES, RAG_ENGINE, INGEST_JOBS, BATCH_JOBS
     POLICIES = load_policies(BASE_DIR / "policies.yaml")
+    OUTPUT_SHIELD_RULES = compile_pii_shield(POLICIES)
+    ADMISSION.configure(POLICIES)
     init_db() # SQLModel init and seeding
     
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
-        print("WARNING: GEMINI_API_KEY not found. RAG will not work.")
+        # RAG_EMBEDDING_BACKEND=auto falls back to the local embedder (local_embeddings.py)
+        print("WARNING: GEMINI_API_KEY not found. RAG will use local embeddings.")
+    try:
+        RAG_ENGINE = HybridRetriever(api_key)
+    except ValueError as e:
+        print(f"WARNING: RAG disabled: {e}")
         RAG_ENGINE = None
     else:
-        RAG_ENGINE = HybridRetriever(api_key)
+        # Finish / roll back document writes interrupted by a previous crash
+        RAG_ENGINE.recover_pending_ops()
+        RAG_ENGINE.check_embedding_dimensions()
+        INGEST_JOBS = IngestJobManager(RAG_ENGINE)
+    # Batch prompts run without RAG when the engine is disabled, like /chat
+    BATCH_JOBS = BatchJobManager(POLICIES, OUTPUT_SHIELD_RULES, RAG_ENGINE)
+
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_process_pool()
+    if RAG_ENGINE is not None:
+        RAG_ENGINE.save_embedding_stats()
+
+def _sample_gauges():
+    cache, sessions = EXTRACTION_CACHE.stats(), SESSIONS.stats()
+    STORE_ENTRIES.replace({
+        ("extraction_cache", "memory"): cache["memory_entries"],
+        ("extraction_cache", "disk"): cache["disk_entries"],
+        ("sessions", "memory"): sessions["memory_sessions"],
+        ("sessions", "disk"): sessions["disk_sessions"],
+    })
+    STORE_BYTES.replace({
+        ("extraction_cache", "memory"): cache["memory_bytes"],
+        ("extraction_cache", "disk"): cache["disk_bytes"],
+        ("sessions", "memory"): sessions["memory_bytes"],
+        ("sessions", "disk"): sessions["disk_bytes"],
+    })
+    ADMISSION_SLOTS.replace({
+        (pool, state): value
+        for pool, stats in ADMISSION.stats().items() for state, value in stats.items()
+    })
+    INGEST_JOBS_ACTIVE.replace({(status,): n for status, n in (INGEST_JOBS.stats() if INGEST_JOBS else {}).items()})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus scrape endpoint: per-stage /chat latency histograms, single-flight / extraction cache /
+    ingest stage counters, and gauges sampled now (store sizes, admission slots, ingest jobs).
+    Per-process values: with several workers each scrape sees the worker that answered it.
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    _sample_gauges()
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 # --- Auth Endpoints ---
 
@@ -86,152 +171,452 @@ def logout(response: Response):
 
 # --- Tenant Scoped Endpoints ---
 
+def _remove_spooled(uploads):
+    for _, path, _ in uploads:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
 @app.post("/tenants/{tenant_id}/chat")
 async def chat_endpoint(
     tenant_id: str,
     message: str = Form(...),
     files: List[UploadFile] = File(default=[]),
+    session_id: Optional[str] = Form(None),
+    attachment_ids: Optional[str] = Form(None),
     context: dict = Depends(get_current_context)
 ):
+    """
+    Streams NDJSON events (status / chunk / complete / error).
+    session_id (from POST /tenants/{tenant_id}/sessions) makes the call a turn of that conversation:
+    earlier attachments are reused without re-upload (attachment_ids: comma-separated subset, default all).
+    """
     user_id = context["user_id"]
     
     try:
+        # Rate limits / queue length: fail fast with 429 before any work is done
+        ADMISSION.admit(tenant_id, user_id)
         start = time.time()
+        timer = StageTimer()
 
-        # Handle Files
-        if files:
-            file_contents = []
-            for file in files:
-                if file.filename:
-                    content = await extract_text_from_file(file)
-                    file_contents.append(f"Filename: {file.filename}\nContent:\n{content}")
-            
-            if file_contents:
-                message += "\n\n[Attached Files]\n" + "\n---\n".join(file_contents)
-
-        # Governance Logic
-        domain = detect_domain(message)
-        pii = detect_pii(message)
-        mode = decide_mode(message, POLICIES, domain, pii)
-
-        if files and mode == "FAST":
-             mode = "HEAVY"
-
-        model = select_model(mode, POLICIES)
-        system_prompt = build_system_prompt(mode, POLICIES)
+        session = None
+        session_attachments = []
+        if session_id:
+            try:
+                session = await run_in_threadpool(SESSIONS.get, session_id, tenant_id, user_id)
+            except SessionNotFoundError:
+                raise HTTPException(status_code=404, detail="Session not found")
+            ids = None if attachment_ids is None else [i.strip() for i in attachment_ids.split(",") if i.strip()]
+            try:
+                session_attachments = select_attachments(session, ids)
+            except KeyError as e:
+                raise HTTPException(status_code=400, detail=f"Unknown attachment id: {e.args[0]}")
+
+        # Uploads are only spooled to disk here (UploadFile is closed once the endpoint returns).
+        # Extraction runs inside the stream, concurrently with PII analysis and retrieval.
+        uploads = []
+        try:
+            with timer.span("upload"):
+                for file in files or []:
+                    if file.filename:
+                        path, sha256 = await spool_upload(file)
+                        uploads.append((file.filename, path, sha256))
+        except BaseException:
+            _remove_spooled(uploads)
+            raise
 
         async def stream_generator():
-            nonlocal system_prompt
             full_reply = ""
+            mode = None
+            tasks = []
             
             try:
-                # 1. Status: Searching
+                # 1. Status: the stream opens before any governance / retrieval work is done
                 yield json.dumps({"type": "status", "content": "🔍 Searching Knowledge Base..."}) + "\n"
-
-                if RAG_ENGINE:
-                    # [REFAC] Pass tenant_id to RAG
-                    context_docs = await run_in_threadpool(RAG_ENGINE.search, tenant_id, message, n_results=3)
-                    if context_docs:
-                        context_str = "\n\n".join(context_docs)
-                        current_system_prompt = system_prompt + f"\n\n[Reference Information]\nUse the following information to answer the user's request if relevant:\n{context_str}\n"
-                    else:
-                        current_system_prompt = system_prompt
-                else:
-                    current_system_prompt = system_prompt
-
-                # 2. Status: Generating
-                yield json.dumps({"type": "status", "content": "🤖 Generating Response..."}) + "\n"
-
-                # Streaming Call
-                async for chunk in call_llm_stream(model, current_system_prompt, message):
-                    full_reply += chunk
-                    data = {"type": "chunk", "content": chunk}
-                    yield json.dumps(data) + "\n"
+                if uploads:
+                    yield json.dumps({"type": "status", "content": "📎 Reading attached files..."}) + "\n"
+
+                # Extraction, Presidio and retrieval run on the threadpool: a bounded, tenant-fair "prepare"
+                # pool keeps one tenant's burst of large attachments from taking every worker thread
+                if ADMISSION.would_wait(PREPARE_POOL):
+                    yield json.dumps({"type": "status", "content": "⏳ Waiting for a free worker..."}) + "\n"
+                prepared = {}
+                async with ADMISSION.slot(PREPARE_POOL, tenant_id, prepared):
+                    timer.add("prepare_wait", prepared.get("queue_wait_ms", 0))
+
+                    async def retrieve():
+                        if not RAG_ENGINE:
+                            return [], {}
+                        timings = {}
+                        # [REFAC] Pass tenant_id to RAG
+                        with timer.span("retrieval"):
+                            docs = await run_in_threadpool(
+                                RAG_ENGINE.search, tenant_id, message, n_results=RAG_CONTEXT_CANDIDATES, timings=timings
+                            )
+                        for key, stage in RETRIEVAL_STAGES.items():
+                            timer.add(stage, timings.get(key))
+                        return docs, timings
+
+                    async def scan(text):
+                        # Presidio / spaCy is blocking: keep it off the event loop
+                        with timer.span("pii"):
+                            return await run_in_threadpool(detect_pii, text)
+
+                    async def extract_and_scan(filename, path, sha256):
+                        # Same file already in the session: no extraction, no PII scan
+                        cached = find_attachment(session, filename, sha256)
+                        if cached is not None:
+                            return (filename, cached["text"]), cached["pii"]
+                        with timer.span("extract"):
+                            content = await extract_text_from_path(path, filename, sha256)
+                        return (filename, content), await scan(content)
+
+                    # Retrieval only needs the question, and each attachment is scanned as soon as it is extracted,
+                    # so the wait is roughly the slowest of these stages rather than their sum
+                    rag_task = asyncio.create_task(retrieve())
+                    pii_task = asyncio.create_task(scan(message))
+                    file_tasks = [asyncio.create_task(extract_and_scan(*u)) for u in uploads]
+                    tasks = [rag_task, pii_task, *file_tasks]
+
+                    file_results = await asyncio.gather(*file_tasks)
+                    attachments = [attachment for attachment, _ in file_results]
+                    message_pii = await pii_task
+                    pii_results = [message_pii] + [file_pii for _, file_pii in file_results]
+
+                    # Governance runs on the full text (question + every attachment), before any budget trimming
+                    governed_text = message
+                    if attachments:
+                        governed_text += "\n\n[Attached Files]\n" + "\n---\n".join(
+                            f"Filename: {name}\nContent:\n{content}" for name, content in attachments
+                        )
+
+                    # Session turn: earlier attachments (not re-uploaded now) go in as excerpts for this question,
+                    # with their cached PII results; earlier messages are in the history, so their PII flags count too
+                    if session is not None:
+                        uploaded_ids = {attachment_id(sha256, name) for name, _, sha256 in uploads}
+                        referenced = [(att_id, att) for att_id, att in session_attachments if att_id not in uploaded_ids]
+                        per_attachment = SESSION_ATTACHMENT_TOKENS // max(1, len(referenced))
+                        for att_id, att in referenced:
+                            attachments.append((att["filename"], excerpt_text(message, att["text"], per_attachment)))
+                            pii_results.append(att["pii"])
+                        if referenced:
+                            governed_text += "\n\n[Session Attachments]\n" + "\n".join(
+                                f"{att['filename']} (id: {att_id})" for att_id, att in referenced
+                            )
+                        pii_results.append(session["pii"])
+                    pii = merge_pii_results(pii_results)
+
+                    # Governance Logic
+                    mode, model, system_prompt = route(governed_text, POLICIES, pii, bool(attachments))
+                    annotate_profile(mode=mode)
+
+                    context_docs, retrieval_timings = await rag_task
+                    retrieved_docs = context_docs
+                    history = history_text(session)
+                    if session is not None:
+                        # Passages of the previous turn stay available behind the fresh ones (follow-up questions)
+                        context_docs = context_docs + [d for d in session["context_docs"] if d not in context_docs]
+
+                    # Fit passages and attachments into the mode's token budget (policies.yaml: context_budget)
+                    with timer.span("pack"):
+                        packed = pack_context(system_prompt, message, context_docs, attachments, get_context_budget(mode, POLICIES), history)
+                    packed["stats"]["retrieval_ms"] = retrieval_timings
+                    current_system_prompt = packed["system_prompt"]
+                    prompt_message = packed["message"]
+
+                # Per-mode concurrency cap (policies.yaml: max_concurrency); saturated modes wait in a fair queue
+                if ADMISSION.would_wait(mode):
+                    yield json.dumps({"type": "status", "content": f"⏳ Waiting for a free {mode} slot..."}) + "\n"
+                admission = {}
+                async with ADMISSION.slot(mode, tenant_id, admission):
+                    timer.add("queue_wait", admission.get("queue_wait_ms", 0))
+                    queue_wait_ms = prepared.get("queue_wait_ms", 0) + admission.get("queue_wait_ms", 0)
+
+                    # 2. Status: Generating
+                    yield json.dumps({"type": "status", "content": "🤖 Generating Response...", "queue_wait_ms": queue_wait_ms}) + "\n"
+
+                    # Streaming Call (time to first token and the rest of the generation are timed separately)
+                    # PII in the output is masked as it streams (policies.yaml: pii_shield); only a short tail is held back
+                    shield = OutputShield(OUTPUT_SHIELD_RULES)
+                    async for chunk in stream_reply(model, packed, shield, timer):
+                        full_reply += chunk
+                        yield json.dumps({"type": "chunk", "content": chunk}) + "\n"
+                output_masked = shield.stats()
+
+                if session is not None:
+                    for (filename, _, sha256), ((_, content), file_pii) in zip(uploads, file_results):
+                        add_attachment(session, filename, sha256, content, file_pii)
+                    record_turn(session, message, full_reply, message_pii, retrieved_docs)
+                    with timer.span("session_save"):
+                        await run_in_threadpool(SESSIONS.save, session)
 
                 total_ms = int((time.time() - start) * 1000)
 
                 # Log (Async / Non-blocking)
-                # [REFAC] Use SQLModel Log object
-                log_entry = Log(
-                    timestamp=datetime.utcnow().isoformat() + "Z",
-                    user_id=user_id,
-                    tenant_id=tenant_id,
-                    mode=mode,
-                    model=model,
-                    policy_version=POLICIES.get("version", "0.0"),
-                    pii_mask_applied=pii.get("pii_detected", False),
-                    safety_flags=pii.get("detected_types", []),
-                    tools_used=[],
-                    latency_ms=total_ms,
-                    input_text=message,
-                    output_text=full_reply
+                log_entry = build_log_entry(
+                    user_id, tenant_id, mode, model, POLICIES, pii, total_ms, governed_text, full_reply,
+                    packed=packed, output_masked=output_masked, timer=timer, queue_wait_ms=queue_wait_ms,
                 )
-                
-                await run_in_threadpool(insert_log_entry, log_entry)
+                with timer.span("log_write"):
+                    await insert_log_entry_async(log_entry)
 
                 # Complete Notification
                 meta = {
                     "type": "complete",
-                    "meta": {
-                        "reply": full_reply,
-                        "mode": mode,
-                        "model": model,
-                        "policy_version": POLICIES.get("version", "0.0"),
-                        "safety_flags": ["pii"] if pii.get("pii_detected") else [],
-                        "tools_used": [],
-                        "latency_ms": total_ms
-                    }
+                    "meta": reply_meta(full_reply, mode, model, POLICIES, pii, total_ms, packed, queue_wait_ms, output_masked, timer),
                 }
+                if session is not None:
+                    meta["meta"]["session"] = describe_session(session)
                 yield json.dumps(meta) + "\n"
 
+            except HTTPException as e:
+                # e.g. 413 from file_parser page limits, 429 from admission, raised inside the stream
+                yield json.dumps({"type": "error", "content": e.detail}) + "\n"
             except Exception as e:
                 error_data = {"type": "error", "content": f"An error occurred during generation: {str(e)}"}
                 yield json.dumps(error_data) + "\n"
                 print(f"Stream Error: {e}")
-
-        return StreamingResponse(stream_generator(), media_type="application/x-ndjson")
-
+            finally:
+                # Client gone or a stage failed: don't leave the other stages running
+                for task in tasks:
+                    task.cancel()
+                _remove_spooled(uploads)
+                timer.finish(mode)
+
+        # Headers go out before the body: Server-Timing only covers the upload, the rest is in the complete event
+        server_timing = timer.server_timing()
+        headers = {"Server-Timing": server_timing} if server_timing else None
+        return StreamingResponse(stream_generator(), media_type="application/x-ndjson", headers=headers)
+
+    except HTTPException:
+        # e.g. 413 from file_parser size limits while spooling
+        raise
     except Exception as e:
         print(f"Endpoint Error: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+@app.post("/tenants/{tenant_id}/chat/batch", status_code=202)
+async def submit_chat_batch(
+    tenant_id: str,
+    file: UploadFile = File(...),
+    context: dict = Depends(get_current_context)
+):
+    """
+    Accepts a JSONL file of prompts ({"id": ..., "message": ...} per line), queues them as a
+    background job and returns the job id. Poll /chat/batch/{job_id}; results are at /chat/batch/{job_id}/output.
+    """
+    ADMISSION.admit(tenant_id, context["user_id"])
+    return await BATCH_JOBS.submit(tenant_id, context["user_id"], file)
+
+
+@app.get("/tenants/{tenant_id}/chat/batch")
+def list_chat_batches(tenant_id: str, context: dict = Depends(get_current_context)):
+    return BATCH_JOBS.list_jobs(tenant_id) if BATCH_JOBS else []
+
+
+@app.get("/tenants/{tenant_id}/chat/batch/{job_id}")
+def get_chat_batch(tenant_id: str, job_id: str, context: dict = Depends(get_current_context)):
+    job = BATCH_JOBS.get_job(tenant_id, job_id) if BATCH_JOBS else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+
+@app.get("/tenants/{tenant_id}/chat/batch/{job_id}/output")
+def download_chat_batch(tenant_id: str, job_id: str, context: dict = Depends(get_current_context)):
+    """Results so far as JSONL (one line per finished prompt, in completion order)."""
+    path = BATCH_JOBS.output_path(tenant_id, job_id) if BATCH_JOBS else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"batch-{job_id}.jsonl")
+
+
 @app.get("/tenants/{tenant_id}/policies")
 def get_policies(tenant_id: str, context: dict = Depends(get_current_context)):
     return POLICIES
 
 
 @app.get("/tenants/{tenant_id}/logs")
-def get_logs(tenant_id: str, limit: int = 50, context: dict = Depends(get_current_context)):
+async def get_logs(tenant_id: str, limit: int = 50, context: dict = Depends(get_current_context)):
     # [REFAC] Filter by tenant_id
-    return get_recent_logs_for_tenant(tenant_id, limit)
+    return await get_recent_logs_for_tenant_async(tenant_id, limit)
 
 
 @app.post("/tenants/{tenant_id}/ingest")
 async def ingest_document(
     tenant_id: str,
     file: UploadFile = File(...),
+    external_id: Optional[str] = Form(None),
     context: dict = Depends(get_current_context)
 ):
+    """
+    Adds a document, or updates it if one with the same external_id (default: filename) exists.
+    Only changed chunks are re-embedded.
+    """
     if not RAG_ENGINE:
         return {"error": "RAG Engine not initialized"}
     
-    content = await extract_text_from_file(file)
-    if not content:
-        return {"error": "Could not extract text from file"}
-        
-    # [REFAC] Pass tenant_id
-    doc_id = RAG_ENGINE.add_document(
-        tenant_id,
-        content,
-        metadata={"filename": file.filename, "timestamp": datetime.utcnow().isoformat() + "Z", "uploader": context["user_id"]}
-    )
-    return {"status": "success", "doc_id": doc_id, "filename": file.filename}
+    ADMISSION.admit(tenant_id, context["user_id"])
+    async with ADMISSION.slot(INGEST_POOL, tenant_id):
+        content = await extract_text_from_file(file)
+        if not content:
+            return {"error": "Could not extract text from file"}
+
+        # [REFAC] Pass tenant_id
+        try:
+            result = await run_in_threadpool(
+                RAG_ENGINE.ingest_document,
+                tenant_id,
+                content,
+                metadata={"filename": file.filename, "timestamp": datetime.utcnow().isoformat() + "Z", "uploader": context["user_id"]},
+                doc_key=external_id
+            )
+        except VersionConflictError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    # result: doc_id, version, unchanged, chunk counts (new / unchanged / duplicate / removed)
+    return {"status": "success", "filename": file.filename, **result}
+
+
+@app.post("/tenants/{tenant_id}/ingest/bulk", status_code=202)
+async def bulk_ingest_documents(
+    tenant_id: str,
+    files: List[UploadFile] = File(...),
+    context: dict = Depends(get_current_context)
+):
+    """
+    Accepts many files and/or zip archives, queues them as a background job and
+    returns the job id immediately. Poll /ingest/jobs/{job_id} for progress.
+    """
+    if not INGEST_JOBS:
+        return {"error": "RAG Engine not initialized"}
+    ADMISSION.admit(tenant_id, context["user_id"])
+    return await INGEST_JOBS.submit(tenant_id, context["user_id"], files)
+
+
+@app.get("/tenants/{tenant_id}/ingest/jobs")
+def list_ingest_jobs(tenant_id: str, context: dict = Depends(get_current_context)):
+    if not INGEST_JOBS:
+        return []
+    return INGEST_JOBS.list_jobs(tenant_id)
+
+
+@app.get("/tenants/{tenant_id}/ingest/jobs/{job_id}")
+def get_ingest_job(tenant_id: str, job_id: str, context: dict = Depends(get_current_context)):
+    job = INGEST_JOBS.get_job(tenant_id, job_id) if INGEST_JOBS else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    return job
 
 
 @app.get("/tenants/{tenant_id}/knowledge")
-def get_knowledge_base(tenant_id: str, context: dict = Depends(get_current_context)):
+def get_knowledge_base(
+    tenant_id: str,
+    limit: int = Query(KNOWLEDGE_PAGE_SIZE, ge=1, le=KNOWLEDGE_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    filename: Optional[str] = None,
+    uploader: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    context: dict = Depends(get_current_context)
+):
+    """
+    Paginated document listing for the knowledge-base tab (metadata only, newest first).
+    Pass next_cursor from the previous page as cursor; offset is kept for simple clients.
+    """
     if not RAG_ENGINE:
-        return []
+        return {"items": [], "next_cursor": None}
     # [REFAC] Pass tenant_id
-    return RAG_ENGINE.list_documents(tenant_id)
+    try:
+        return RAG_ENGINE.list_documents(
+            tenant_id, limit=limit, cursor=cursor, offset=offset,
+            filename=filename, uploader=uploader, since=since, until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/tenants/{tenant_id}/knowledge/{doc_id}")
+async def delete_knowledge_document(tenant_id: str, doc_id: str, context: dict = Depends(get_current_context)):
+    if not RAG_ENGINE:
+        return {"error": "RAG Engine not initialized"}
+    deleted = await run_in_threadpool(RAG_ENGINE.delete_document, tenant_id, doc_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"status": "success", "doc_id": doc_id}
+
+
+@app.post("/tenants/{tenant_id}/knowledge/reconcile")
+async def reconcile_knowledge_base(tenant_id: str, repair: bool = True, context: dict = Depends(get_current_context)):
+    """Admin only: checks (and by default repairs) consistency between Chroma, keyword_docs and the catalog."""
+    if context["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin role required")
+    if not RAG_ENGINE:
+        return {"error": "RAG Engine not initialized"}
+    return await run_in_threadpool(RAG_ENGINE.reconcile, tenant_id, repair)
+
+
+# --- Conversation sessions (see sessions.py) ---
+
+@app.post("/tenants/{tenant_id}/sessions")
+async def create_session(tenant_id: str, context: dict = Depends(get_current_context)):
+    """Starts a conversation; pass the returned session_id to /chat on every turn."""
+    session = await run_in_threadpool(SESSIONS.create, tenant_id, context["user_id"])
+    return describe_session(session)
+
+
+@app.get("/tenants/{tenant_id}/sessions/{session_id}")
+async def get_session(tenant_id: str, session_id: str, context: dict = Depends(get_current_context)):
+    """Attachments (ids for attachment_ids), merged PII flags and history size; no attachment text."""
+    try:
+        session = await run_in_threadpool(SESSIONS.get, session_id, tenant_id, context["user_id"])
+    except SessionNotFoundError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return describe_session(session)
+
+
+@app.delete("/tenants/{tenant_id}/sessions/{session_id}")
+async def delete_session(tenant_id: str, session_id: str, context: dict = Depends(get_current_context)):
+    try:
+        await run_in_threadpool(SESSIONS.delete, session_id, tenant_id, context["user_id"])
+    except SessionNotFoundError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"status": "success", "session_id": session_id}
+
+
+# --- Profiler (admin only, PROFILER_ENABLED=1) ---
+
+def _require_profiler_admin(context: dict):
+    if context["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin role required")
+    if not PROFILER.enabled:
+        raise HTTPException(status_code=404, detail="Profiler disabled")
+
+
+@app.get("/tenants/{tenant_id}/admin/profiler")
+def get_profiler_summary(tenant_id: str, context: dict = Depends(get_current_context)):
+    """Profiled requests and sample counts per (route, mode), plus the sampler's own CPU time."""
+    _require_profiler_admin(context)
+    return PROFILER.summary()
+
+
+@app.get("/tenants/{tenant_id}/admin/profiler/collapsed", response_class=PlainTextResponse)
+def get_profiler_collapsed(
+    tenant_id: str,
+    route: Optional[str] = None,
+    mode: Optional[str] = None,
+    context: dict = Depends(get_current_context)
+):
+    """Collapsed stacks for flamegraph.pl / speedscope, optionally filtered by route template and mode."""
+    _require_profiler_admin(context)
+    return PlainTextResponse(PROFILER.collapsed(route, mode))
+
+
+@app.delete("/tenants/{tenant_id}/admin/profiler")
+def reset_profiler(tenant_id: str, context: dict = Depends(get_current_context)):
+    _require_profiler_admin(context)
+    PROFILER.reset()
+    return {"status": "success"}
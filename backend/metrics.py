@@ -0,0 +1,222 @@
+"""
+Per-stage latency instrumentation for /chat.
+
+A StageTimer is created per request and collects stage durations (ms):
+
+    timer = StageTimer()
+    with timer.span("pii"):
+        pii = detect_pii(text)
+    timer.add("embed", retrieval_timings["embed_ms"])
+    ...
+    timer.finish(mode)   # -> histograms, once per request
+
+The durations go to
+- the process-wide histograms rendered by render_metrics() (GET /metrics, Prometheus text format),
+- the Log row (stage_timings) and the trailing "complete" NDJSON event,
+- the Server-Timing header (only stages finished before the stream starts; headers go out first).
+
+No prometheus_client dependency: a histogram and a counter with a lock are all we need.
+METRICS_ENABLED=0 turns every StageTimer into a no-op (no clock reads, no locking).
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Bucket upper bounds in seconds (Prometheus convention); from sub-millisecond stages up to long generations
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Iterable[float] = STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe_many(self, samples: Iterable[Tuple[Tuple[str, ...], float]]):
+        """samples: (label values, seconds). One lock acquisition per request instead of per stage."""
+        with self._lock:
+            for labels, seconds in samples:
+                series = self._series.get(labels)
+                if series is None:
+                    series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+                counts, total = series
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        counts[i] += 1
+                        break
+                else:
+                    counts[-1] += 1
+                total[0] += seconds
+
+    def observe(self, labels: Tuple[str, ...], seconds: float):
+        self.observe_many([(labels, seconds)])
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(c), t[0]) for k, (c, t) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, labels))
+            sep = "," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound:g}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter:
+    """Monotonic counter keyed by label values, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: Tuple[str, ...]) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{base}}} {value:g}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Counter):
+    """Current value keyed by label values (set, not incremented), rendered in Prometheus text format."""
+
+    def set(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def replace(self, values: Dict[Tuple[str, ...], float]):
+        """Sets every series at once; series missing from values are dropped (e.g. a status with no jobs left)."""
+        with self._lock:
+            self._values = dict(values)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+STAGE_SECONDS = Histogram(
+    "prism_chat_stage_duration_seconds",
+    "Duration of each /chat processing stage.",
+    ("stage", "mode"),
+)
+
+# singleflight.SingleFlight: role="leader" ran the work, role="coalesced" shared a concurrent leader's result
+SINGLEFLIGHT_CALLS = Counter(
+    "prism_singleflight_calls_total",
+    "Calls through the single-flight layer by kind and role.",
+    ("kind", "role"),
+)
+
+# extraction_cache.ExtractionCache.get: result="memory_hit" / "disk_hit" / "miss"
+EXTRACTION_CACHE_LOOKUPS = Counter(
+    "prism_extraction_cache_lookups_total",
+    "Extraction cache lookups by result.",
+    ("result",),
+)
+
+# ingest_jobs.IngestJobManager: work done per pipeline stage (items = chunks for chunk/embed/store)
+INGEST_STAGE_FILES = Counter("prism_ingest_stage_files_total", "Files processed per ingest stage.", ("stage",))
+INGEST_STAGE_ITEMS = Counter("prism_ingest_stage_items_total", "Items processed per ingest stage.", ("stage",))
+INGEST_STAGE_SECONDS = Counter("prism_ingest_stage_seconds_total", "Time spent per ingest stage.", ("stage",))
+
+# Sampled on each scrape (main.metrics) from the owners' stats()
+STORE_ENTRIES = Gauge("prism_store_entries", "Entries held by the in-process stores.", ("store", "tier"))
+STORE_BYTES = Gauge("prism_store_bytes", "Bytes held by the in-process stores.", ("store", "tier"))
+ADMISSION_SLOTS = Gauge("prism_admission_slots", "Admission pool capacity, slots in use and queued requests.", ("pool", "state"))
+INGEST_JOBS_ACTIVE = Gauge("prism_ingest_jobs", "Ingest jobs kept in memory, by status.", ("status",))
+
+GAUGES = (STORE_ENTRIES, STORE_BYTES, ADMISSION_SLOTS, INGEST_JOBS_ACTIVE)
+
+
+class StageTimer:
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = METRICS_ENABLED if enabled is None else enabled
+        self.started = time.perf_counter() if self.enabled else 0.0
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        if not self.enabled:
+            yield
+            return
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - t) * 1000)
+
+    def add(self, stage: str, ms: Optional[float]):
+        """Adds ms to the stage (a stage run several times, e.g. one extraction per file, accumulates)."""
+        if self.enabled and ms is not None:
+            self.stages[stage] = round(self.stages.get(stage, 0.0) + ms, 3)
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 3) if self.enabled else 0.0
+
+    def snapshot(self) -> Optional[Dict[str, float]]:
+        """Stage timings so far plus "total"; None when disabled (stored as NULL in the Log row)."""
+        if not self.enabled:
+            return None
+        return {**self.stages, "total": self.elapsed_ms()}
+
+    def server_timing(self) -> Optional[str]:
+        """Server-Timing header value for the stages recorded so far."""
+        if not self.enabled or not self.stages:
+            return None
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in self.stages.items())
+
+    def finish(self, mode: str):
+        """Feeds every stage (and the total) into the histograms. Call once per request."""
+        timings = self.snapshot()
+        if timings is None:
+            return
+        STAGE_SECONDS.observe_many(((stage, mode or "unknown"), ms / 1000) for stage, ms in timings.items())
+
+
+def render_metrics() -> str:
+    families = (STAGE_SECONDS, SINGLEFLIGHT_CALLS, EXTRACTION_CACHE_LOOKUPS,
+                INGEST_STAGE_FILES, INGEST_STAGE_ITEMS, INGEST_STAGE_SECONDS) + GAUGES
+    return "\n".join(line for family in families for line in family.render()) + "\n"
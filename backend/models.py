@@ -66,6 +66,13 @@ class Log(SQLModel, table=True):
     latency_ms: int
     input_text: str
     output_text: str
+    # Estimated prompt size and packing decisions (see context_packer.pack_context)
+    prompt_tokens: Optional[int] = None
+    context_stats: Optional[Dict[str, Any]] = Field(default=None, sa_type=JSON)
+    # Per-stage milliseconds (extract, pii, embed, vector_search, ..., llm_ttft, llm_generate, total); see metrics.StageTimer
+    stage_timings: Optional[Dict[str, float]] = Field(default=None, sa_type=JSON)
+    # Time spent waiting for a free mode slot (admission.py)
+    queue_wait_ms: Optional[int] = None
 
     user: User = Relationship(back_populates="logs")
     tenant: Tenant = Relationship(back_populates="logs")
@@ -0,0 +1,193 @@
+"""
+Incremental PII masking of the LLM output stream (policies.yaml: safety.pii_shield).
+
+    rules = compile_pii_shield(POLICIES)        # once, when the policies are loaded
+    shield = OutputShield(rules)                # per response
+    for chunk in stream:
+        yield shield.feed(chunk)                # masked text that can no longer change
+    yield shield.flush()                        # the held-back tail
+
+Each pii_shield group maps its examples to detectors and applies its mask_strategy:
+    full_mask         -> mask_token                     (direct_ids: email, phone_number, credit_card)
+    head1_mask        -> first visible_chars + mask_char (quasi_ids: person_name, partial_address)
+    category_replace  -> categories[category]            (code_names: literal terms listed under terms)
+echo_pii_back: true turns masking off.
+
+Only a small tail is held back between chunks, never the whole reply:
+- text up to the last line / sentence break (newline, 。, 、, ！, ？) is final, because no
+  detector matches across those characters;
+- otherwise the last OUTPUT_SHIELD_CARRY_CHARS characters are held back, so an entity split
+  over chunk boundaries (e.g. "090-12" + "34-5678") is complete before anything is released;
+- a match that straddles the release point is held back whole.
+Entities longer than the carry-over window that arrive without a break can slip through split.
+
+Detectors are regular expressions, not Presidio: spaCy per chunk would add its latency to
+every chunk. Names are found by honorifics (山田さん, 佐藤様, 田中氏), addresses by
+prefecture + municipality (+ street and block number); the input side keeps using Presidio (governance_kernel.detect_pii).
+"""
+
+import os
+import re
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+OUTPUT_SHIELD_ENABLED = os.getenv("OUTPUT_SHIELD_ENABLED", "1") == "1"
+OUTPUT_SHIELD_CARRY_CHARS = int(os.getenv("OUTPUT_SHIELD_CARRY_CHARS", "64"))
+
+# Characters no detector matches across: text before the last one can be released
+_BREAKS = re.compile(r"[\n。、！？]")
+# Words before an honorific that are not names
+_NOT_NAMES = {"御社", "貴社", "弊社", "当社", "担当", "皆様", "各位", "先生", "社長", "部長", "課長", "係長", "店長", "会長", "院長", "患者", "利用者", "管理者"}
+
+
+def _luhn_ok(digits: str) -> bool:
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        d = int(ch)
+        if i % 2:
+            d = d * 2 - 9 if d > 4 else d * 2
+        total += d
+    return total % 10 == 0
+
+
+# Policy example name -> (pattern, validator of the matched text)
+_DETECTORS: Dict[str, Tuple[Pattern, Optional[Callable[[str], bool]]]] = {
+    "email": (re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)*\.[A-Za-z]{2,}"), None),
+    # Starts with 0 or +81 so that amounts and years are left alone
+    "phone_number": (re.compile(r"(?<![\d+])(?:\+81[- ]?|0)\d{1,4}[- ]?\d{1,4}[- ]?\d{3,4}(?!\d)"), None),
+    "credit_card": (
+        re.compile(r"(?<!\d)(?:\d{4}[- ]?){3}\d{4}(?!\d)"),
+        lambda text: _luhn_ok(re.sub(r"\D", "", text)),
+    ),
+    # Kanji surname / full name or katakana name before an honorific; the honorific itself stays
+    "person_name": (
+        re.compile(r"(?<![一-龥々])[一-龥々]{2,4}(?=さん|様|氏|殿)|(?<![ァ-ヶー])[ァ-ヶー]{2,10}(?=さん|様|氏)"),
+        lambda text: text not in _NOT_NAMES,
+    ),
+    "partial_address": (
+        # prefecture + municipality, then either town names ending in 町/村/区 (中区山下町) or any kanji/katakana
+        # run (street, e.g. 六本木) followed by the block number (1-2-3, 1丁目2番3号)
+        re.compile(
+            r"(?:東京都|北海道|(?:大阪|京都)府|[一-龥]{2,3}県)[一-龥ァ-ヶ]{1,6}?[市区町村]"
+            r"(?:[一-龥々ァ-ヶー]{0,10}\d{1,4}(?:(?:丁目|番地?|[-ー－])\d{1,4}){0,2}(?:番地?|号)?|(?:[一-龥々ァ-ヶ]{1,6}?[町村区]){1,2})?"
+        ),
+        None,
+    ),
+}
+
+
+class ShieldRule:
+    def __init__(self, category: str, pattern: Pattern, replace: Callable[[str], str],
+                 validate: Optional[Callable[[str], bool]] = None):
+        self.category = category
+        self.pattern = pattern
+        self.replace = replace
+        self.validate = validate
+
+
+def _full_mask(token: str) -> Callable[[str], str]:
+    return lambda text: token
+
+
+def _head_mask(visible: int, mask_char: str) -> Callable[[str], str]:
+    return lambda text: text[:visible] + mask_char * max(0, len(text) - visible)
+
+
+def compile_pii_shield(policies: Dict) -> List[ShieldRule]:
+    """ShieldRules for safety.pii_shield (empty when echo_pii_back is true or nothing is configured)."""
+    shield = (policies.get("safety") or {}).get("pii_shield") or {}
+    if not OUTPUT_SHIELD_ENABLED or shield.get("echo_pii_back"):
+        return []
+    rules = []
+    for group_name, group in shield.items():
+        if not isinstance(group, dict):
+            continue
+        strategy = group.get("mask_strategy")
+        if strategy == "category_replace":
+            terms = group.get("terms") or {}
+            for category, token in (group.get("categories") or {}).items():
+                words = sorted((t for t in terms.get(category) or [] if t and not _BREAKS.search(t)), key=len, reverse=True)
+                if words:
+                    pattern = re.compile("|".join(re.escape(w) for w in words), re.IGNORECASE)
+                    rules.append(ShieldRule(category, pattern, _full_mask(token)))
+            continue
+        if strategy == "full_mask":
+            replace = _full_mask(group.get("mask_token", "[REDACTED]"))
+        elif strategy == "head1_mask":
+            replace = _head_mask(int(group.get("visible_chars", 1)), group.get("mask_char", "*"))
+        else:
+            print(f"[WARN] pii_shield.{group_name}: unknown mask_strategy {strategy!r}, ignored")
+            continue
+        for example in group.get("examples") or []:
+            detector = _DETECTORS.get(example)
+            if detector is None:
+                print(f"[WARN] pii_shield.{group_name}: no output detector for {example!r}, ignored")
+                continue
+            rules.append(ShieldRule(example, detector[0], replace, detector[1]))
+    return rules
+
+
+class OutputShield:
+    def __init__(self, rules: List[ShieldRule], carry_chars: int = OUTPUT_SHIELD_CARRY_CHARS):
+        self.rules = rules
+        self.carry_chars = carry_chars
+        self.buffer = ""
+        # category -> number of masked matches
+        self.masked: Counter = Counter()
+
+    def _spans(self, text: str) -> List[Tuple[int, int, ShieldRule]]:
+        """Non-overlapping matches, earliest first (longest wins on the same start)."""
+        found = []
+        for rule in self.rules:
+            for m in rule.pattern.finditer(text):
+                if m.end() > m.start() and (rule.validate is None or rule.validate(m.group())):
+                    found.append((m.start(), m.end(), rule))
+        found.sort(key=lambda s: (s[0], -s[1]))
+        spans, last_end = [], 0
+        for start, end, rule in found:
+            if start >= last_end:
+                spans.append((start, end, rule))
+                last_end = end
+        return spans
+
+    def _release(self, end: int, spans: List[Tuple[int, int, ShieldRule]]) -> str:
+        parts, pos = [], 0
+        for start, stop, rule in spans:
+            if stop > end:
+                break
+            parts.append(self.buffer[pos:start])
+            parts.append(rule.replace(self.buffer[start:stop]))
+            self.masked[rule.category] += 1
+            pos = stop
+        parts.append(self.buffer[pos:end])
+        self.buffer = self.buffer[end:]
+        return "".join(parts)
+
+    def feed(self, chunk: str) -> str:
+        """Masked text that is final so far ("" while everything is still held back)."""
+        if not self.rules:
+            return chunk
+        self.buffer += chunk
+        end = len(self.buffer) - self.carry_chars
+        last_break = None
+        for last_break in _BREAKS.finditer(self.buffer):
+            pass
+        if last_break is not None:
+            end = max(end, last_break.end())
+        if end <= 0:
+            return ""
+        spans = self._spans(self.buffer)
+        for start, stop, _ in spans:
+            if start < end < stop:
+                end = start
+                break
+        return self._release(end, spans) if end > 0 else ""
+
+    def flush(self) -> str:
+        """The held-back tail, masked. Call once after the last chunk."""
+        if not self.buffer:
+            return ""
+        return self._release(len(self.buffer), self._spans(self.buffer))
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.masked)
@@ -0,0 +1,338 @@
+"""
+Shared PII analysis sidecar (optional).
+
+Each uvicorn worker that runs Presidio loads its own ja_core_news_lg (+ en_core_web_sm),
+so memory grows with the worker count. Run one sidecar per node instead and point the
+workers at it:
+
+    python pii_sidecar.py --socket /run/prism/pii.sock      # loads spaCy once
+    PII_SIDECAR_SOCKET=/run/prism/pii.sock uvicorn main:app --workers 8
+
+The workers are thin clients (governance_kernel.detect_pii -> PII_CLIENT): a small pool of
+reused Unix-socket connections. They still import presidio_analyzer (and with it spaCy) but
+never load the spaCy models, which is where the memory goes. If the sidecar is down or too
+slow, detection falls back to the regex patterns, and the sidecar is not retried for
+PII_SIDECAR_RETRY_SECONDS so that requests don't each wait for a timeout.
+
+The sidecar collects texts from concurrent requests (all connections) for up to
+PII_SIDECAR_BATCH_WINDOW_MS or PII_SIDECAR_BATCH_MAX_TEXTS and analyzes them in one spaCy
+nlp.pipe() pass (governance_kernel.detect_pii_batch) on a single analyzer thread.
+
+Wire format (big-endian), one request / response per frame, frames prefixed by u32 length:
+
+    request:   u8 op (=1 ANALYZE) | u16 n | n x (u32 len | utf-8 text)
+    response:  u8 status (=0 OK)  | u16 n | n x (u8 k | k x u8 type code)
+               type code 255 = not in ENTITY_TYPES, followed by u8 len | ascii name
+    error:     u8 status (=1)     | u16 len | utf-8 message
+"""
+
+import argparse
+import asyncio
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+PII_SIDECAR_SOCKET = os.getenv("PII_SIDECAR_SOCKET", "")
+PII_SIDECAR_TIMEOUT_MS = int(os.getenv("PII_SIDECAR_TIMEOUT_MS", "10000"))
+PII_SIDECAR_POOL_SIZE = int(os.getenv("PII_SIDECAR_POOL_SIZE", "8"))
+PII_SIDECAR_RETRY_SECONDS = float(os.getenv("PII_SIDECAR_RETRY_SECONDS", "5"))
+PII_SIDECAR_BATCH_WINDOW_MS = float(os.getenv("PII_SIDECAR_BATCH_WINDOW_MS", "5"))
+PII_SIDECAR_BATCH_MAX_TEXTS = int(os.getenv("PII_SIDECAR_BATCH_MAX_TEXTS", "64"))
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+OP_ANALYZE = 1
+STATUS_OK = 0
+STATUS_ERROR = 1
+# Presidio entities (governance_kernel.PII_ENTITIES) and the regex fallback names; the index is the wire code
+ENTITY_TYPES = ("PERSON", "PHONE_NUMBER", "EMAIL_ADDRESS", "LOCATION", "CREDIT_CARD", "email", "phone")
+_OTHER_TYPE = 255
+_TYPE_CODES = {name: code for code, name in enumerate(ENTITY_TYPES)}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# --- Encoding ---
+
+def _frame(payload: bytes) -> bytes:
+    return struct.pack("!I", len(payload)) + payload
+
+
+def encode_request(texts: List[str]) -> bytes:
+    parts = [struct.pack("!BH", OP_ANALYZE, len(texts))]
+    for text in texts:
+        data = text.encode("utf-8")
+        parts.append(struct.pack("!I", len(data)))
+        parts.append(data)
+    return _frame(b"".join(parts))
+
+
+def decode_request(payload: bytes) -> List[str]:
+    op, n = struct.unpack_from("!BH", payload)
+    if op != OP_ANALYZE:
+        raise ProtocolError(f"unknown op {op}")
+    offset, texts = 3, []
+    for _ in range(n):
+        (length,) = struct.unpack_from("!I", payload, offset)
+        offset += 4
+        texts.append(payload[offset:offset + length].decode("utf-8"))
+        offset += length
+    return texts
+
+
+def encode_response(results: List[Dict]) -> bytes:
+    parts = [struct.pack("!BH", STATUS_OK, len(results))]
+    for result in results:
+        types = result["detected_types"]
+        parts.append(struct.pack("!B", len(types)))
+        for name in types:
+            code = _TYPE_CODES.get(name)
+            if code is None:
+                data = name.encode("ascii", "replace")[:255]
+                parts.append(struct.pack("!BB", _OTHER_TYPE, len(data)) + data)
+            else:
+                parts.append(struct.pack("!B", code))
+    return _frame(b"".join(parts))
+
+
+def encode_error(message: str) -> bytes:
+    data = message.encode("utf-8")[:65535]
+    return _frame(struct.pack("!BH", STATUS_ERROR, len(data)) + data)
+
+
+def decode_response(payload: bytes) -> List[Dict]:
+    status, n = struct.unpack_from("!BH", payload)
+    if status == STATUS_ERROR:
+        raise ProtocolError(payload[3:3 + n].decode("utf-8", "replace"))
+    offset, results = 3, []
+    for _ in range(n):
+        k = payload[offset]
+        offset += 1
+        types = []
+        for _ in range(k):
+            code = payload[offset]
+            offset += 1
+            if code == _OTHER_TYPE:
+                length = payload[offset]
+                types.append(payload[offset + 1:offset + 1 + length].decode("ascii"))
+                offset += 1 + length
+            else:
+                types.append(ENTITY_TYPES[code])
+        results.append({"pii_detected": len(types) > 0, "detected_types": types})
+    return results
+
+
+# --- Client (API workers) ---
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("PII sidecar closed the connection")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+class PiiSidecarClient:
+    """
+    Blocking client, safe to call from threadpool threads. Connections are kept in a pool
+    and reused; a reused connection that turns out to be dead (sidecar restarted) is
+    replaced once before the call fails.
+    """
+
+    def __init__(self, socket_path: str, timeout_ms: int = PII_SIDECAR_TIMEOUT_MS,
+                 pool_size: int = PII_SIDECAR_POOL_SIZE, retry_seconds: float = PII_SIDECAR_RETRY_SECONDS):
+        self.socket_path = socket_path
+        self.timeout = timeout_ms / 1000
+        self.retry_seconds = retry_seconds
+        self._pool: "queue.LifoQueue[socket.socket]" = queue.LifoQueue(maxsize=pool_size)
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _call(self, sock: socket.socket, request: bytes) -> List[Dict]:
+        sock.sendall(request)
+        (length,) = struct.unpack("!I", _recv_exact(sock, 4))
+        if length > MAX_FRAME_BYTES:
+            raise ProtocolError(f"response frame too large: {length}")
+        return decode_response(_recv_exact(sock, length))
+
+    def _request(self, request: bytes) -> Tuple[List[Dict], socket.socket]:
+        try:
+            sock = self._pool.get_nowait()
+        except queue.Empty:
+            sock = None
+        if sock is not None:
+            try:
+                return self._call(sock, request), sock
+            except ConnectionError:
+                # Pooled connection went stale (sidecar restarted): retry once on a new one
+                sock.close()
+            except BaseException:
+                sock.close()
+                raise
+        sock = self._connect()
+        try:
+            return self._call(sock, request), sock
+        except BaseException:
+            sock.close()
+            raise
+
+    def analyze(self, texts: List[str]) -> List[Dict]:
+        """detect_pii() results for the texts. Raises if the sidecar is unavailable."""
+        if time.monotonic() < self._down_until:
+            raise ConnectionError("PII sidecar marked down")
+        try:
+            results, sock = self._request(encode_request(texts))
+        except Exception as e:
+            with self._lock:
+                if time.monotonic() >= self._down_until:
+                    print(f"[WARN] PII sidecar unavailable ({e}). Using regex detection for {self.retry_seconds:g}s.")
+                self._down_until = time.monotonic() + self.retry_seconds
+            raise
+        try:
+            self._pool.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+        return results
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+PII_CLIENT: Optional[PiiSidecarClient] = PiiSidecarClient(PII_SIDECAR_SOCKET) if PII_SIDECAR_SOCKET else None
+
+
+# --- Server (sidecar process) ---
+
+class PiiSidecarServer:
+    def __init__(self, socket_path: str, analyze_batch: Optional[Callable[[List[str]], List[Dict]]] = None,
+                 batch_window_ms: float = PII_SIDECAR_BATCH_WINDOW_MS, batch_max_texts: int = PII_SIDECAR_BATCH_MAX_TEXTS):
+        if analyze_batch is None:
+            # Imported here: only the sidecar process loads Presidio / spaCy
+            from governance_kernel import detect_pii_batch
+            analyze_batch = detect_pii_batch
+        self.socket_path = socket_path
+        self.analyze_batch = analyze_batch
+        self.batch_window = batch_window_ms / 1000
+        self.batch_max_texts = batch_max_texts
+        # spaCy pipelines are not shared between threads: one analyzer thread, batches in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pii-analyzer")
+        self._pending: "asyncio.Queue[Tuple[List[str], asyncio.Future]]" = None
+        self.batches = 0
+        self.texts = 0
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.batch_window
+            while size < self.batch_max_texts:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._pending.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                results = await loop.run_in_executor(self._executor, self.analyze_batch, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            offset = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    (length,) = struct.unpack("!I", await reader.readexactly(4))
+                except asyncio.IncompleteReadError:
+                    return  # client closed the connection
+                if length > MAX_FRAME_BYTES:
+                    writer.write(encode_error(f"request frame too large: {length}"))
+                    return
+                payload = await reader.readexactly(length)
+                try:
+                    texts = decode_request(payload)
+                    future = asyncio.get_running_loop().create_future()
+                    await self._pending.put((texts, future))
+                    response = encode_response(await future)
+                except Exception as e:
+                    response = encode_error(str(e))
+                writer.write(response)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, ready: Optional[threading.Event] = None):
+        self._pending = asyncio.Queue()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left over from a previous run
+        batcher = asyncio.create_task(self._batcher())
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._executor.shutdown(wait=False)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared Presidio PII analysis service on a Unix socket.")
+    parser.add_argument("--socket", default=PII_SIDECAR_SOCKET or "/tmp/prism-pii.sock")
+    args = parser.parse_args()
+
+    server = PiiSidecarServer(args.socket)
+    # Load the models before accepting connections, so the first requests don't time out
+    started = time.perf_counter()
+    server.analyze_batch(["warmup"])
+    print(f"PII sidecar: analyzer ready in {time.perf_counter() - started:.1f}s, listening on {args.socket}")
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
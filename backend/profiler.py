@@ -0,0 +1,265 @@
+"""
+Opt-in sampling profiler for live requests (off by default).
+
+    PROFILER_ENABLED=1          turn the facility on
+    PROFILER_SAMPLE_RATE=0.01   profile this fraction of requests (0 = only on request)
+    X-Profile: 1                profile this request; honoured for tenant admins only
+
+While a profiled request is in flight, a background thread samples the Python stacks of
+every busy thread of the worker (event loop + threadpool) every PROFILER_INTERVAL_MS.
+Samples are aggregated per (route template, mode) as collapsed stacks ("a;b;c count"),
+the input format of flamegraph.pl / speedscope / inferno.
+
+Bounded overhead:
+- at most PROFILER_MAX_ACTIVE requests are profiled at the same time; further
+  candidates run unprofiled
+- a profile stops after PROFILER_MAX_SECONDS even if the stream continues
+- at most PROFILER_MAX_STACKS distinct stacks per key; the rest are counted as "[truncated]"
+The sampler only runs while a profile is active. Its own CPU time is reported by summary().
+
+Samples are process-wide. With concurrent traffic, the stacks include other requests that
+ran at the same time. Work in the PDF process pool (file_parser) is not visible here;
+it shows up as the waiting caller.
+"""
+
+import contextvars
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+PROFILER_MAX_ACTIVE = int(os.getenv("PROFILER_MAX_ACTIVE", "1"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "30"))
+PROFILER_MAX_STACKS = int(os.getenv("PROFILER_MAX_STACKS", "2000"))
+PROFILE_HEADER = "x-profile"
+MAX_DEPTH = 64
+
+# Leaf frames of threads that are parked (event loop waiting for I/O, idle pool workers)
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+_TENANT_PATH = re.compile(r"^/tenants/([^/]+)/")
+
+_CURRENT = contextvars.ContextVar("profile_session", default=None)
+
+
+class ProfileSession:
+    def __init__(self, route: str, reason: str):
+        self.route = route
+        self.reason = reason
+        self.mode = "-"
+        self.started = time.monotonic()
+        # Buffered here and merged on stop, when the mode is known
+        self.stacks: Counter = Counter()
+
+
+def annotate(mode: Optional[str] = None):
+    """Labels the request being profiled (no-op when the current request is not profiled)."""
+    session = _CURRENT.get()
+    if session is not None and mode:
+        session.mode = mode
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+def _collapse(frame) -> Optional[str]:
+    leaf = frame.f_code
+    if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_LEAVES:
+        return None
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    def __init__(self, enabled: bool = PROFILER_ENABLED, sample_rate: float = PROFILER_SAMPLE_RATE,
+                 interval_ms: float = PROFILER_INTERVAL_MS, max_active: int = PROFILER_MAX_ACTIVE,
+                 max_seconds: float = PROFILER_MAX_SECONDS, max_stacks: int = PROFILER_MAX_STACKS):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.max_active = max_active
+        self.max_seconds = max_seconds
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        self._active: List[ProfileSession] = []
+        self._stacks: Dict[Tuple[str, str], Counter] = {}
+        self._requests: Counter = Counter()
+        self._skipped = 0
+        self._samples = 0
+        self._sampler_seconds = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+
+    # --- Sessions ---
+
+    def start(self, route: str, reason: str) -> Optional[ProfileSession]:
+        with self._lock:
+            if len(self._active) >= self.max_active:
+                self._skipped += 1
+                return None
+            session = ProfileSession(route, reason)
+            self._active.append(session)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return session
+
+    def stop(self, session: ProfileSession):
+        with self._lock:
+            if session in self._active:
+                self._finish(session)
+
+    def _finish(self, session: ProfileSession):
+        # Caller holds the lock
+        self._active.remove(session)
+        key = (session.route, session.mode)
+        self._requests[key] += 1
+        counter = self._stacks.setdefault(key, Counter())
+        for stack, count in session.stacks.items():
+            if stack in counter or len(counter) < self.max_stacks:
+                counter[stack] += count
+            else:
+                counter["[truncated]"] += count
+
+    # --- Sampling ---
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            self._wake.wait()
+            with self._lock:
+                now = time.monotonic()
+                for session in [s for s in self._active if now - s.started > self.max_seconds]:
+                    self._finish(session)
+                if not self._active:
+                    self._wake.clear()
+                    continue
+            t = time.perf_counter()
+            stacks = [s for tid, f in sys._current_frames().items() if tid != own_id for s in [_collapse(f)] if s]
+            with self._lock:
+                for session in self._active:
+                    for stack in stacks:
+                        if stack in session.stacks or len(session.stacks) < self.max_stacks:
+                            session.stacks[stack] += 1
+                        else:
+                            session.stacks["[truncated]"] += 1
+                self._samples += 1
+                self._sampler_seconds += time.perf_counter() - t
+            time.sleep(self.interval)
+
+    # --- Reporting ---
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = set(self._stacks) | set(self._requests)
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval * 1000,
+                "active": len(self._active),
+                "skipped_busy": self._skipped,
+                "samples": self._samples,
+                "sampler_cpu_ms": round(self._sampler_seconds * 1000, 1),
+                "profiles": [
+                    {
+                        "route": route,
+                        "mode": mode,
+                        "requests": self._requests.get((route, mode), 0),
+                        "stack_samples": sum(self._stacks.get((route, mode), Counter()).values()),
+                        "distinct_stacks": len(self._stacks.get((route, mode), ())),
+                    }
+                    for route, mode in sorted(keys)
+                ],
+            }
+
+    def collapsed(self, route: Optional[str] = None, mode: Optional[str] = None) -> str:
+        """Collapsed stacks ("frame;frame;frame count" per line) of the matching keys, merged."""
+        merged: Counter = Counter()
+        with self._lock:
+            for (r, m), counter in self._stacks.items():
+                if (route is None or r == route) and (mode is None or m == mode):
+                    merged.update(counter)
+        return "".join(f"{stack} {count}\n" for stack, count in merged.most_common())
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._requests.clear()
+            self._skipped = 0
+            self._samples = 0
+            self._sampler_seconds = 0.0
+
+
+PROFILER = Profiler()
+
+
+def _route_template(app, scope) -> str:
+    from starlette.routing import Match
+    for route in getattr(app, "routes", []):
+        if route.matches(scope)[0] == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return scope["path"]
+
+
+async def _is_tenant_admin(scope) -> bool:
+    # Imported here: auth pulls in the DB layer
+    from auth import get_current_context, get_current_user_id
+    match = _TENANT_PATH.match(scope["path"])
+    if not match:
+        return False
+    try:
+        user_id = get_current_user_id(Request(scope).cookies.get("access_token"))
+        context = await get_current_context(match.group(1), user_id)
+    except Exception:
+        return False
+    return context["role"] == "admin"
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware (not BaseHTTPMiddleware) so that the profile covers the whole
+    streamed body, not just the time until the response headers are sent.
+    """
+
+    def __init__(self, app, profiler: Profiler = PROFILER):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            return await self.app(scope, receive, send)
+
+        reason = None
+        requested = any(k == PROFILE_HEADER.encode() and v == b"1" for k, v in scope.get("headers", []))
+        if requested and await _is_tenant_admin(scope):
+            reason = "header"
+        elif self.profiler.sample_rate > 0 and random.random() < self.profiler.sample_rate:
+            reason = "sampled"
+        session = self.profiler.start(_route_template(scope.get("app") or self.app, scope), reason) if reason else None
+        if session is None:
+            return await self.app(scope, receive, send)
+
+        token = _CURRENT.set(session)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _CURRENT.reset(token)
+            self.profiler.stop(session)
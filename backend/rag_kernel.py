@@ -1,84 +1,221 @@
 import os
 import sqlite3
-import chromadb
-from chromadb.config import Settings
+import time
 from google import genai
 from google.genai import types
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import uuid
 from rank_bm25 import BM25Okapi
+from dedup import DedupIndex, collapse_near_duplicates, content_hash, minhash_many
+from document_catalog import DocumentCatalog, VersionConflictError
+from vector_index import MmapVectorStore, VectorStore
+from local_embeddings import LocalEmbeddingService
+from mmr import RAG_MMR_ENABLED, RAG_MMR_LAMBDA, RAG_MMR_POOL_SIZE, mmr_select
+from singleflight import SingleFlight, content_key
 
 # [EDUCATIONAL COMMENT]
 # ChromaDB has two main client types:
 # 1. EphemeralClient: Stores data in memory. Fast for testing, but data is lost when the process ends.
 # 2. PersistentClient: Stores data on disk (e.g., in a folder). Data survives restarts.
 # Here we use PersistentClient to ensure our RAG knowledge base persists.
+# chromadb is imported lazily so deployments using the built-in mmap backend don't need it.
+
+# Vector backend: "chroma" (default) or "mmap" (vector_index.MmapVectorStore)
+RAG_VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+
+# Chunking: documents are split into overlapping character windows before embedding.
+# Character-based (not whitespace tokens) because most of the corpus is Japanese.
+CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "800"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "100"))
+# Max texts per embed_content call (batch embedding limit of the Gemini API)
+EMBED_BATCH_SIZE = 100
+# text-embedding-004 is Matryoshka-trained: a smaller output_dimensionality is a truncated prefix.
+# Changing this requires re-ingesting (stored vectors keep their dimension).
+EMBEDDING_DIM = int(os.getenv("RAG_EMBEDDING_DIM", "768"))
+# Embedding backend: "gemini", "local" (local_embeddings.LocalEmbeddingService) or "auto" (gemini if a key is set)
+RAG_EMBEDDING_BACKEND = os.getenv("RAG_EMBEDDING_BACKEND", "auto")
+# Per-request timeout of the Gemini embedder; a failed / slow query embedding falls back to keyword-only search
+RAG_EMBED_TIMEOUT_MS = int(os.getenv("RAG_EMBED_TIMEOUT_MS", "10000"))
+_CHUNK_BREAKS = ("\n\n", "\n", "。", ". ", "、", " ")
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    Splits text into chunks of at most chunk_size characters, overlapping by `overlap`.
+    Each cut is moved back to the nearest paragraph / sentence break in the second half of the window.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if len(text) <= chunk_size:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            window = text[start:end]
+            for sep in _CHUNK_BREAKS:
+                cut = window.rfind(sep)
+                if cut >= chunk_size // 2:
+                    end = start + cut + len(sep)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def duplicate_document_id(doc_plan: Dict[str, Any]) -> Optional[str]:
+    """doc_id of another stored document that already contains every chunk of the plan, if any."""
+    chunks = doc_plan["chunks"]
+    doc_ids = {p["duplicate_doc_id"] for p in chunks}
+    if chunks and len(doc_ids) == 1 and all(p["duplicate_of"] for p in chunks):
+        other = doc_ids.pop()
+        if other != doc_plan["doc_id"]:
+            return other
+    return None
+
+
+def summarize_plan(doc_plan: Dict[str, Any]) -> Dict[str, Any]:
+    chunks = doc_plan["chunks"]
+    doc_id = doc_plan["doc_id"]
+    summary = {
+        "doc_id": doc_id,
+        "version": doc_plan["version"] if doc_plan["unchanged"] else doc_plan["version"] + 1,
+        "unchanged": doc_plan["unchanged"],
+        "chunks": len(chunks),
+        "new_chunks": sum(1 for p in chunks if not p["duplicate_of"]),
+        "unchanged_chunks": sum(1 for p in chunks if p["duplicate_of"] and p["duplicate_doc_id"] == doc_id),
+        "duplicate_chunks": sum(1 for p in chunks if p["duplicate_of"] and p["duplicate_doc_id"] != doc_id),
+        "near_duplicate_chunks": sum(1 for p in chunks if p["near_duplicate_of"]),
+        "removed_chunks": len(doc_plan["removed_candidates"]),
+    }
+    other = duplicate_document_id(doc_plan)
+    if other:
+        summary["duplicate_of_doc"] = other
+    return summary
+
+
+def _elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 3)
+
+
+def resolve_doc_key(doc_key: Optional[str], metadata: Dict[str, Any]) -> str:
+    """Documents are versioned by external id if given, else by filename, else they are always new."""
+    return doc_key or metadata.get("filename") or str(uuid.uuid4())
+
 
 class EmbeddingService:
     def __init__(self, api_key: str):
-        self.client = genai.Client(api_key=api_key)
+        self.client = genai.Client(api_key=api_key, http_options=types.HttpOptions(timeout=RAG_EMBED_TIMEOUT_MS))
         self.model = "models/text-embedding-004"
+        self.dim = EMBEDDING_DIM
 
     def embed_text(self, text: str) -> List[float]:
         """Generates embedding for a single string."""
         result = self.client.models.embed_content(
             model=self.model,
             contents=text,
-            config=types.EmbedContentConfig(output_dimensionality=768) # Standard size
+            config=types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIM)
         )
         return result.embeddings[0].values
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Generates embeddings for a list of strings."""
-        # Note: For large batches, you might want to chunk this.
-        # This simple implementation iterates, but batch APIs are better if available.
-        return [self.embed_text(t) for t in texts]
+        """Generates embeddings for a list of strings, EMBED_BATCH_SIZE texts per API call."""
+        vectors = []
+        for i in range(0, len(texts), EMBED_BATCH_SIZE):
+            result = self.client.models.embed_content(
+                model=self.model,
+                contents=texts[i:i + EMBED_BATCH_SIZE],
+                config=types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIM)
+            )
+            vectors.extend(e.values for e in result.embeddings)
+        return vectors
+
+def create_embedding_service(api_key: Optional[str] = None, backend: str = RAG_EMBEDDING_BACKEND):
+    if backend == "auto":
+        backend = "gemini" if api_key else "local"
+    if backend == "gemini":
+        if not api_key:
+            raise ValueError("RAG_EMBEDDING_BACKEND=gemini requires GEMINI_API_KEY")
+        return EmbeddingService(api_key)
+    if backend == "local":
+        return LocalEmbeddingService()
+    raise ValueError(f"Unknown RAG_EMBEDDING_BACKEND: {backend}")
 
-class VectorStore:
+class ChromaVectorStore(VectorStore):
     def __init__(self, persist_path: str = "./chroma_db"):
+        import chromadb
         # Initialize persistent client
         self.client = chromadb.PersistentClient(path=persist_path)
-    
+
+    def count(self, tenant_id: str) -> int:
+        return self.get_collection(tenant_id).count()
+
     def get_collection(self, tenant_id: str):
         # [NEW] Tenant isolation: Create/Get collection per tenant
         return self.client.get_or_create_collection(name=f"governance_docs_{tenant_id}")
 
     def add_documents(self, tenant_id: str, documents: List[str], metadatas: List[Dict[str, Any]], ids: List[str], embeddings: List[List[float]]):
-        """Adds documents to the vector store."""
+        """Adds documents to the vector store (upsert, so replaying a journaled write is harmless)."""
         collection = self.get_collection(tenant_id)
-        collection.add(
+        collection.upsert(
             documents=documents,
             metadatas=metadatas,
             ids=ids,
             embeddings=embeddings
         )
 
-    def search_similarity(self, tenant_id: str, query_embedding: List[float], n_results: int = 5) -> Dict[str, Any]:
+    def delete_documents(self, tenant_id: str, ids: List[str]):
+        if not ids:
+            return
+        self.get_collection(tenant_id).delete(ids=list(ids))
+
+    def list_ids(self, tenant_id: str) -> List[str]:
+        return self.get_collection(tenant_id).get(include=[])['ids']
+
+    def get_documents(self, tenant_id: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """id -> {"document", "metadata"} for the given ids."""
+        if not ids:
+            return {}
+        results = self.get_collection(tenant_id).get(ids=list(ids), include=["documents", "metadatas"])
+        return {
+            chunk_id: {"document": results['documents'][i], "metadata": results['metadatas'][i] or {}}
+            for i, chunk_id in enumerate(results['ids'])
+        }
+
+    def get_embeddings(self, tenant_id: str, ids: List[str]) -> Dict[str, List[float]]:
+        """id -> stored embedding for the given ids."""
+        if not ids:
+            return {}
+        results = self.get_collection(tenant_id).get(ids=list(ids), include=["embeddings"])
+        return {chunk_id: results['embeddings'][i] for i, chunk_id in enumerate(results['ids'])}
+
+    def search_similarity(self, tenant_id: str, query_embedding: List[float], n_results: int = 5,
+                          include_embeddings: bool = False) -> Dict[str, Any]:
         """Searches for similar documents using vector similarity."""
         collection = self.get_collection(tenant_id)
+        include = ["documents", "metadatas", "distances"]
+        if include_embeddings:
+            include.append("embeddings")
         return collection.query(
             query_embeddings=[query_embedding],
-            n_results=n_results
+            n_results=n_results,
+            include=include
         )
 
-    def list_documents(self, tenant_id: str) -> List[Dict[str, Any]]:
-        """Lists all documents in the collection."""
-        collection = self.get_collection(tenant_id)
-        # ChromaDB's get() returns all items if no ids are specified
-        results = collection.get()
-        
-        docs = []
-        if results['ids']:
-            for i, doc_id in enumerate(results['ids']):
-                meta = results['metadatas'][i] if results['metadatas'] else {}
-                # Ensure metadata is a dict
-                if meta is None:
-                    meta = {}
-                docs.append({
-                    "id": doc_id,
-                    "metadata": meta
-                })
-        return docs
+def create_vector_store(backend: str = RAG_VECTOR_BACKEND) -> VectorStore:
+    if backend == "chroma":
+        return ChromaVectorStore()
+    if backend == "mmap":
+        return MmapVectorStore()
+    raise ValueError(f"Unknown RAG_VECTOR_BACKEND: {backend}")
+
 
 class KeywordStore:
     def __init__(self, db_path: str = "governance_logs.db"):
@@ -101,16 +238,49 @@ class KeywordStore:
         conn.commit()
         conn.close()
 
-    def add_documents(self, tenant_id: str, documents: List[str], metadatas: List[Dict[str, Any]], ids: List[str]):
-        conn = sqlite3.connect(self.db_path)
+    def add_documents(self, tenant_id: str, documents: List[str], metadatas: List[Dict[str, Any]], ids: List[str], conn: sqlite3.Connection = None):
+        # When conn is given the caller owns the transaction (see HybridRetriever.commit_document)
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         data = []
         for doc, meta, doc_id in zip(documents, metadatas, ids):
             data.append((doc_id, tenant_id, doc, str(meta)))
         
         cursor.executemany("INSERT OR REPLACE INTO keyword_docs (id, tenant_id, content, metadata) VALUES (?, ?, ?, ?)", data)
-        conn.commit()
+        if own_conn:
+            conn.commit()
+            conn.close()
+
+    def delete_documents(self, tenant_id: str, ids: List[str], conn: sqlite3.Connection = None):
+        if not ids:
+            return
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        conn.executemany("DELETE FROM keyword_docs WHERE id = ? AND tenant_id = ?", [(i, tenant_id) for i in ids])
+        if own_conn:
+            conn.commit()
+            conn.close()
+
+    def list_ids(self, tenant_id: str) -> List[str]:
+        conn = sqlite3.connect(self.db_path)
+        ids = [r[0] for r in conn.execute("SELECT id FROM keyword_docs WHERE tenant_id = ?", (tenant_id,)).fetchall()]
         conn.close()
+        return ids
+
+    def get_documents(self, tenant_id: str, ids: List[str]) -> Dict[str, str]:
+        """id -> content for the given ids."""
+        if not ids:
+            return {}
+        conn = sqlite3.connect(self.db_path)
+        placeholders = ",".join("?" for _ in ids)
+        rows = conn.execute(
+            f"SELECT id, content FROM keyword_docs WHERE tenant_id = ? AND id IN ({placeholders})", [tenant_id, *ids]
+        ).fetchall()
+        conn.close()
+        return {r[0]: r[1] for r in rows}
 
     def search_keyword(self, tenant_id: str, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """
@@ -150,54 +320,510 @@ class KeywordStore:
         return results
 
 class HybridRetriever:
-    def __init__(self, api_key: str):
-        self.embedding_service = EmbeddingService(api_key)
-        self.vector_store = VectorStore()
-        self.keyword_store = KeywordStore()
+    def __init__(self, api_key: Optional[str] = None, embedding_service=None,
+                 vector_store: Optional[VectorStore] = None, db_path: str = "governance_logs.db"):
+        # embedding_service / vector_store default to the configured backends (tests inject fakes)
+        self.embedding_service = embedding_service if embedding_service is not None else create_embedding_service(api_key)
+        self.vector_store = vector_store if vector_store is not None else create_vector_store()
+        self.keyword_store = KeywordStore(db_path)
+        self.dedup_index = DedupIndex(db_path)
+        self.catalog = DocumentCatalog(db_path)
+        self._legacy_checked = set()
+        # Identical concurrent query embeddings / searches share one computation (see singleflight.py)
+        self._embed_flight = SingleFlight("embed")
+        self._search_flight = SingleFlight("retrieval")
 
     def add_document(self, tenant_id: str, text: str, metadata: Dict[str, Any] = None):
-        if metadata is None:
-            metadata = {}
-        
-        doc_id = str(uuid.uuid4())
-        embedding = self.embedding_service.embed_text(text)
-        
-        # Add to Vector Store
-        self.vector_store.add_documents(
-            tenant_id=tenant_id,
-            documents=[text],
-            metadatas=[metadata],
-            ids=[doc_id],
-            embeddings=[embedding]
-        )
-        
-        # Add to Keyword Store
-        self.keyword_store.add_documents(
-            tenant_id=tenant_id,
-            documents=[text],
-            metadatas=[metadata],
-            ids=[doc_id]
+        return self.ingest_document(tenant_id, text, metadata)["doc_id"]
+
+    def ingest_document(self, tenant_id: str, text: str, metadata: Dict[str, Any] = None, doc_key: str = None) -> Dict[str, Any]:
+        """
+        Creates or updates the document identified by doc_key (defaults to the filename).
+        Only chunks that are not stored yet are embedded; chunks dropped by the new version
+        are removed from both stores in the same commit.
+        Raises VersionConflictError if the same document is being re-ingested concurrently.
+        """
+        metadata = metadata or {}
+        doc_plan = self.plan_document(tenant_id, resolve_doc_key(doc_key, metadata), self.chunk_document(text))
+        if doc_plan["unchanged"]:
+            return summarize_plan(doc_plan)
+
+        new_chunks = [p["text"] for p in doc_plan["chunks"] if p["duplicate_of"] is None]
+        embeddings = self.embed_chunks(new_chunks)
+        return self.commit_document(tenant_id, doc_plan, embeddings, metadata)
+
+    # --- Ingest stages (also driven individually by ingest_jobs) ---
+
+    def chunk_document(self, text: str) -> List[str]:
+        return chunk_text(text)
+
+    def plan_document(self, tenant_id: str, doc_key: str, chunks: List[str]) -> Dict[str, Any]:
+        """
+        Diffs the new chunks against the stored version of doc_key.
+        Chunk ids are content-addressed ("{doc_id}:{hash}"), so unchanged chunks keep their id
+        and show up as duplicates of themselves.
+        """
+        existing = self.catalog.get_by_key(tenant_id, doc_key)
+        doc_id = existing["doc_id"] if existing else str(uuid.uuid4())
+        old_ids = [c["chunk_id"] for c in self.catalog.get_manifest(tenant_id, doc_id)] if existing else []
+
+        plan = self.dedupe_chunks(tenant_id, doc_id, chunks)
+        stored_ids = [p["duplicate_of"] or p["chunk_id"] for p in plan]
+        kept = set(stored_ids)
+        return {
+            "doc_id": doc_id,
+            "doc_key": doc_key,
+            "version": existing["version"] if existing else 0,
+            "unchanged": bool(existing) and stored_ids == old_ids,
+            "chunks": plan,
+            "removed_candidates": [c for c in dict.fromkeys(old_ids) if c not in kept],
+        }
+
+    def dedupe_chunks(self, tenant_id: str, doc_id: str, chunks: List[str]) -> List[Dict[str, Any]]:
+        """
+        Returns one plan entry per chunk:
+        - duplicate_of: chunk_id of an identical stored chunk (skip embedding, link to it)
+        - near_duplicate_of / similarity: most similar chunk of another document above NEAR_DUP_THRESHOLD
+          (still embedded, but tagged so it can be collapsed at search time)
+        """
+        hashes = [content_hash(c) for c in chunks]
+        existing = self.dedup_index.find_exact(tenant_id, list(set(hashes)))
+        sigs = minhash_many(chunks)
+
+        plan = []
+        first_seen: Dict[str, str] = {}
+        for i, (chunk, h) in enumerate(zip(chunks, hashes)):
+            entry = {
+                "index": i,
+                "chunk_id": f"{doc_id}:{h[:16]}",
+                "text": chunk,
+                "content_hash": h,
+                "minhash": sigs[i],
+                "duplicate_of": None,
+                "duplicate_doc_id": None,
+                "near_duplicate_of": None,
+                "similarity": None,
+            }
+            if h in existing:
+                entry["duplicate_of"], entry["duplicate_doc_id"] = existing[h]
+            elif h in first_seen:
+                # Repeated chunk inside the same document
+                entry["duplicate_of"], entry["duplicate_doc_id"] = first_seen[h], doc_id
+            else:
+                first_seen[h] = entry["chunk_id"]
+                near = self.dedup_index.find_near(tenant_id, sigs[i], exclude_doc_id=doc_id)
+                if near:
+                    entry["near_duplicate_of"], entry["similarity"] = near
+            plan.append(entry)
+        return plan
+
+    def embed_chunks(self, chunks: List[str]) -> List[List[float]]:
+        if not chunks:
+            return []
+        return self.embedding_service.embed_documents(chunks)
+
+    def commit_document(self, tenant_id: str, doc_plan: Dict[str, Any], embeddings: List[List[float]], metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Applies a plan_document() result to Chroma, keyword_docs, the dedup index and the catalog.
+        embeddings are given for the new chunks only, in plan order.
+
+        The SQLite transaction is the commit point:
+        1. journal the Chroma ids about to be added (rag_pending_ops, "pending")
+        2. upsert the new chunks into Chroma
+        3. one transaction: catalog + manifest + keyword_docs + fingerprints, journal -> "committed"
+        4. delete the chunks nothing references any more from Chroma, drop the journal row
+        A crash before 3 is rolled back and a crash after 3 is finished by recover_pending_ops();
+        while this call runs, the journal row's owner (host:pid + heartbeat) keeps recovery and
+        reconcile in other workers away from it.
+        """
+        metadata = metadata or {}
+        tenant_doc_id = doc_plan["doc_id"]
+        plan = doc_plan["chunks"]
+
+        new = [p for p in plan if p["duplicate_of"] is None]
+        ids = [p["chunk_id"] for p in new]
+        documents = [p["text"] for p in new]
+        metadatas = []
+        for p in new:
+            meta = {**metadata, "doc_id": tenant_doc_id, "chunk_index": p["index"], "chunk_count": len(plan), "content_hash": p["content_hash"]}
+            if p["near_duplicate_of"]:
+                meta["near_duplicate_of"] = p["near_duplicate_of"]
+            metadatas.append(meta)
+        manifest = [
+            {"chunk_index": p["index"], "chunk_id": p["duplicate_of"] or p["chunk_id"], "content_hash": p["content_hash"]}
+            for p in plan
+        ]
+        links = sorted({p["duplicate_of"] for p in plan if p["duplicate_of"]})
+
+        with self.catalog.op(tenant_id, tenant_doc_id, ids) as op_id:
+            try:
+                if new:
+                    self.vector_store.add_documents(
+                        tenant_id=tenant_id,
+                        documents=documents,
+                        metadatas=metadatas,
+                        ids=ids,
+                        embeddings=embeddings
+                    )
+                    self.catalog.touch_op(op_id)
+
+                conn = self.catalog.connect()
+                try:
+                    with conn:
+                        if links and len(self.dedup_index.existing_ids(tenant_id, links, conn=conn)) != len(links):
+                            # A linked chunk was deleted while we were embedding
+                            raise VersionConflictError(f"linked chunks of {doc_plan['doc_key']} changed concurrently")
+                        version = self.catalog.upsert_document(
+                            conn, tenant_id, tenant_doc_id, doc_plan["doc_key"], doc_plan["version"], len(plan), metadata
+                        )
+                        self.catalog.replace_manifest(conn, tenant_id, tenant_doc_id, manifest)
+                        self.keyword_store.add_documents(tenant_id, documents, metadatas, ids, conn=conn)
+                        self.dedup_index.add(
+                            tenant_id, [(p["chunk_id"], tenant_doc_id, p["content_hash"], p["minhash"]) for p in new], conn=conn
+                        )
+                        removed = self.catalog.unreferenced(conn, tenant_id, doc_plan["removed_candidates"])
+                        self.keyword_store.delete_documents(tenant_id, removed, conn=conn)
+                        self.dedup_index.delete(tenant_id, removed, conn=conn)
+                        self.catalog.mark_committed(conn, op_id, removed)
+                finally:
+                    conn.close()
+            except Exception:
+                # Not committed: undo the Chroma upsert. If that fails too the journal row stays
+                # "pending" and recover_pending_ops() rolls it back later.
+                try:
+                    self.vector_store.delete_documents(tenant_id, self._orphaned_adds(tenant_id, op_id, ids))
+                    self.catalog.finish_op(op_id)
+                except Exception as e:
+                    print(f"[WARN] rollback of ingest op {op_id} failed: {e}")
+                raise
+
+            self._finish_committed_op(tenant_id, op_id, removed)
+            self._observe_committed(documents)
+            summary = summarize_plan(doc_plan)
+            summary["version"] = version
+            return summary
+
+    def delete_document(self, tenant_id: str, doc_id: str) -> bool:
+        """Removes a document from the catalog and both stores. Returns False if it does not exist."""
+        if not self.catalog.get(tenant_id, doc_id):
+            return False
+        chunk_ids = [c["chunk_id"] for c in self.catalog.get_manifest(tenant_id, doc_id)]
+
+        with self.catalog.op(tenant_id, doc_id, []) as op_id:
+            conn = self.catalog.connect()
+            try:
+                with conn:
+                    self.catalog.delete_document(conn, tenant_id, doc_id)
+                    # Chunks linked from other documents stay
+                    removed = self.catalog.unreferenced(conn, tenant_id, chunk_ids)
+                    self.keyword_store.delete_documents(tenant_id, removed, conn=conn)
+                    self.dedup_index.delete(tenant_id, removed, conn=conn)
+                    self.catalog.mark_committed(conn, op_id, removed)
+            except Exception:
+                self.catalog.finish_op(op_id)
+                raise
+            finally:
+                conn.close()
+
+            self._finish_committed_op(tenant_id, op_id, removed)
+            return True
+
+    def _observe_committed(self, texts: List[str]):
+        # The local embedder's IDF counts each committed chunk once (not embedding retries or re-embeds)
+        observe = getattr(self.embedding_service, "observe", None)
+        if observe and texts:
+            observe(texts)
+
+    def save_embedding_stats(self):
+        """Persists the local embedder's unsaved IDF counts (called at shutdown)."""
+        save_stats = getattr(self.embedding_service, "save_stats", None)
+        if save_stats:
+            save_stats()
+
+    def _orphaned_adds(self, tenant_id: str, op_id: str, ids: List[str]) -> List[str]:
+        """
+        The ids added by op_id that are safe to roll back. Chunk ids are content-addressed, so a
+        concurrent ingest of the same content writes the same ids: those referenced by a committed
+        manifest or journaled by another in-flight op belong to it as well and must stay.
+        """
+        conn = self.catalog.connect()
+        try:
+            orphans = self.catalog.unreferenced(conn, tenant_id, ids)
+        finally:
+            conn.close()
+        in_flight = {i for op in self.catalog.pending_ops(tenant_id) if op["op_id"] != op_id for i in op["add_ids"]}
+        return [i for i in orphans if i not in in_flight]
+
+    def _finish_committed_op(self, tenant_id: str, op_id: str, removed: List[str]):
+        try:
+            self.vector_store.delete_documents(tenant_id, removed)
+            self.catalog.finish_op(op_id)
+        except Exception as e:
+            # The journal row stays "committed"; recover_pending_ops() retries the delete
+            print(f"[WARN] vector delete for op {op_id} failed: {e}")
+
+    # --- Consistency ---
+
+    def recover_pending_ops(self, tenant_id: str = None) -> int:
+        """
+        Brings Chroma in line with the SQLite commit point after a crash:
+        pending ops are rolled back (their Chroma adds removed), committed ops have their deletes re-applied.
+        Ops whose owner may still be running (DocumentCatalog.is_live) are left to it.
+        """
+        ops = [op for op in self.catalog.pending_ops(tenant_id) if not self.catalog.is_live(op)]
+        for op in ops:
+            if op["status"] == "pending":
+                conn = self.catalog.connect()
+                try:
+                    orphans = self.catalog.unreferenced(conn, op["tenant_id"], op["add_ids"])
+                finally:
+                    conn.close()
+                self.vector_store.delete_documents(op["tenant_id"], orphans)
+            else:
+                self.vector_store.delete_documents(op["tenant_id"], op["delete_ids"])
+            self.catalog.finish_op(op["op_id"])
+        return len(ops)
+
+    def check_embedding_dimensions(self) -> Dict[str, int]:
+        """
+        Compares one stored vector per tenant with the embedder's dimension (run at startup).
+        A mismatch means the store was built with another RAG_EMBEDDING_BACKEND (e.g. auto
+        fell back to local embeddings because GEMINI_API_KEY is missing): searches of that
+        tenant then run on keywords only. Returns tenant_id -> stored dimension for mismatches.
+        """
+        dim = getattr(self.embedding_service, "dim", None)
+        if not dim:
+            return {}
+        mismatched = {}
+        for tenant_id, chunk_id in self.catalog.sample_chunk_ids().items():
+            try:
+                stored = self.vector_store.get_embeddings(tenant_id, [chunk_id]).get(chunk_id)
+            except Exception as e:
+                print(f"[WARN] Could not read a stored embedding of tenant {tenant_id}: {e}")
+                continue
+            if stored is not None and len(stored) != dim:
+                mismatched[tenant_id] = len(stored)
+                print(
+                    f"[WARN] Tenant {tenant_id}: stored vectors have {len(stored)} dims but the "
+                    f"{type(self.embedding_service).__name__} embedder produces {dim}; vector search is "
+                    "disabled for it until RAG_EMBEDDING_BACKEND matches the store or the store is rebuilt "
+                    "(POST /knowledge/reconcile into an empty store)."
+                )
+        return mismatched
+
+    def adopt_legacy_documents(self, tenant_id: str) -> int:
+        """
+        Registers chunks written before the catalog existed (no content_hash in their metadata)
+        as catalog documents, so they can be listed, updated and deleted.
+        """
+        manifest_ids = self.catalog.all_chunk_ids(tenant_id)
+        if self.vector_store.count(tenant_id) <= len(manifest_ids):
+            return 0
+        unknown = [i for i in self.vector_store.list_ids(tenant_id) if i not in manifest_ids]
+        stored = self.vector_store.get_documents(tenant_id, unknown)
+
+        groups: Dict[str, List[tuple]] = {}
+        for chunk_id, item in stored.items():
+            meta = item["metadata"]
+            if "content_hash" in meta:
+                continue  # written by the current code path -> an orphan, handled by reconcile()
+            groups.setdefault(meta.get("doc_id", chunk_id), []).append((meta.get("chunk_index", 0), chunk_id, item))
+
+        for doc_id, items in groups.items():
+            items.sort(key=lambda x: x[0])
+            meta = {k: v for k, v in items[0][2]["metadata"].items() if k not in ("doc_id", "chunk_index", "chunk_count")}
+            texts = [item["document"] or "" for _, _, item in items]
+            hashes = [content_hash(t) for t in texts]
+            sigs = minhash_many(texts)
+            conn = self.catalog.connect()
+            try:
+                with conn:
+                    self.catalog.upsert_document(conn, tenant_id, doc_id, doc_id, 0, len(items), meta)
+                    self.catalog.replace_manifest(conn, tenant_id, doc_id, [
+                        {"chunk_index": n, "chunk_id": chunk_id, "content_hash": hashes[n]}
+                        for n, (_, chunk_id, _) in enumerate(items)
+                    ])
+                    self.dedup_index.add(
+                        tenant_id, [(chunk_id, doc_id, hashes[n], sigs[n]) for n, (_, chunk_id, _) in enumerate(items)], conn=conn
+                    )
+            finally:
+                conn.close()
+        return len(groups)
+
+    def reconcile(self, tenant_id: str, repair: bool = True) -> Dict[str, Any]:
+        """
+        Compares the catalog manifest with the chunk ids actually present in Chroma and keyword_docs.
+        With repair=True: orphans are deleted, chunks missing from keyword_docs are copied from Chroma,
+        and chunks missing from Chroma are re-embedded from keyword_docs.
+        """
+        recovered_ops = self.recover_pending_ops(tenant_id)
+        adopted = self.adopt_legacy_documents(tenant_id)
+
+        # Order matters: ids upserted by an ingest that is still in flight are in the stores but not
+        # in the manifest yet. Any such id listed below was journaled before the stores were read, so
+        # its op is still in the journal when it is read next, unless it committed first; the manifest
+        # is read last, so it then contains the id.
+        vector_ids = set(self.vector_store.list_ids(tenant_id))
+        keyword_ids = set(self.keyword_store.list_ids(tenant_id))
+        in_flight = {i for op in self.catalog.pending_ops(tenant_id) for i in op["add_ids"]}
+        manifest_ids = self.catalog.all_chunk_ids(tenant_id)
+        vector_ids -= in_flight
+        keyword_ids -= in_flight
+        manifest_ids -= in_flight
+
+        missing_in_vector = sorted(manifest_ids - vector_ids)
+        missing_in_keyword = sorted(manifest_ids - keyword_ids)
+        orphaned_in_vector = sorted(vector_ids - manifest_ids)
+        orphaned_in_keyword = sorted(keyword_ids - manifest_ids)
+        unrecoverable = sorted(set(missing_in_vector) & set(missing_in_keyword))
+
+        if repair:
+            self.vector_store.delete_documents(tenant_id, orphaned_in_vector)
+            self.keyword_store.delete_documents(tenant_id, orphaned_in_keyword)
+
+            copy_ids = [i for i in missing_in_keyword if i in vector_ids]
+            if copy_ids:
+                items = self.vector_store.get_documents(tenant_id, copy_ids)
+                self.keyword_store.add_documents(
+                    tenant_id,
+                    [items[i]["document"] for i in items],
+                    [items[i]["metadata"] for i in items],
+                    list(items)
+                )
+
+            embed_ids = [i for i in missing_in_vector if i in keyword_ids]
+            if embed_ids:
+                texts = self.keyword_store.get_documents(tenant_id, embed_ids)
+                ids = list(texts)
+                documents = [texts[i] for i in ids]
+                if getattr(self.embedding_service, "observed_docs", None) == 0:
+                    # Fresh local embedder (RAG_EMBEDDING_BACKEND switched): it has never counted these chunks
+                    self._observe_committed(documents)
+                self.vector_store.add_documents(
+                    tenant_id=tenant_id,
+                    documents=documents,
+                    metadatas=[{"doc_id": i.split(":", 1)[0], "content_hash": content_hash(texts[i])} for i in ids],
+                    ids=ids,
+                    embeddings=self.embed_chunks(documents)
+                )
+
+        def sample(ids: List[str]) -> Dict[str, Any]:
+            return {"count": len(ids), "sample": ids[:20]}
+
+        return {
+            "tenant_id": tenant_id,
+            "consistent": not (missing_in_vector or missing_in_keyword or orphaned_in_vector or orphaned_in_keyword),
+            "repaired": repair,
+            "recovered_ops": recovered_ops,
+            "adopted_legacy_documents": adopted,
+            "manifest_chunks": len(manifest_ids),
+            "vector_chunks": len(vector_ids),
+            "keyword_chunks": len(keyword_ids),
+            "missing_in_vector": sample(missing_in_vector),
+            "missing_in_keyword": sample(missing_in_keyword),
+            "orphaned_in_vector": sample(orphaned_in_vector),
+            "orphaned_in_keyword": sample(orphaned_in_keyword),
+            "unrecoverable": sample(unrecoverable),
+        }
+
+    def search(self, tenant_id: str, query: str, n_results: int = 5,
+               timings: Optional[Dict[str, float]] = None) -> List[str]:
+        """
+        Hybrid search: vector + keyword candidates, near-duplicate collapse, then MMR
+        so the n_results passages are relevant but not redundant.
+        timings (optional dict) receives per-stage milliseconds.
+        Concurrent identical searches (same tenant, query and n_results) run once; the others
+        wait for that result and get only total_ms and coalesced=True in timings.
+        """
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        own_timings: Dict[str, float] = {}
+        docs = self._search_flight.do(
+            content_key(tenant_id, n_results, query),
+            lambda: self._search(tenant_id, query, n_results, own_timings)
         )
-        return doc_id
+        if own_timings:
+            timings.update(own_timings)
+        else:
+            timings["coalesced"] = True
+            timings["total_ms"] = _elapsed_ms(started)
+        # The list is shared with the coalesced callers
+        return list(docs)
+
+    def _search(self, tenant_id: str, query: str, n_results: int, timings: Dict[str, float]) -> List[str]:
+        started = time.perf_counter()
+        # Over-fetch so that collapsing duplicates / MMR still leaves n_results passages to pick from
+        fetch_n = max(RAG_MMR_POOL_SIZE, n_results * 2) if RAG_MMR_ENABLED else n_results * 2
 
-    def search(self, tenant_id: str, query: str, n_results: int = 5) -> List[str]:
         # 1. Vector Search
-        query_embedding = self.embedding_service.embed_text(query)
-        vector_results = self.vector_store.search_similarity(tenant_id, query_embedding, n_results)
-        
+        t = time.perf_counter()
+        try:
+            # Keyed by the text only: the same question from different tenants embeds once
+            query_embedding = self._embed_flight.do(content_key(query), lambda: self.embedding_service.embed_text(query))
+        except Exception as e:
+            # Embedder down or too slow: answer from the keyword index rather than failing the chat
+            print(f"[WARN] Query embedding failed, using keyword search only: {e}")
+            query_embedding = None
+        timings["embed_ms"] = _elapsed_ms(t)
+
+        vector_results: Dict[str, Any] = {}
+        if query_embedding is not None:
+            t = time.perf_counter()
+            try:
+                vector_results = self.vector_store.search_similarity(
+                    tenant_id, query_embedding, fetch_n, include_embeddings=RAG_MMR_ENABLED
+                )
+                timings["vector_ms"] = _elapsed_ms(t)
+            except Exception as e:
+                # e.g. the store was built with another embedding backend (dimension mismatch)
+                print(f"[WARN] Vector search failed for tenant {tenant_id}, using keyword search only: {e}")
+                query_embedding = None
+
         # Extract documents from vector results
         # vector_results['documents'] is a list of lists (one list per query)
-        v_docs = vector_results['documents'][0] if vector_results['documents'] else []
-        
+        v_ids = vector_results['ids'][0] if vector_results.get('ids') else []
+        v_docs = vector_results['documents'][0] if vector_results.get('documents') else []
+        embeddings: Dict[str, Any] = {}
+        if RAG_MMR_ENABLED and vector_results.get('embeddings') is not None and len(vector_results['embeddings']):
+            embeddings = dict(zip(v_ids, vector_results['embeddings'][0]))
+
         # 2. Keyword Search
-        keyword_results = self.keyword_store.search_keyword(tenant_id, query, n_results)
-        k_docs = [r['document'] for r in keyword_results]
-        
-        # 3. Hybrid Fusion (Simple Union for now)
+        t = time.perf_counter()
+        keyword_results = self.keyword_store.search_keyword(tenant_id, query, fetch_n)
+        timings["keyword_ms"] = _elapsed_ms(t)
+
+        # 3. Hybrid Fusion (Simple Union for now, order-preserving)
         # In a more advanced system, we would use Reciprocal Rank Fusion (RRF)
-        all_docs = list(set(v_docs + k_docs))
-        
+        candidates: Dict[str, str] = {}  # text -> chunk id
+        for chunk_id, doc in list(zip(v_ids, v_docs)) + [(r['id'], r['document']) for r in keyword_results]:
+            candidates.setdefault(doc, chunk_id)
+
+        # 4. Collapse near-identical passages so they don't fill every context slot
+        t = time.perf_counter()
+        all_docs = collapse_near_duplicates(list(candidates))
+        timings["collapse_ms"] = _elapsed_ms(t)
+
+        # 5. MMR over the candidates we have embeddings for (keyword-only hits are fetched by id)
+        if RAG_MMR_ENABLED and query_embedding is not None and len(all_docs) > n_results:
+            t = time.perf_counter()
+            missing = [candidates[d] for d in all_docs if candidates[d] not in embeddings]
+            if missing:
+                embeddings.update(self.vector_store.get_embeddings(tenant_id, missing))
+            with_vec = [d for d in all_docs if candidates[d] in embeddings]
+            without_vec = [d for d in all_docs if candidates[d] not in embeddings]
+            picked = mmr_select(query_embedding, [embeddings[candidates[d]] for d in with_vec], n_results, RAG_MMR_LAMBDA)
+            all_docs = [with_vec[i] for i in picked] + without_vec
+            timings["mmr_ms"] = _elapsed_ms(t)
+
+        timings["total_ms"] = _elapsed_ms(started)
         return all_docs[:n_results]
 
-    def list_documents(self, tenant_id: str) -> List[Dict[str, Any]]:
-        return self.vector_store.list_documents(tenant_id)
+    def list_documents(self, tenant_id: str, **page) -> Dict[str, Any]:
+        """
+        Lists the current documents of a tenant from the catalog (Chroma is not touched).
+        page: limit / cursor / offset / filename / uploader / since / until, see DocumentCatalog.list_documents.
+        """
+        if tenant_id not in self._legacy_checked:
+            self.adopt_legacy_documents(tenant_id)
+            self._legacy_checked.add(tenant_id)
+        return self.catalog.list_documents(tenant_id, **page)
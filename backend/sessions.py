@@ -0,0 +1,348 @@
+"""
+Server-side conversation sessions for /chat (opt-in: POST /tenants/{id}/sessions, then send session_id).
+
+A session keeps what a conversation has already paid for, so later turns don't redo it:
+- attachments: extracted text + PII result per file (id = hash of the file bytes), so a PDF
+  uploaded once can be referenced by id in later turns without re-upload, re-extraction or
+  re-scanning; re-uploading the same file in the session is also served from here
+- the merged PII flags of the user's earlier messages (they are part of the prompt via history)
+- the passages retrieved for the previous turn, offered again behind the fresh ones
+- history: recent turns verbatim (SESSION_HISTORY_TOKENS) plus a rolling summary of older
+  turns (SESSION_SUMMARY_TOKENS), so the prompt stays bounded however long the conversation gets
+
+The rolling summary is extractive (head of each question / answer), not an LLM call: it costs
+nothing per turn and never sends the conversation to a second model.
+
+On later turns, attachments added in earlier turns are sent as the excerpts most related to the
+new question (at most SESSION_ATTACHMENT_TOKENS in total) instead of their full text.
+
+Storage: two tiers bounded by bytes with LRU eviction, like extraction_cache.py.
+- memory: OrderedDict of session id -> session dict
+- disk:   one JSON file per session under SESSION_DIR, written on every save (so sessions survive
+  restarts and are shared by uvicorn workers; a worker reloads its memory copy when the file changed).
+  SESSION_DISK_BYTES caps the directory, not one worker's writes: each worker re-reads the
+  directory sizes every SESSION_DISK_RESCAN_SECONDS (and whenever its own count goes over the
+  limit) and evicts the least recently saved files, so the total can overshoot by what the
+  other workers wrote since the last rescan.
+Sessions idle for longer than SESSION_TTL_SECONDS are dropped. Two turns of the same session
+running at the same time are not merged: the later save wins.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from context_packer import estimate_tokens, truncate_to_tokens
+from governance_kernel import merge_pii_results
+
+if os.path.exists("/app/data"):
+    # Docker環境 (永続ボリューム)
+    _DEFAULT_SESSION_DIR = Path("/app/data/sessions")
+else:
+    # ローカル開発環境
+    _DEFAULT_SESSION_DIR = Path(__file__).parent / ".sessions"
+
+SESSION_DIR = Path(os.getenv("SESSION_DIR", str(_DEFAULT_SESSION_DIR)))
+SESSION_MEMORY_BYTES = int(os.getenv("SESSION_MEMORY_BYTES", str(64 * 1024 * 1024)))
+SESSION_DISK_BYTES = int(os.getenv("SESSION_DISK_BYTES", str(1024 * 1024 * 1024)))
+SESSION_DISK_RESCAN_SECONDS = float(os.getenv("SESSION_DISK_RESCAN_SECONDS", "60"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "1500"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "600"))
+SESSION_ATTACHMENT_TOKENS = int(os.getenv("SESSION_ATTACHMENT_TOKENS", "2000"))
+# Passages of the previous turn kept for the next one
+SESSION_CONTEXT_DOCS = 10
+# Per summarized turn: head of the question / of the answer
+SUMMARY_QUESTION_TOKENS = 60
+SUMMARY_ANSWER_TOKENS = 120
+
+
+class SessionNotFoundError(Exception):
+    pass
+
+
+def attachment_id(sha256: str, filename: str) -> str:
+    # Same bytes read as PDF or as text give different text (see file_parser cache keys)
+    kind = "pdf" if filename.lower().endswith(".pdf") else "text"
+    return hashlib.sha256(f"{sha256}-{kind}".encode()).hexdigest()[:16]
+
+
+# --- Session contents ---
+
+def add_attachment(session: Dict[str, Any], filename: str, sha256: str, text: str, pii: Dict) -> str:
+    att_id = attachment_id(sha256, filename)
+    session["attachments"][att_id] = {
+        "filename": filename,
+        "text": text,
+        "tokens": estimate_tokens(text),
+        "pii": pii,
+        "turn": session["turn_count"] + 1,
+    }
+    return att_id
+
+
+def find_attachment(session: Optional[Dict[str, Any]], filename: str, sha256: str) -> Optional[Dict[str, Any]]:
+    if session is None:
+        return None
+    return session["attachments"].get(attachment_id(sha256, filename))
+
+
+def select_attachments(session: Dict[str, Any], ids: Optional[List[str]] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """(id, attachment) for the ids (None: every attachment of the session). Raises KeyError on an unknown id."""
+    if ids is None:
+        return list(session["attachments"].items())
+    return [(att_id, session["attachments"][att_id]) for att_id in ids]
+
+
+def history_text(session: Optional[Dict[str, Any]]) -> str:
+    if not session or (not session["summary"] and not session["turns"]):
+        return ""
+    parts = []
+    if session["summary"]:
+        parts.append("Summary of earlier turns:\n" + "\n".join(session["summary"]))
+    for turn in session["turns"]:
+        parts.append(f"User: {turn['user']}\nAssistant: {turn['assistant']}")
+    return "\n\n".join(parts) + "\n"
+
+
+def _summarize_turn(turn: Dict[str, str]) -> str:
+    question = truncate_to_tokens(" ".join(turn["user"].split()), SUMMARY_QUESTION_TOKENS)
+    answer = truncate_to_tokens(" ".join(turn["assistant"].split()), SUMMARY_ANSWER_TOKENS)
+    return f"- Q: {question} / A: {answer}"
+
+
+def record_turn(session: Dict[str, Any], message: str, reply: str, message_pii: Dict, context_docs: List[str]):
+    """Appends the turn and rolls the oldest turns into the summary once history is over budget."""
+    session["turn_count"] += 1
+    session["turns"].append({"user": message, "assistant": reply})
+    session["pii"] = merge_pii_results([session["pii"], message_pii])
+    session["context_docs"] = list(context_docs[:SESSION_CONTEXT_DOCS])
+
+    def turns_tokens():
+        return sum(estimate_tokens(t["user"]) + estimate_tokens(t["assistant"]) for t in session["turns"])
+
+    # The latest turn stays verbatim even if it alone is over budget
+    while len(session["turns"]) > 1 and turns_tokens() > SESSION_HISTORY_TOKENS:
+        session["summary"].append(_summarize_turn(session["turns"].pop(0)))
+    while len(session["summary"]) > 1 and estimate_tokens("\n".join(session["summary"])) > SESSION_SUMMARY_TOKENS:
+        session["summary"].pop(0)
+
+
+def describe(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Session metadata for the API (no attachment text)."""
+    return {
+        "session_id": session["session_id"],
+        "created": session["created"],
+        "updated": session["updated"],
+        "turn_count": session["turn_count"],
+        "attachments": [
+            {"id": att_id, "filename": a["filename"], "tokens": a["tokens"],
+             "pii_detected": a["pii"].get("pii_detected", False), "turn": a["turn"]}
+            for att_id, a in session["attachments"].items()
+        ],
+        "pii": session["pii"],
+        "history_tokens": estimate_tokens(history_text(session)),
+        "summarized_turns": len(session["summary"]),
+    }
+
+
+# --- Store ---
+
+class SessionStore:
+    def __init__(self, session_dir: Optional[Path], memory_bytes: int, disk_bytes: int, ttl_seconds: int = SESSION_TTL_SECONDS,
+                 rescan_seconds: float = SESSION_DISK_RESCAN_SECONDS):
+        self.session_dir = Path(session_dir) if session_dir else None
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.rescan_seconds = rescan_seconds
+        self._scanned_at = 0.0
+
+        # session id -> (session, size in bytes, mtime_ns of the file it was loaded from / saved to)
+        self._memory: "OrderedDict[str, Tuple[Dict[str, Any], int, Optional[int]]]" = OrderedDict()
+        self._memory_size = 0
+        # session id -> size on disk, in LRU order (oldest first)
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        if self._use_disk:
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    @property
+    def _use_disk(self) -> bool:
+        return bool(self.session_dir) and self.disk_bytes > 0
+
+    def _load_disk_index(self):
+        """(Re)builds the disk index from the directory, which other workers write to as well."""
+        self._disk.clear()
+        self._disk_size = 0
+        self._scanned_at = time.monotonic()
+        entries = []
+        for path in self.session_dir.glob("*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path.stem, st.st_size))
+        for _, session_id, size in sorted(entries):
+            self._disk[session_id] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def _path(self, session_id: str) -> Path:
+        return self.session_dir / f"{session_id}.json"
+
+    def _drop_memory(self, session_id: str):
+        entry = self._memory.pop(session_id, None)
+        if entry is not None:
+            self._memory_size -= entry[1]
+
+    def _put_memory(self, session: Dict[str, Any], size: int, mtime_ns: Optional[int]):
+        self._drop_memory(session["session_id"])
+        if size > self.memory_bytes:
+            return
+        self._memory[session["session_id"]] = (session, size, mtime_ns)
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            _, (_, evicted_size, _) = self._memory.popitem(last=False)
+            self._memory_size -= evicted_size
+
+    def _drop_disk(self, session_id: str):
+        size = self._disk.pop(session_id, None)
+        if size is not None:
+            self._disk_size -= size
+        if self._use_disk:
+            try:
+                self._path(session_id).unlink()
+            except OSError:
+                pass
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            session_id = next(iter(self._disk))
+            self._drop_disk(session_id)
+
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        cached = self._memory.get(session_id)
+        mtime_ns = None
+        if self._use_disk:
+            path = self._path(session_id)
+            try:
+                mtime_ns = path.stat().st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            # Another worker saved a newer version (or deleted it)
+            if cached is not None and cached[2] is not None and cached[2] != mtime_ns:
+                self._drop_memory(session_id)
+                cached = None
+        if cached is not None:
+            self._memory.move_to_end(session_id)
+            return cached[0]
+        if mtime_ns is None:
+            return None
+        try:
+            data = self._path(session_id).read_bytes()
+            session = json.loads(data)
+        except (OSError, ValueError):
+            return None
+        if session_id not in self._disk:
+            self._disk_size += len(data)
+        self._disk[session_id] = len(data)
+        self._disk.move_to_end(session_id)
+        self._put_memory(session, len(data), mtime_ns)
+        return session
+
+    def create(self, tenant_id: str, user_id: str) -> Dict[str, Any]:
+        now = time.time()
+        session = {
+            "session_id": uuid.uuid4().hex,
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "created": now,
+            "updated": now,
+            "turn_count": 0,
+            "attachments": {},
+            "pii": {"pii_detected": False, "detected_types": []},
+            "context_docs": [],
+            "turns": [],
+            "summary": [],
+        }
+        self.save(session)
+        return session
+
+    def get(self, session_id: str, tenant_id: str, user_id: str) -> Dict[str, Any]:
+        """
+        A copy of the session (callers modify it, then save()).
+        Raises SessionNotFoundError if it does not exist, expired or belongs to someone else.
+        """
+        with self._lock:
+            session = self._load(session_id) if session_id.isalnum() else None
+            if session is not None and time.time() - session["updated"] > self.ttl_seconds:
+                self._drop_memory(session_id)
+                self._drop_disk(session_id)
+                session = None
+            if session is None or session["tenant_id"] != tenant_id or session["user_id"] != user_id:
+                raise SessionNotFoundError(session_id)
+            # Strings are shared, containers copied: cheap even with large attachments
+            return copy.deepcopy(session)
+
+    def save(self, session: Dict[str, Any]):
+        session["updated"] = time.time()
+        data = json.dumps(session, ensure_ascii=False).encode("utf-8")
+        session_id = session["session_id"]
+        with self._lock:
+            mtime_ns = None
+            if self._use_disk and len(data) <= self.disk_bytes:
+                path = self._path(session_id)
+                tmp_path = None
+                try:
+                    # Unique temp file: workers saving the same session must not write into one file
+                    with tempfile.NamedTemporaryFile(dir=self.session_dir, prefix=f"{session_id}.", suffix=".tmp",
+                                                     delete=False) as f:
+                        tmp_path = f.name
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                    mtime_ns = path.stat().st_mtime_ns
+                except OSError as e:
+                    print(f"[WARN] session write failed: {e}")
+                    if tmp_path:
+                        try:
+                            os.unlink(tmp_path)
+                        except OSError:
+                            pass
+                else:
+                    self._disk_size += len(data) - self._disk.get(session_id, 0)
+                    self._disk[session_id] = len(data)
+                    self._disk.move_to_end(session_id)
+                    if (self._disk_size > self.disk_bytes
+                            or time.monotonic() - self._scanned_at > self.rescan_seconds):
+                        self._load_disk_index()
+                    self._evict_disk()
+            self._put_memory(copy.deepcopy(session), len(data), mtime_ns)
+
+    def delete(self, session_id: str, tenant_id: str, user_id: str):
+        self.get(session_id, tenant_id, user_id)  # ownership check
+        with self._lock:
+            self._drop_memory(session_id)
+            self._drop_disk(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_sessions": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_sessions": len(self._disk),
+            "disk_bytes": self._disk_size,
+        }
+
+
+SESSIONS = SessionStore(SESSION_DIR, memory_bytes=SESSION_MEMORY_BYTES, disk_bytes=SESSION_DISK_BYTES)
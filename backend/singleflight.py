@@ -0,0 +1,130 @@
+"""
+Single-flight: concurrent calls with the same key share one computation.
+
+When many users ask the same question at the same moment (e.g. right after an announcement),
+each /chat request would embed the same query, run the same vector / keyword searches and
+parse the same attachment. With single-flight the first caller for a key (the leader) does
+the work; callers arriving while it runs wait and receive the leader's result (or exception).
+Nothing is kept once the call finishes: this is in-flight deduplication, not a cache
+(ExtractionCache and the stores handle reuse over time).
+
+    EMBED_FLIGHT = SingleFlight("embed")
+    vector = EMBED_FLIGHT.do(content_key(text), lambda: service.embed_text(text))          # threads
+    text = await EXTRACT_FLIGHT.do_async(key, lambda: extract(path))                     # event loop
+
+Results are shared between callers: treat them as read-only (copy before mutating).
+Keys are content hashes (content_key) so they stay small whatever the input size.
+Calls are counted in metrics.SINGLEFLIGHT_CALLS (role "leader" / "coalesced").
+
+SINGLEFLIGHT_ENABLED=0 runs every call on its own.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import SINGLEFLIGHT_CALLS
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+
+
+def content_key(*parts: Any) -> str:
+    """SHA-256 over the parts (str() of each, separated so ("ab", "c") != ("a", "bc"))."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _LeaderCancelled(Exception):
+    """The async leader was cancelled (client gone); a waiting caller takes over."""
+
+
+class SingleFlight:
+    def __init__(self, kind: str, enabled: Optional[bool] = None):
+        self.kind = kind
+        self.enabled = SINGLEFLIGHT_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._futures: Dict[str, asyncio.Future] = {}
+
+    def _count(self, role: str):
+        SINGLEFLIGHT_CALLS.inc((self.kind, role))
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Blocking variant (threadpool code): runs fn() unless an identical call is in flight."""
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self._count("coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self._count("leader")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Event-loop variant: awaits factory() unless an identical call is in flight.
+        The work runs in the leader's own task, so it may use the leader's resources
+        (e.g. its spooled temp file). If the leader is cancelled, one of the waiting
+        callers runs the work again instead of failing.
+        """
+        if not self.enabled:
+            return await factory()
+        counted = False
+        while key in self._futures:
+            if not counted:
+                self._count("coalesced")
+                counted = True
+            try:
+                # shield: a waiter that is cancelled must not cancel the shared future
+                return await asyncio.shield(self._futures[key])
+            except _LeaderCancelled:
+                continue
+
+        if not counted:
+            self._count("leader")
+        future = asyncio.get_running_loop().create_future()
+        self._futures[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._futures[key]
+            # Marks an exception as retrieved (no "exception was never retrieved" log when nobody waited)
+            future.exception()
@@ -0,0 +1,105 @@
+"""
+Tests for the in-process token / membership caches in auth.py.
+DB access is replaced with a counting stub, so no database is touched.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import auth
+
+
+@pytest.fixture(autouse=True)
+def clean_caches():
+    auth.invalidate_membership_cache()
+    auth.invalidate_token_cache()
+    yield
+    auth.invalidate_membership_cache()
+    auth.invalidate_token_cache()
+
+
+@pytest.fixture
+def membership_calls(monkeypatch):
+    calls = []
+
+    async def fake_get_membership(tenant_id, user_id):
+        calls.append((tenant_id, user_id))
+        if (tenant_id, user_id) == ("tenant-a", "user-1"):
+            return {"role": "admin", "display_name": "Alice (Admin)"}
+        return None
+
+    monkeypatch.setattr(auth, "get_membership_async", fake_get_membership)
+    return calls
+
+
+def test_membership_is_cached(membership_calls):
+    ctx1 = asyncio.run(auth.get_current_context("tenant-a", user_id="user-1"))
+    ctx2 = asyncio.run(auth.get_current_context("tenant-a", user_id="user-1"))
+    assert ctx1 == ctx2 == {
+        "user_id": "user-1",
+        "tenant_id": "tenant-a",
+        "role": "admin",
+        "display_name": "Alice (Admin)",
+    }
+    assert len(membership_calls) == 1
+
+
+def test_denial_is_not_cached(membership_calls):
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(auth.get_current_context("tenant-b", user_id="user-2"))
+        assert exc.value.status_code == 403
+    assert len(membership_calls) == 2
+
+
+def test_zero_ttl_disables_the_membership_cache(membership_calls, monkeypatch):
+    monkeypatch.setattr(auth, "MEMBERSHIP_CACHE_TTL_SECONDS", 0)
+    for _ in range(2):
+        asyncio.run(auth.get_current_context("tenant-a", user_id="user-1"))
+    assert len(membership_calls) == 2
+
+
+def test_invalidation_by_user_and_tenant(membership_calls):
+    asyncio.run(auth.get_current_context("tenant-a", user_id="user-1"))
+    assert auth.invalidate_membership_cache(tenant_id="tenant-b") == 0
+    assert auth.invalidate_membership_cache(user_id="user-1") == 1
+    asyncio.run(auth.get_current_context("tenant-a", user_id="user-1"))
+    assert len(membership_calls) == 2
+
+
+def test_ttl_cache_expiry_and_lru_bound(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth.time, "monotonic", lambda: now[0])
+    cache = auth.TTLCache(max_entries=2)
+    cache.set("a", 1, ttl_seconds=10)
+    cache.set("b", 2, ttl_seconds=10)
+    assert cache.get("a") == 1  # "a" becomes most recently used
+    cache.set("c", 3, ttl_seconds=10)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] += 11
+    assert cache.get("a") is None
+
+
+def test_verified_token_is_cached(monkeypatch):
+    token = auth.create_access_token({"sub": "user-1"})
+    assert auth.get_current_user_id(token) == "user-1"
+
+    def fail_decode(*args, **kwargs):
+        raise AssertionError("token should have been served from cache")
+
+    monkeypatch.setattr(auth.jwt, "decode", fail_decode)
+    assert auth.get_current_user_id(token) == "user-1"
+
+
+def test_invalid_token_is_rejected():
+    with pytest.raises(HTTPException) as exc:
+        auth.get_current_user_id("not-a-jwt")
+    assert exc.value.status_code == 401
@@ -0,0 +1,202 @@
+"""
+Tests for batch chat jobs (batch_jobs.py) with a fake LLM stream and log writer,
+so no API key, vector store or database is needed.
+"""
+
+import asyncio
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from output_shield import compile_pii_shield
+from policy_store import load_policies
+
+POLICIES = load_policies(backend_dir / "policies.yaml")
+
+
+@pytest.fixture
+def batch_jobs(monkeypatch):
+    """
+    The batch_jobs module. providers.py refuses to import without GEMINI_API_KEY: the dummy key is set
+    for this test only (set at module level it would leak into test_rag.py, which then talks to Gemini).
+    """
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    import batch_jobs
+    return batch_jobs
+
+
+def make_upload(lines):
+    data = "\n".join(l if isinstance(l, str) else json.dumps(l, ensure_ascii=False) for l in lines)
+    return UploadFile(file=io.BytesIO(data.encode("utf-8")), filename="prompts.jsonl")
+
+
+def patch_pipeline(monkeypatch, batch_jobs, failures=0):
+    import chat_pipeline
+    state = {"active": 0, "peak": 0, "failures": failures, "logs": []}
+
+    async def fake_stream(model, system_prompt, message):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(0.01)
+            if state["failures"] > 0:
+                state["failures"] -= 1
+                yield "Error: 503 UNAVAILABLE"
+                return
+            yield "連絡先は090-1234-"
+            yield "5678です"
+        finally:
+            state["active"] -= 1
+
+    async def fake_log(entry):
+        state["logs"].append(entry)
+
+    monkeypatch.setattr(chat_pipeline, "call_llm_stream", fake_stream)
+    monkeypatch.setattr(batch_jobs, "insert_log_entry_async", fake_log)
+    monkeypatch.setattr(batch_jobs, "BATCH_RETRY_BACKOFF_SECONDS", 0.0)
+    return state
+
+
+def test_parse_marks_bad_lines_failed(batch_jobs):
+    items, messages = batch_jobs.parse_batch_lines(b'{"id": "a", "message": "hi"}\n\nnot json\n{"message": ""}\n{"message": "x"}\n')
+    assert [i["id"] for i in items] == ["a", "3", "4", "5"]
+    assert [i["status"] for i in items] == ["queued", "failed", "failed", "queued"]
+    assert messages == ["hi", None, None, "x"]
+
+
+def test_batch_runs_pipeline_with_model_cap_retries_and_logs(batch_jobs, monkeypatch, tmp_path):
+    state = patch_pipeline(monkeypatch, batch_jobs, failures=1)
+    monkeypatch.setattr(batch_jobs, "BATCH_DEFAULT_MODEL_CONCURRENCY", 2)
+    manager = batch_jobs.BatchJobManager(POLICIES, compile_pii_shield(POLICIES), output_dir=str(tmp_path), workers=8, model_limits={})
+
+    async def run():
+        prompts = [{"id": f"t{i}", "message": f"チケット{i}を分類してください"} for i in range(10)] + ["{broken"]
+        job = await manager.submit("tenant-a", "user-1", make_upload(prompts))
+        await asyncio.gather(*manager._tasks)
+        return manager.get_job("tenant-a", job["job_id"]), manager.output_path("tenant-a", job["job_id"])
+
+    job, path = asyncio.run(run())
+    assert job["status"] == "completed_with_errors"
+    assert job["progress"]["completed"] == 10 and job["progress"]["failed"] == 1
+    assert job["progress"]["retries"] == 1
+    assert job["throughput"]["items_per_second"] > 0
+    # Eight workers, but at most two calls per model (every prompt here routes to the same model)
+    assert len(set(job["models"])) == 1 and state["peak"] == 2
+
+    results = [json.loads(l) for l in path.read_text(encoding="utf-8").splitlines()]
+    assert sorted(r["line"] for r in results) == list(range(1, 12))
+    done = [r for r in results if r["status"] == "completed"]
+    # The phone number split over two chunks is masked in the output file
+    assert all("090-1234-5678" not in r["reply"] for r in done)
+    assert all(r["mode"] and r["model"] for r in done)
+    # Every prompt that reached the pipeline is a Log row; the retry is not logged twice
+    assert len(state["logs"]) == 10
+    assert all(log.context_stats["batch"]["job_id"] == job["job_id"] for log in state["logs"])
+    assert manager.get_job("tenant-b", job["job_id"]) is None
+
+
+def test_concurrent_jobs_share_one_batch_pool(batch_jobs, monkeypatch, tmp_path):
+    state = patch_pipeline(monkeypatch, batch_jobs)
+    monkeypatch.setattr(batch_jobs, "BATCH_DEFAULT_MODEL_CONCURRENCY", 100)
+    manager = batch_jobs.BatchJobManager(POLICIES, [], output_dir=str(tmp_path), workers=8, concurrency=3, model_limits={})
+
+    async def run():
+        prompts = [{"message": f"ログ{i}を要約して"} for i in range(10)]
+        jobs = [await manager.submit(tenant, "user-1", make_upload(prompts)) for tenant in ("tenant-a", "tenant-a", "tenant-b")]
+        await asyncio.gather(*manager._tasks)
+        return [manager.get_job(t, j["job_id"]) for j, t in zip(jobs, ("tenant-a", "tenant-a", "tenant-b"))]
+
+    jobs = asyncio.run(run())
+    assert all(job["status"] == "completed" for job in jobs)
+    # Three jobs with eight workers each, but never more than three prompts in flight overall
+    assert state["peak"] == 3
+
+
+def test_permanently_failing_item_is_logged_once(batch_jobs, monkeypatch, tmp_path):
+    state = patch_pipeline(monkeypatch, batch_jobs, failures=10)
+    manager = batch_jobs.BatchJobManager(POLICIES, [], output_dir=str(tmp_path), max_retries=1)
+
+    async def run():
+        job = await manager.submit("tenant-a", "user-1", make_upload([{"message": "hello"}]))
+        await asyncio.gather(*manager._tasks)
+        return manager.get_job("tenant-a", job["job_id"])
+
+    job = asyncio.run(run())
+    assert job["status"] == "failed"
+    assert job["items"][0]["attempts"] == 2
+    assert "503" in job["items"][0]["error"]
+    assert [log.safety_flags for log in state["logs"]] == [["batch_failed"]]
+
+
+def test_history_never_evicts_running_jobs(batch_jobs, monkeypatch, tmp_path):
+    patch_pipeline(monkeypatch, batch_jobs)
+    monkeypatch.setattr(batch_jobs, "BATCH_JOB_HISTORY", 2)
+    manager = batch_jobs.BatchJobManager(POLICIES, [], output_dir=str(tmp_path), model_limits={})
+
+    async def run():
+        finished = await manager.submit("tenant-a", "user-1", make_upload([{"message": "hello"}]))
+        await asyncio.gather(*manager._tasks)
+        release = asyncio.Event()
+
+        async def blocked_stream(model, system_prompt, message):
+            await release.wait()
+            yield "ok"
+
+        import chat_pipeline
+        monkeypatch.setattr(chat_pipeline, "call_llm_stream", blocked_stream)
+        running = [await manager.submit("tenant-a", "user-1", make_upload([{"message": "hello"}])) for _ in range(2)]
+        with pytest.raises(HTTPException) as e:
+            await manager.submit("tenant-a", "user-1", make_upload([{"message": "hello"}]))
+        release.set()
+        await asyncio.gather(*manager._tasks)
+        return finished, running, e.value
+
+    finished, running, error = asyncio.run(run())
+    assert error.status_code == 429
+    # The finished job made room for the second running one; both running jobs kept their output
+    assert manager.get_job("tenant-a", finished["job_id"]) is None
+    assert not (tmp_path / f"{finished['job_id']}.jsonl").exists()
+    for job in running:
+        assert manager.get_job("tenant-a", job["job_id"])["status"] == "completed"
+        assert manager.output_path("tenant-a", job["job_id"]).exists()
+
+
+def test_prompts_waiting_for_a_saturated_model_do_not_hold_batch_slots(batch_jobs, monkeypatch, tmp_path):
+    patch_pipeline(monkeypatch, batch_jobs)
+    import chat_pipeline
+    monkeypatch.setattr(batch_jobs, "route", lambda text, policies, pii, has_attachments=False: (
+        "FAST", "pro" if "pro" in text else "flash", "system"
+    ))
+    release = asyncio.Event()
+
+    async def stream(model, system_prompt, message):
+        if model == "pro":
+            await release.wait()
+        yield "ok"
+
+    monkeypatch.setattr(chat_pipeline, "call_llm_stream", stream)
+    monkeypatch.setattr(batch_jobs, "detect_pii", lambda text: {"pii_detected": False, "detected_types": []})
+    manager = batch_jobs.BatchJobManager(POLICIES, [], output_dir=str(tmp_path), workers=8, concurrency=2,
+                                         model_limits={"pro": 1, "flash": 8})
+
+    async def run():
+        await manager.submit("tenant-a", "user-1", make_upload([{"message": f"pro {i}"} for i in range(6)]))
+        flash = await manager.submit("tenant-b", "user-2", make_upload([{"message": f"flash {i}"} for i in range(4)]))
+        # One pro call holds a batch slot; the other pro prompts wait for the model without one
+        for _ in range(200):
+            if manager.get_job("tenant-b", flash["job_id"])["status"] not in ("queued", "running"):
+                break
+            await asyncio.sleep(0.01)
+        status = manager.get_job("tenant-b", flash["job_id"])["status"]
+        release.set()
+        await asyncio.gather(*manager._tasks)
+        return status
+
+    assert asyncio.run(run()) == "completed"
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import bench_retrieval
+
+
+def test_fixture_cases_are_parsed():
+    documents = bench_retrieval.load_documents()
+    assert sorted(documents) == ["D1", "D2", "D3", "D4"]
+    cases = {c["id"]: c for c in bench_retrieval.load_cases()}
+    assert len(cases) == 7
+    assert cases["T-FTS-02"]["relevant"] == ["D2"]
+    assert cases["T-HYB-01"]["relevant"] == ["D4"]
+    assert "PROJ-A77" in cases["T-FTS-01"]["query"]
+    # Negative cases are reported but not scored
+    assert cases["T-VEC-NEG-01"]["relevant"] == []
+
+
+def test_default_configuration_keeps_retrieval_quality():
+    [result] = bench_retrieval.run(["default"], k_values=[1, 5], rounds=1)
+    assert result["queries_scored"] == 5
+    assert result["recall_at_5"] == 1.0
+    # Baseline with the local embedder: 0.75. A drop below this means a ranking regression.
+    assert result["mrr"] >= 0.7
+    assert result["ingest_chunks_per_second"] > 0
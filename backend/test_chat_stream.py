@@ -0,0 +1,151 @@
+"""
+Tests for the /chat stream (main.chat_endpoint): extraction, PII analysis and retrieval run
+concurrently behind an early status line. Every stage is stubbed with a delay, so no API key,
+vector store, Presidio model or database is needed; the app's startup hook is not run.
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from fastapi import UploadFile
+
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from admission import AdmissionController
+from governance_kernel import merge_pii_results
+from output_shield import compile_pii_shield
+from policy_store import load_policies
+
+POLICIES = load_policies(backend_dir / "policies.yaml")
+STAGE_SECONDS = 0.3
+NO_PII = {"pii_detected": False, "detected_types": []}
+
+
+class SlowRetriever:
+    def __init__(self, events):
+        self.events = events
+
+    def search(self, tenant_id, query, n_results=5, timings=None):
+        time.sleep(STAGE_SECONDS)
+        self.events["retrieval_done"] = time.perf_counter()
+        return ["経費精算は翌月5日まで。"]
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """Stubs every stage of main.chat_endpoint; returns (main module, events, spooled paths)."""
+    # providers.py refuses to import without a key: set for this test only, so that it does not
+    # leak into test_rag.py (which would then build a real Gemini retriever)
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    import chat_pipeline
+    import main
+
+    events = {"cancelled": []}
+    spooled = []
+    controller = AdmissionController()
+    controller.configure(POLICIES)
+
+    def slow_pii(text):
+        time.sleep(STAGE_SECONDS)
+        return {"pii_detected": True, "detected_types": ["PHONE_NUMBER"]} if "090" in text else NO_PII
+
+    async def slow_extract(path, filename, sha256=None):
+        try:
+            await asyncio.sleep(STAGE_SECONDS if filename != "slow.txt" else 30)
+        except asyncio.CancelledError:
+            events["cancelled"].append(filename)
+            raise
+        if filename == "broken.txt":
+            raise ValueError("unreadable file")
+        return Path(path).read_text(encoding="utf-8")
+
+    real_spool = main.spool_upload
+
+    async def recording_spool(file):
+        path, sha256 = await real_spool(file)
+        spooled.append(path)
+        return path, sha256
+
+    async def fake_llm(model, system_prompt, message):
+        yield "承知しました。"
+
+    async def no_log(entry):
+        events["log"] = entry
+
+    monkeypatch.setattr(main, "POLICIES", POLICIES)
+    monkeypatch.setattr(main, "OUTPUT_SHIELD_RULES", compile_pii_shield(POLICIES))
+    monkeypatch.setattr(main, "ADMISSION", controller)
+    monkeypatch.setattr(main, "RAG_ENGINE", SlowRetriever(events))
+    monkeypatch.setattr(main, "detect_pii", slow_pii)
+    monkeypatch.setattr(main, "extract_text_from_path", slow_extract)
+    monkeypatch.setattr(main, "spool_upload", recording_spool)
+    monkeypatch.setattr(main, "insert_log_entry_async", no_log)
+    monkeypatch.setattr(chat_pipeline, "call_llm_stream", fake_llm)
+    return main, events, spooled
+
+
+def upload(name, text):
+    return UploadFile(file=io.BytesIO(text.encode("utf-8")), filename=name)
+
+
+async def run_chat(main, message, files):
+    """(seconds since the call, parsed event) for every NDJSON line of the stream."""
+    started = time.perf_counter()
+    response = await main.chat_endpoint(
+        "tenant-a", message=message, files=files, session_id=None, attachment_ids=None,
+        context={"user_id": "user-1", "tenant_id": "tenant-a"},
+    )
+    lines = []
+    async for line in response.body_iterator:
+        lines.append((time.perf_counter(), json.loads(line)))
+    return started, lines
+
+
+def test_merge_pii_results_unions_types_in_order():
+    merged = merge_pii_results([
+        {"pii_detected": True, "detected_types": ["PHONE_NUMBER", "EMAIL_ADDRESS"]},
+        NO_PII,
+        {"pii_detected": True, "detected_types": ["EMAIL_ADDRESS", "PERSON"]},
+    ])
+    assert merged == {"pii_detected": True, "detected_types": ["PHONE_NUMBER", "EMAIL_ADDRESS", "PERSON"]}
+    assert merge_pii_results([NO_PII, {}]) == NO_PII
+
+
+def test_first_line_arrives_before_the_slowest_stage_finishes(chat):
+    main, events, spooled = chat
+    started, lines = asyncio.run(run_chat(main, "経費の締め日は？", [upload("memo.txt", "連絡先 090-1234-5678")]))
+
+    first_at, first = lines[0]
+    assert first["type"] == "status"
+    assert first_at < events["retrieval_done"]
+    # Retrieval, message scan and extraction + attachment scan overlap: about two stages, not four
+    assert events["retrieval_done"] - started < 3 * STAGE_SECONDS
+    complete = lines[-1][1]
+    assert complete["type"] == "complete"
+    # The attachment's PII result is merged with the message's
+    assert complete["meta"]["safety_flags"] == ["pii"]
+    assert events["log"].safety_flags == ["PHONE_NUMBER"]
+    assert not any(os.path.exists(p) for p in spooled)
+
+
+def test_failing_extraction_cancels_the_other_stages_and_removes_spooled_files(chat):
+    main, events, spooled = chat
+
+    async def scenario():
+        started, lines = await run_chat(main, "要約して", [upload("broken.txt", "x"), upload("slow.txt", "y")])
+        await asyncio.sleep(0)  # let the cancelled task run its handler
+        return started, lines
+
+    started, lines = asyncio.run(scenario())
+    finished_at, last = lines[-1]
+    assert last["type"] == "error" and "unreadable file" in last["content"]
+    assert events["cancelled"] == ["slow.txt"]
+    assert finished_at - started < 5 * STAGE_SECONDS
+    assert len(spooled) == 2 and not any(os.path.exists(p) for p in spooled)
@@ -0,0 +1,56 @@
+from context_packer import estimate_tokens, get_context_budget, pack_context, truncate_to_tokens
+from pathlib import Path
+
+from policy_store import load_policies
+
+
+def test_estimate_and_truncate():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("経費精算") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    text = "経費精算のルール " * 50
+    assert estimate_tokens(truncate_to_tokens(text, 40)) <= 40
+    assert truncate_to_tokens("short", 100) == "short"
+
+
+def test_everything_fits_unchanged():
+    packed = pack_context("SYSTEM", "質問", ["passage one", "passage two"], [("a.txt", "file body")],
+                          {"max_input_tokens": 1000})
+    assert "passage one\n\npassage two" in packed["system_prompt"]
+    assert packed["message"] == "質問\n\n[Attached Files]\nFilename: a.txt\nContent:\nfile body"
+    assert packed["stats"]["truncated"] is False
+    assert packed["stats"]["estimated_tokens"] <= 1000
+
+
+def test_passages_dropped_in_rank_order():
+    passages = ["一" * 300, "二" * 300, "三" * 300]
+    packed = pack_context("S", "Q", passages, [], {"max_input_tokens": 500})
+    stats = packed["stats"]["passages"]
+    assert stats["included"] == 2 and stats["truncated"] == 1 and stats["dropped"] == 1
+    assert "一" * 300 in packed["system_prompt"] and "三" not in packed["system_prompt"]
+    assert packed["stats"]["estimated_tokens"] <= 500
+
+
+def test_attachment_keeps_relevant_excerpts():
+    filler = "これは関係のない段落です。" * 200
+    relevant = "交通費の精算期限は翌月5日です。"
+    document = filler + "\n\n" + relevant + "\n\n" + filler
+    packed = pack_context("S", "交通費の精算期限は?", [], [("rules.txt", document)], {"max_input_tokens": 1500})
+    assert relevant in packed["message"]
+    attachment = packed["stats"]["attachments"][0]
+    assert attachment["truncated"] and attachment["excerpts"] < attachment["excerpts_total"]
+    assert packed["stats"]["estimated_tokens"] <= 1500
+
+
+def test_budget_comes_from_policies():
+    policies = load_policies(Path(__file__).parent / "policies.yaml")
+    assert get_context_budget("HEAVY", policies)["max_input_tokens"] > get_context_budget("FAST", policies)["max_input_tokens"]
+    assert get_context_budget("UNKNOWN", policies)["max_input_tokens"] > 0
+
+
+def test_history_is_kept_and_counted():
+    history = "User: 前の質問\nAssistant: 前の回答\n"
+    packed = pack_context("S", "Q", ["一" * 300], [], {"max_input_tokens": 200}, history)
+    assert "[Conversation So Far]\n" + history in packed["system_prompt"]
+    assert packed["stats"]["history_tokens"] > 0
+    assert packed["stats"]["estimated_tokens"] <= 200
@@ -0,0 +1,46 @@
+"""
+Tests for exact / near-duplicate detection (dedup.py) and its use in HybridRetriever.
+"""
+
+import sys
+from pathlib import Path
+
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from dedup import DedupIndex, collapse_near_duplicates, content_hash, minhash, similarity
+
+BASE = (
+    "2. 物品購入の上限 - 通常案件における物品購入の最大許容額は、1 回あたり 5000 JPY とする。"
+    "ただし、上長の事前承認があれば、この限りではない。3. 精算手続き - 領収書を添付して月末までに申請する。"
+)
+
+
+def test_content_hash_ignores_formatting():
+    assert content_hash(BASE) == content_hash(BASE.replace(" ", "\n "))
+    assert content_hash(BASE) != content_hash(BASE.replace("5000", "8000"))
+
+
+def test_minhash_estimates_similarity():
+    edited = BASE.replace("月末", "翌月5日")
+    assert similarity(minhash(BASE), minhash(BASE)) == 1.0
+    assert similarity(minhash(BASE), minhash(edited)) > 0.8
+    assert similarity(minhash(BASE), minhash("従業員の健康管理に関する基本方針を定める。")) < 0.2
+
+
+def test_collapse_keeps_highest_ranked_of_each_group():
+    edited = BASE.replace("月末", "翌月5日")
+    other = "ゼロトラスト・アーキテクチャに基づき、社内ネットワークを安全とは見なさない。"
+    assert collapse_near_duplicates([BASE, other, edited]) == [BASE, other]
+
+
+def test_index_finds_exact_and_near(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.db"))
+    index.add("tenant-a", [("doc1:0", "doc1", content_hash(BASE), minhash(BASE))])
+
+    assert index.find_exact("tenant-a", [content_hash(BASE)]) == {content_hash(BASE): ("doc1:0", "doc1")}
+    assert index.find_exact("tenant-b", [content_hash(BASE)]) == {}
+
+    near = index.find_near("tenant-a", minhash(BASE.replace("月末", "翌月5日")))
+    assert near is not None and near[0] == "doc1:0"
+    assert index.find_near("tenant-b", minhash(BASE)) is None
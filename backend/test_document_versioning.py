@@ -0,0 +1,231 @@
+"""
+Tests for document versioning, delete and cross-store consistency (rag_kernel.HybridRetriever +
+document_catalog.py), using a temp SQLite file and the in-memory vector store from conftest.py.
+"""
+
+import json
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from document_catalog import VersionConflictError
+
+V1 = "第1条 経費は月末までに申請する。\n\n第2条 物品購入は5000円まで。\n\n第3条 交通費は実費精算とする。"
+V2 = "第1条 経費は月末までに申請する。\n\n第2条 物品購入は8000円まで。\n\n第3条 交通費は実費精算とする。"
+
+
+@pytest.fixture
+def rag(make_retriever):
+    retriever = make_retriever()
+    # One chunk per paragraph keeps the diffs easy to reason about
+    retriever.chunk_document = lambda text: [p for p in text.split("\n\n") if p]
+    return retriever
+
+
+def stored_texts(rag, tenant_id="tenant-a"):
+    vector = sorted(doc for (t, _), (doc, _, _) in rag.vector_store.rows.items() if t == tenant_id)
+    keyword = sorted(rag.keyword_store.get_documents(tenant_id, rag.keyword_store.list_ids(tenant_id)).values())
+    assert vector == keyword
+    return vector
+
+
+def test_reingest_only_embeds_changed_chunks(rag):
+    first = rag.ingest_document("tenant-a", V1, {"filename": "rules.pdf"})
+    assert (first["version"], first["new_chunks"]) == (1, 3)
+
+    second = rag.ingest_document("tenant-a", V2, {"filename": "rules.pdf"})
+
+    assert second["doc_id"] == first["doc_id"]
+    assert second["version"] == 2
+    assert (second["new_chunks"], second["unchanged_chunks"], second["removed_chunks"]) == (1, 2, 1)
+    assert rag.embedding_service.embedded == 4
+    assert "第2条 物品購入は8000円まで。" in stored_texts(rag)
+    assert "第2条 物品購入は5000円まで。" not in stored_texts(rag)
+    assert [d["version"] for d in rag.list_documents("tenant-a")["items"]] == [2]
+
+    third = rag.ingest_document("tenant-a", V2, {"filename": "rules.pdf"})
+    assert third["unchanged"] and third["version"] == 2
+    assert rag.embedding_service.embedded == 4
+
+
+def test_external_id_overrides_filename(rag):
+    a = rag.ingest_document("tenant-a", V1, {"filename": "rules.pdf"}, doc_key="policy-001")
+    b = rag.ingest_document("tenant-a", V2, {"filename": "rules_v2.pdf"}, doc_key="policy-001")
+    assert a["doc_id"] == b["doc_id"]
+    assert len(rag.list_documents("tenant-a")["items"]) == 1
+
+
+def test_delete_keeps_chunks_linked_from_other_documents(rag):
+    a = rag.ingest_document("tenant-a", V1, {"filename": "a.pdf"})
+    b = rag.ingest_document("tenant-a", V2, {"filename": "b.pdf"})
+    assert (b["new_chunks"], b["duplicate_chunks"]) == (1, 2)
+
+    assert rag.delete_document("tenant-a", a["doc_id"])
+    assert stored_texts(rag) == sorted(V2.split("\n\n"))
+    assert rag.reconcile("tenant-a", repair=False)["consistent"]
+
+    assert rag.delete_document("tenant-a", b["doc_id"])
+    assert stored_texts(rag) == []
+    assert rag.list_documents("tenant-a")["items"] == []
+    assert not rag.delete_document("tenant-a", b["doc_id"])
+
+
+def test_failed_write_leaves_no_trace(rag):
+    rag.ingest_document("tenant-a", V1, {"filename": "rules.pdf"})
+    before = stored_texts(rag)
+    rag.vector_store.fail_adds = 1
+
+    with pytest.raises(RuntimeError):
+        rag.ingest_document("tenant-a", V2, {"filename": "rules.pdf"})
+
+    assert stored_texts(rag) == before
+    assert rag.list_documents("tenant-a")["items"][0]["version"] == 1
+    assert rag.catalog.pending_ops() == []
+
+
+def test_losing_concurrent_reingest_keeps_the_winners_chunks(rag):
+    rag.ingest_document("tenant-a", V1, {"filename": "rules.pdf"})
+    # Two re-ingests of the same key with the same new content plan against version 1
+    chunks = rag.chunk_document(V2)
+    winner = rag.plan_document("tenant-a", "rules.pdf", chunks)
+    loser = rag.plan_document("tenant-a", "rules.pdf", chunks)
+    embeddings = rag.embed_chunks([p["text"] for p in winner["chunks"] if p["duplicate_of"] is None])
+
+    rag.commit_document("tenant-a", winner, embeddings, {"filename": "rules.pdf"})
+    with pytest.raises(VersionConflictError):
+        rag.commit_document("tenant-a", loser, embeddings, {"filename": "rules.pdf"})
+
+    # The loser's rollback must not delete the ids the winner just committed
+    assert stored_texts(rag) == sorted(chunks)
+    assert rag.reconcile("tenant-a", repair=False)["consistent"]
+    assert rag.catalog.pending_ops() == []
+
+
+def test_rollback_spares_ids_of_another_in_flight_op(rag):
+    rag.ingest_document("tenant-a", V1, {"filename": "rules.pdf"})
+    plan = rag.plan_document("tenant-a", "rules.pdf", rag.chunk_document(V2))
+    new_ids = [p["chunk_id"] for p in plan["chunks"] if p["duplicate_of"] is None]
+    # Another ingest of the same content has journaled and upserted these ids but not committed yet
+    other_op = rag.catalog.begin_op("tenant-a", plan["doc_id"], new_ids)
+    rag.vector_store.add_documents("tenant-a", ["pending"] * len(new_ids), [{}] * len(new_ids), new_ids, [[0.0]] * len(new_ids))
+    rag.vector_store.fail_adds = 1
+
+    with pytest.raises(RuntimeError):
+        rag.commit_document("tenant-a", plan, [[0.0]] * len(new_ids), {"filename": "rules.pdf"})
+    assert all(("tenant-a", i) in rag.vector_store.rows for i in new_ids)
+    assert [op["op_id"] for op in rag.catalog.pending_ops()] == [other_op]
+
+
+def test_recover_pending_ops_rolls_back_uncommitted_adds(rag):
+    rag.ingest_document("tenant-a", V1, {"filename": "rules.pdf"})
+    # Simulate a crash between the Chroma upsert and the SQLite commit
+    op_id = rag.catalog.begin_op("tenant-a", "ghost", ["ghost:1"])
+    rag.vector_store.add_documents("tenant-a", ["orphan"], [{}], ["ghost:1"], [[0.0]])
+    # Still running in this process: left alone
+    assert rag.recover_pending_ops() == 0
+    rag.catalog.release_op(op_id)  # the call that owned it is gone
+
+    assert rag.recover_pending_ops() == 1
+    assert ("tenant-a", "ghost:1") not in rag.vector_store.rows
+    assert rag.reconcile("tenant-a", repair=False)["consistent"]
+
+
+def test_reconcile_during_an_ingest_keeps_its_vectors(rag):
+    # Another worker (or an admin) runs reconcile between the vector upsert and the SQLite commit
+    reports = []
+    add = rag.vector_store.add_documents
+
+    def add_then_reconcile(*args, **kwargs):
+        add(*args, **kwargs)
+        reports.append(rag.reconcile("tenant-a"))
+
+    rag.vector_store.add_documents = add_then_reconcile
+    doc = rag.ingest_document("tenant-a", V1, {"filename": "rules.pdf"})
+    rag.vector_store.add_documents = add
+
+    assert reports[0]["recovered_ops"] == 0 and reports[0]["orphaned_in_vector"]["count"] == 0
+    ids = [c["chunk_id"] for c in rag.catalog.get_manifest("tenant-a", doc["doc_id"])]
+    assert all(("tenant-a", i) in rag.vector_store.rows for i in ids)
+    assert rag.reconcile("tenant-a", repair=False)["consistent"]
+
+
+def test_ops_of_other_workers_are_recovered_only_when_their_owner_is_gone(rag, monkeypatch):
+    def journal(op_id, owner, heartbeat_at):
+        conn = rag.catalog.connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO rag_pending_ops (op_id, tenant_id, doc_id, status, add_ids, delete_ids, created_at, owner, heartbeat_at) "
+                "VALUES (?, 'tenant-a', 'ghost', 'pending', ?, '[]', '', ?, ?)",
+                (op_id, json.dumps([f"{op_id}:1"]), owner, heartbeat_at),
+            )
+        conn.close()
+        rag.vector_store.add_documents("tenant-a", ["x"], [{}], [f"{op_id}:1"], [[0.0]])
+
+    host = socket.gethostname()
+    journal("live", f"{host}:{os.getppid()}", time.time())          # another worker on this host
+    journal("remote", "other-host:1", time.time())                  # another host, fresh lease
+    journal("expired", "other-host:1", time.time() - 3600)          # another host, lease expired
+    journal("dead", f"{host}:{2 ** 22 + 1}", time.time())           # pid no longer exists
+
+    assert rag.recover_pending_ops() == 2
+    assert sorted(op["op_id"] for op in rag.catalog.pending_ops()) == ["live", "remote"]
+    assert ("tenant-a", "live:1") in rag.vector_store.rows
+    assert ("tenant-a", "dead:1") not in rag.vector_store.rows
+
+
+def test_reconcile_repairs_both_stores(rag):
+    doc = rag.ingest_document("tenant-a", V1, {"filename": "rules.pdf"})
+    ids = [c["chunk_id"] for c in rag.catalog.get_manifest("tenant-a", doc["doc_id"])]
+    rag.keyword_store.delete_documents("tenant-a", [ids[0]])
+    rag.vector_store.delete_documents("tenant-a", [ids[1]])
+    rag.keyword_store.add_documents("tenant-a", ["stray"], [{}], ["stray:0"])
+
+    report = rag.reconcile("tenant-a")
+    assert not report["consistent"]
+    assert report["missing_in_keyword"]["sample"] == [ids[0]]
+    assert report["missing_in_vector"]["sample"] == [ids[1]]
+    assert report["orphaned_in_keyword"]["sample"] == ["stray:0"]
+
+    assert rag.reconcile("tenant-a")["consistent"]
+    assert stored_texts(rag) == sorted(V1.split("\n\n"))
+
+
+def test_legacy_chunks_are_adopted_into_the_catalog(rag):
+    rag.vector_store.add_documents(
+        "tenant-a", ["legacy document"], [{"filename": "old.txt", "uploader": "user-1"}], ["legacy-1"], [[0.0]]
+    )
+    docs = rag.list_documents("tenant-a")["items"]
+    assert [(d["id"], d["metadata"]["filename"]) for d in docs] == [("legacy-1", "old.txt")]
+    assert rag.delete_document("tenant-a", "legacy-1")
+    assert rag.vector_store.rows == {}
+
+
+def test_list_documents_paginates_and_filters(make_retriever):
+    rag = make_retriever()
+    for n, (name, uploader) in enumerate([("a.txt", "alice"), ("b.txt", "bob"), ("report_a.pdf", "alice")]):
+        rag.ingest_document("tenant-a", f"document {name} body {n}", {
+            "filename": name, "uploader": uploader, "timestamp": f"2025-01-0{n + 1}T00:00:00Z",
+        })
+
+    first = rag.list_documents("tenant-a", limit=2)
+    assert [d["metadata"]["filename"] for d in first["items"]] == ["report_a.pdf", "b.txt"]
+    assert "body" not in str(first["items"])
+    second = rag.list_documents("tenant-a", limit=2, cursor=first["next_cursor"])
+    assert [d["metadata"]["filename"] for d in second["items"]] == ["a.txt"]
+    assert second["next_cursor"] is None
+    assert rag.list_documents("tenant-a", limit=2, offset=2)["items"] == second["items"]
+
+    def names(**filters):
+        return [d["metadata"]["filename"] for d in rag.list_documents("tenant-a", **filters)["items"]]
+
+    assert names(uploader="alice") == ["report_a.pdf", "a.txt"]
+    assert names(filename="A.") == ["report_a.pdf", "a.txt"]
+    assert names(filename="_") == ["report_a.pdf"]
+    assert names(since="2025-01-02T00:00:00Z", until="2025-01-02T23:59:59Z") == ["b.txt"]
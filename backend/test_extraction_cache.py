@@ -0,0 +1,138 @@
+"""
+Tests for the SHA-256 keyed extraction cache (extraction_cache.py / file_parser.py).
+"""
+
+import asyncio
+import io
+import sys
+import threading
+from pathlib import Path
+
+from fastapi import UploadFile
+
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import file_parser
+from extraction_cache import ExtractionCache
+from metrics import EXTRACTION_CACHE_LOOKUPS
+
+TEST_DATA = backend_dir / "tests" / "test_data"
+
+
+def test_memory_tier_is_lru_bounded_by_bytes(tmp_path):
+    cache = ExtractionCache(None, memory_bytes=10, disk_bytes=0)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"  # "b" is now least recently used
+    cache.put("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.stats()["memory_bytes"] <= 10
+
+
+def test_disk_tier_survives_restart_and_is_bounded(tmp_path):
+    cache = ExtractionCache(tmp_path, memory_bytes=0, disk_bytes=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    cache.put("c", "cccc")
+    assert sorted(p.stem for p in tmp_path.glob("*.txt")) == ["b", "c"]
+
+    reopened = ExtractionCache(tmp_path, memory_bytes=1024, disk_bytes=10)
+    assert reopened.get("c") == "cccc"
+    assert reopened.get("c") == "cccc"
+    assert reopened.get("a") is None
+    stats = reopened.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+    assert abs(stats["hit_rate"] - 2 / 3) < 1e-9
+
+
+def test_lookups_are_exported_as_counters(tmp_path):
+    before = {r: EXTRACTION_CACHE_LOOKUPS.value((r,)) for r in ("memory_hit", "disk_hit", "miss")}
+    ExtractionCache(tmp_path, memory_bytes=0, disk_bytes=1024).put("a", "aaaa")
+    cache = ExtractionCache(tmp_path, memory_bytes=1024, disk_bytes=1024)
+    cache.get("a"), cache.get("a"), cache.get("b")
+    after = {r: EXTRACTION_CACHE_LOOKUPS.value((r,)) for r in before}
+    assert {r: after[r] - before[r] for r in before} == {"memory_hit": 1, "disk_hit": 1, "miss": 1}
+
+
+def test_repeated_attachment_skips_parsing(tmp_path, monkeypatch):
+    cache = ExtractionCache(tmp_path, memory_bytes=1024 * 1024, disk_bytes=1024 * 1024)
+    monkeypatch.setattr(file_parser, "EXTRACTION_CACHE", cache)
+    pdf = next(TEST_DATA.glob("F1a_*.pdf")).read_bytes()
+
+    async def extract(name):
+        return await file_parser.extract_text_from_file(UploadFile(file=io.BytesIO(pdf), filename=name))
+
+    first = asyncio.run(extract("chat.pdf"))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("PDF should not be parsed again")
+
+    monkeypatch.setattr(file_parser, "iter_pdf_pages", fail)
+    assert asyncio.run(extract("ingest.pdf")) == first
+    assert cache.stats()["memory_hits"] == 1
+    file_parser.shutdown_process_pool()
+
+
+def test_cache_io_runs_off_the_event_loop(tmp_path, monkeypatch):
+    cache = ExtractionCache(tmp_path, memory_bytes=1024, disk_bytes=1024)
+    monkeypatch.setattr(file_parser, "EXTRACTION_CACHE", cache)
+    threads = []
+
+    def on_thread(method):
+        def wrapper(*args):
+            threads.append(threading.get_ident())
+            return method(*args)
+        return wrapper
+
+    monkeypatch.setattr(cache, "get", on_thread(cache.get))
+    monkeypatch.setattr(cache, "put", on_thread(cache.put))
+    path = tmp_path / "note.txt"
+    path.write_text("hello", encoding="utf-8")
+
+    async def extract():
+        loop_thread = threading.get_ident()
+        text = await file_parser.extract_text_from_path(str(path), "note.txt", "abc")
+        return loop_thread, text
+
+    loop_thread, text = asyncio.run(extract())
+    assert text == "hello"
+    assert len(threads) == 2 and loop_thread not in threads
+
+
+def test_concurrent_writers_of_one_key_use_their_own_temp_files(tmp_path, monkeypatch):
+    # Two workers sharing the cache directory write the same key at once
+    workers = [ExtractionCache(tmp_path, memory_bytes=0, disk_bytes=10_000_000) for _ in range(2)]
+    texts = ["a" * 1_000_000, "b" * 1_000_000]
+    threads = [threading.Thread(target=cache.put, args=("k", text)) for cache, text in zip(workers, texts)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (tmp_path / "k.txt").read_text(encoding="utf-8") in texts
+    assert list(tmp_path.glob("*.tmp")) == []
+
+    # A failed rename leaves no temp file behind
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("extraction_cache.os.replace", fail)
+    workers[0].put("other", "text")
+    assert not (tmp_path / "other.txt").exists()
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_disk_cap_covers_what_other_workers_wrote(tmp_path):
+    a = ExtractionCache(tmp_path, memory_bytes=0, disk_bytes=100, rescan_seconds=0)
+    b = ExtractionCache(tmp_path, memory_bytes=0, disk_bytes=100, rescan_seconds=0)
+    a.put("first", "x" * 60)
+    # b reads a's entry from disk although its own index never saw it
+    assert b.get("first") == "x" * 60
+    assert b.stats()["disk_hits"] == 1
+
+    b.put("second", "y" * 60)
+    # b's rescan counted a's file: the directory stays under the cap, the older entry went
+    assert sum(p.stat().st_size for p in tmp_path.glob("*.txt")) <= 100
+    assert [p.stem for p in tmp_path.glob("*.txt")] == ["second"]
+    assert a.get("first") is None
@@ -0,0 +1,54 @@
+"""
+Tests for page-parallel PDF extraction (file_parser.py): page ranges are parsed in the
+process pool and must come back in page order; PDFs over FILE_MAX_PDF_PAGES get a 413.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from pypdf import PdfReader, PdfWriter
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import file_parser
+
+TEST_DATA = Path(__file__).parent / "tests" / "test_data"
+
+
+@pytest.fixture
+def multi_page_pdf(tmp_path, monkeypatch):
+    """5 pages built from the single-page test PDFs, parsed 2 pages per worker task (3 tasks)."""
+    sources = sorted(TEST_DATA.glob("*.pdf"))
+    writer = PdfWriter()
+    for source in sources + sources[:2]:
+        writer.append(str(source))
+    path = tmp_path / "multi.pdf"
+    with open(path, "wb") as f:
+        writer.write(f)
+    monkeypatch.setattr(file_parser, "PDF_PAGES_PER_TASK", 2)
+    yield str(path)
+    file_parser.shutdown_process_pool()
+
+
+async def _collect(path):
+    return [page async for page in file_parser.iter_pdf_pages(path)]
+
+
+def test_pages_come_back_in_order(multi_page_pdf):
+    expected = [page.extract_text() or "" for page in PdfReader(multi_page_pdf).pages]
+    assert len(expected) == 5 and len(set(expected)) == 3
+
+    assert asyncio.run(_collect(multi_page_pdf)) == expected
+    text = asyncio.run(file_parser.extract_text_from_path(multi_page_pdf, "multi.pdf"))
+    assert text == "".join(page + "\n" for page in expected if page)
+
+
+def test_page_limit_is_a_413(multi_page_pdf, monkeypatch):
+    monkeypatch.setattr(file_parser, "MAX_PDF_PAGES", 4)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(_collect(multi_page_pdf))
+    assert e.value.status_code == 413
+    assert "5 pages" in e.value.detail
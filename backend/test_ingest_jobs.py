@@ -0,0 +1,118 @@
+"""
+Tests for background bulk ingestion (ingest_jobs.py) with a fake retriever,
+so no embedding API or vector store is needed.
+"""
+
+import asyncio
+import io
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import file_parser
+import ingest_jobs
+from extraction_cache import ExtractionCache
+from ingest_jobs import IngestJobManager
+from rag_kernel import chunk_text
+
+TEST_DATA = backend_dir / "tests" / "test_data"
+
+
+@pytest.fixture(autouse=True)
+def extraction_cache(tmp_path, monkeypatch):
+    """Keeps extracted texts out of the real backend/.extraction_cache."""
+    cache = ExtractionCache(tmp_path / "extraction_cache", memory_bytes=1024 * 1024, disk_bytes=1024 * 1024)
+    monkeypatch.setattr(file_parser, "EXTRACTION_CACHE", cache)
+    return cache
+
+
+def _zip_of_test_data() -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for path in sorted(TEST_DATA.iterdir()):
+            zf.write(path, arcname=f"corpus/{path.name}")
+        zf.writestr("corpus/.DS_Store", b"ignored")
+        zf.writestr("corpus/empty.txt", b"   ")
+    return buf.getvalue()
+
+
+async def _run_job(manager, files):
+    job = await manager.submit("tenant-a", "user-1", files)
+    await asyncio.gather(*manager._tasks)
+    return manager.get_job("tenant-a", job["job_id"])
+
+
+def test_zip_archive_is_ingested_with_retries(make_retriever, monkeypatch):
+    monkeypatch.setattr(ingest_jobs, "INGEST_RETRY_BACKOFF_SECONDS", 0)
+    retriever = make_retriever(embed_failures=1)
+    manager = IngestJobManager(retriever, concurrency=2, max_retries=2)
+    files = [UploadFile(file=io.BytesIO(_zip_of_test_data()), filename="corpus.zip")]
+
+    job = asyncio.run(_run_job(manager, files))
+
+    assert job["status"] == "completed_with_errors"
+    assert job["progress"]["total"] == 5
+    assert job["progress"]["completed"] == 4
+    assert job["progress"]["retries"] == 1
+    failed = [f for f in job["files"] if f["status"] == "failed"]
+    assert [f["filename"] for f in failed] == ["corpus/empty.txt"]
+    assert failed[0]["attempts"] == 1  # empty files are not retried
+    stored = retriever.vector_store.rows.values()
+    assert len({meta["doc_id"] for _, meta, _ in stored}) == 4
+    assert all(meta["uploader"] == "user-1" for _, meta, _ in stored)
+    assert job["stages"]["embed"]["items"] == retriever.embedding_service.embedded == len(stored)
+    assert manager.get_job("tenant-b", job["job_id"]) is None
+
+
+def test_reingesting_same_corpus_embeds_nothing(make_retriever):
+    retriever = make_retriever()
+    manager = IngestJobManager(retriever)
+
+    async def ingest_twice():
+        await _run_job(manager, [UploadFile(file=io.BytesIO(_zip_of_test_data()), filename="a.zip")])
+        embedded = retriever.embedding_service.embedded
+        job = await _run_job(manager, [UploadFile(file=io.BytesIO(_zip_of_test_data()), filename="b.zip")])
+        return embedded, job
+
+    embedded, job = asyncio.run(ingest_twice())
+
+    assert retriever.embedding_service.embedded == embedded
+    done = [f for f in job["files"] if f["status"] == "completed"]
+    assert len(done) == 4
+    assert all(f["unchanged"] and f["version"] == 1 for f in done)
+
+
+def test_zip_expanding_past_the_total_limit_is_a_413(make_retriever, monkeypatch, tmp_path):
+    # Every member is far below FILE_MAX_BYTES; together they expand past the archive limit
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i in range(3):
+            zf.writestr(f"bomb/{i}.txt", b"0" * (1024 * 1024))
+    monkeypatch.setattr(ingest_jobs, "MAX_ZIP_EXPANDED_BYTES", 2 * 1024 * 1024 + 1)
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(spool_dir))
+    manager = IngestJobManager(make_retriever())
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(manager.submit("tenant-a", "user-1", [UploadFile(file=io.BytesIO(buf.getvalue()), filename="bomb.zip")]))
+    assert e.value.status_code == 413
+    assert "expands to more than" in e.value.detail
+    # The members already extracted and the spooled archive are removed
+    assert list(spool_dir.iterdir()) == []
+
+
+def test_chunk_text_overlaps_and_respects_size():
+    text = "。".join(f"文{i:03d}" for i in range(200))
+    chunks = chunk_text(text, chunk_size=100, overlap=10)
+    assert all(len(c) <= 100 for c in chunks)
+    assert chunks[0][-5:] in chunks[1]
+    assert chunk_text("short") == ["short"]
+    assert chunk_text("   ") == []
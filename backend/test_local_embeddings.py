@@ -0,0 +1,133 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import rag_kernel
+from local_embeddings import LocalEmbeddingService
+from vector_index import MmapVectorStore
+
+DOCS = [
+    "営業経費ルール：交通費は翌月5日までに精算申請を行うこと。上限は1日5000円。",
+    "セキュリティポリシー：パスワードは12文字以上とし、90日ごとに変更する。",
+    "2025-11-15 deploy failed with error code E1234: disk quota exceeded on api-server-02.",
+]
+
+
+def test_vectors_are_deterministic_and_normalized(tmp_path):
+    a = LocalEmbeddingService(dim=256, stats_path=None)
+    b = LocalEmbeddingService(dim=256, stats_path=None)
+    va, vb = a.embed_documents(DOCS), b.embed_documents(DOCS)
+    assert np.allclose(va, vb)
+    assert len(va[0]) == 256
+    assert np.allclose(np.linalg.norm(va, axis=1), 1.0)
+    assert np.linalg.norm(a.embed_text("")) == 0
+
+
+def test_queries_rank_the_matching_document_first():
+    service = LocalEmbeddingService(stats_path=None)
+    docs = np.array(service.embed_documents(DOCS))
+    for query, expected in [("交通費の精算期限", 0), ("パスワードの変更ルール", 1), ("E1234 disk quota", 2)]:
+        assert int(np.argmax(docs @ np.array(service.embed_text(query)))) == expected
+
+
+def test_idf_statistics_persist_in_batches(tmp_path):
+    path = str(tmp_path / "df.npz")
+    service = LocalEmbeddingService(stats_path=path, flush_docs=3)
+    # Embedding alone (e.g. an attempt that is retried) counts nothing
+    service.embed_documents(DOCS)
+    assert service.observed_docs == 0
+    service.observe(DOCS[:2])
+    assert not (tmp_path / "df.npz").exists()
+    service.observe(DOCS[2:])
+    reloaded = LocalEmbeddingService(stats_path=path)
+    assert reloaded.observed_docs == 3
+    assert np.allclose(reloaded.embed_text("交通費"), service.embed_text("交通費"), atol=1e-6)
+
+    # Counts below the batch size are written by save_stats (at shutdown)
+    service.observe(DOCS[:1])
+    service.save_stats()
+    assert LocalEmbeddingService(stats_path=path).observed_docs == 4
+
+
+def test_workers_add_up_their_counts(tmp_path):
+    path = str(tmp_path / "df.npz")
+    a, b = (LocalEmbeddingService(stats_path=path) for _ in range(2))
+    a.observe(DOCS[:2])
+    b.observe(DOCS[2:])
+    a.save_stats()
+    b.save_stats()
+    # b's save merged a's counts instead of overwriting them, and b adopted the totals
+    assert b.observed_docs == LocalEmbeddingService(stats_path=path).observed_docs == 3
+    single = LocalEmbeddingService(stats_path=None)
+    single.observe(DOCS)
+    assert np.allclose(b.embed_text("交通費"), single.embed_text("交通費"), atol=1e-6)
+
+
+def test_only_committed_chunks_are_counted(tmp_path):
+    retriever = rag_kernel.HybridRetriever(
+        embedding_service=LocalEmbeddingService(dim=64, stats_path=None),
+        vector_store=MmapVectorStore(root=str(tmp_path / "vectors")),
+        db_path=str(tmp_path / "rag.db"),
+    )
+    retriever.ingest_document("tenant-a", DOCS[0], {"filename": "rules.txt"})
+    retriever.ingest_document("tenant-a", DOCS[0], {"filename": "rules.txt"})  # unchanged: nothing committed
+    assert retriever.embedding_service.observed_docs == 1
+
+    # Reconcile re-embeds the lost vectors without counting the chunks again
+    retriever.vector_store.delete_documents("tenant-a", retriever.vector_store.list_ids("tenant-a"))
+    assert retriever.reconcile("tenant-a")["consistent"] is False
+    assert retriever.vector_store.count("tenant-a") == 1
+    assert retriever.embedding_service.observed_docs == 1
+
+    # ... unless the embedder has no statistics at all (RAG_EMBEDDING_BACKEND switched)
+    retriever.embedding_service = LocalEmbeddingService(dim=64, stats_path=None)
+    retriever.vector_store.delete_documents("tenant-a", retriever.vector_store.list_ids("tenant-a"))
+    retriever.reconcile("tenant-a")
+    assert retriever.embedding_service.observed_docs == 1
+
+
+def test_auto_backend_without_key_is_local():
+    assert isinstance(rag_kernel.create_embedding_service(None, "auto"), LocalEmbeddingService)
+
+
+def test_search_falls_back_to_keywords_when_embedding_fails(make_retriever):
+    retriever = make_retriever()
+    retriever.ingest_document("tenant-a", DOCS[0], {"filename": "rules.txt"})
+
+    class _Down:
+        def embed_text(self, text):
+            raise TimeoutError("embedder timed out")
+
+    retriever.embedding_service = _Down()
+    timings = {}
+    assert retriever.search("tenant-a", "交通費", n_results=3, timings=timings) == [DOCS[0]]
+    assert "vector_ms" not in timings
+
+
+def _store_built_with_another_backend(tmp_path):
+    """A retriever whose vectors were written with 16 dims, now embedding queries with 64."""
+    retriever = rag_kernel.HybridRetriever(
+        embedding_service=LocalEmbeddingService(dim=16, stats_path=None),
+        vector_store=MmapVectorStore(root=str(tmp_path / "vectors")),
+        db_path=str(tmp_path / "rag.db"),
+    )
+    retriever.ingest_document("tenant-a", DOCS[0], {"filename": "rules.txt"})
+    retriever.embedding_service = LocalEmbeddingService(dim=64, stats_path=None)
+    return retriever
+
+
+def test_search_falls_back_to_keywords_on_dimension_mismatch(tmp_path):
+    retriever = _store_built_with_another_backend(tmp_path)
+    timings = {}
+    assert retriever.search("tenant-a", "交通費", n_results=3, timings=timings) == [DOCS[0]]
+    assert "vector_ms" not in timings
+
+
+def test_startup_check_reports_dimension_mismatch(tmp_path):
+    retriever = _store_built_with_another_backend(tmp_path)
+    assert retriever.check_embedding_dimensions() == {"tenant-a": 16}
+    retriever.embedding_service = LocalEmbeddingService(dim=16, stats_path=None)
+    assert retriever.check_embedding_dimensions() == {}
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import logging_db
+
+
+def test_relative_sqlite_url_is_ignored_in_docker(monkeypatch):
+    monkeypatch.setattr(logging_db.os.path, "exists", lambda p: p == "/app/data")
+    assert logging_db._resolve_database_url("sqlite:///./governance_logs.db") == logging_db.sqlite_url
+    assert logging_db._resolve_database_url("sqlite:////app/data/other.db") == "sqlite:////app/data/other.db"
+    assert logging_db._resolve_database_url("sqlite:///:memory:") == "sqlite:///:memory:"
+    postgres = "postgresql://prism:prism@db:5432/prism"
+    assert logging_db._resolve_database_url(postgres) == postgres
+    assert logging_db._resolve_database_url("") == logging_db.sqlite_url
+
+
+def test_relative_sqlite_url_is_kept_outside_docker(monkeypatch):
+    monkeypatch.setattr(logging_db.os.path, "exists", lambda p: False)
+    assert logging_db._resolve_database_url("sqlite:///./governance_logs.db") == "sqlite:///./governance_logs.db"
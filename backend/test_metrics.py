@@ -0,0 +1,52 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from metrics import Gauge, Histogram, StageTimer
+
+
+def test_histogram_renders_cumulative_buckets():
+    hist = Histogram("test_seconds", "Test histogram.", ("stage",), buckets=(0.01, 0.1))
+    hist.observe_many([(("embed",), 0.005), (("embed",), 0.05), (("embed",), 3.0)])
+    lines = hist.render()
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{stage="embed",le="0.01"} 1' in lines
+    assert 'test_seconds_bucket{stage="embed",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{stage="embed",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="embed"} 3' in lines
+    assert 'test_seconds_sum{stage="embed"} 3.055000' in lines
+
+
+def test_stage_timer_records_spans_and_server_timing():
+    timer = StageTimer(enabled=True)
+    with timer.span("extract"):
+        time.sleep(0.01)
+    with timer.span("extract"):
+        pass
+    timer.add("embed", 1.5)
+    timer.add("mmr", None)
+    snapshot = timer.snapshot()
+    assert snapshot["extract"] >= 10
+    assert snapshot["embed"] == 1.5
+    assert "mmr" not in snapshot
+    assert snapshot["total"] >= snapshot["extract"]
+    assert timer.server_timing().startswith("extract;dur=")
+
+
+def test_disabled_timer_is_a_no_op():
+    timer = StageTimer(enabled=False)
+    with timer.span("pii"):
+        pass
+    timer.add("embed", 2.0)
+    assert timer.snapshot() is None
+    assert timer.server_timing() is None
+    timer.finish("FAST")
+
+
+def test_gauge_replace_drops_missing_series():
+    gauge = Gauge("test_jobs", "Test gauge.", ("status",))
+    gauge.replace({("running",): 2, ("queued",): 1})
+    gauge.replace({("queued",): 3})
+    assert gauge.render() == ["# HELP test_jobs Test gauge.", "# TYPE test_jobs gauge", 'test_jobs{status="queued"} 3']
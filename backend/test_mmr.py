@@ -0,0 +1,74 @@
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import rag_kernel
+from mmr import mmr_select
+
+
+def test_mmr_skips_near_identical_candidates():
+    query = [1.0, 0.0, 0.0]
+    candidates = [
+        [0.95, 0.05, 0.0],   # most relevant
+        [0.94, 0.06, 0.0],   # near copy of the first
+        [0.93, 0.07, 0.0],   # another near copy
+        [0.7, 0.0, 0.7],     # less relevant, but different
+    ]
+    assert mmr_select(query, candidates, 2, lambda_mult=1.0) == [0, 1]
+    assert mmr_select(query, candidates, 2, lambda_mult=0.5) == [0, 3]
+    assert len(mmr_select(query, candidates, 10)) == 4
+    assert mmr_select(query, [], 3) == []
+
+
+def test_mmr_is_fast_for_a_typical_pool():
+    rng = np.random.default_rng(0)
+    candidates = rng.normal(size=(50, 768)).astype(np.float32)
+    query = rng.normal(size=768).astype(np.float32)
+    started = time.perf_counter()
+    for _ in range(20):
+        mmr_select(query, candidates, 5)
+    assert (time.perf_counter() - started) / 20 < 0.01
+
+
+class _Embedder:
+    """Maps a passage to a vector by topic so duplicates share a direction."""
+
+    def embed_text(self, text):
+        return [1.0, 0.0] if "経費" in text else [0.0, 1.0]
+
+
+def test_search_diversifies_and_reports_timings(make_retriever, monkeypatch):
+    retriever = make_retriever()
+    retriever.embedding_service = _Embedder()
+    docs = {
+        "a": ("経費精算のルール 版1", [1.0, 0.0]),
+        "b": ("経費精算のルール 版2", [0.99, 0.01]),
+        "c": ("経費精算のルール 版3", [0.98, 0.02]),
+        "d": ("出張の申請手順", [0.6, 0.8]),
+    }
+    store = retriever.vector_store
+
+    def search_similarity(tenant_id, query_embedding, n_results=5, include_embeddings=False):
+        q = np.asarray(query_embedding)
+        ranked = sorted(docs, key=lambda k: -float(np.dot(q, docs[k][1])))[:n_results]
+        result = {"ids": [ranked], "documents": [[docs[k][0] for k in ranked]]}
+        if include_embeddings:
+            result["embeddings"] = [[docs[k][1] for k in ranked]]
+        return result
+
+    store.search_similarity = search_similarity
+    store.get_embeddings = lambda tenant_id, ids: {i: docs[i][1] for i in ids if i in docs}
+    monkeypatch.setattr(rag_kernel, "RAG_MMR_ENABLED", True)
+    monkeypatch.setattr(rag_kernel, "RAG_MMR_LAMBDA", 0.3)
+
+    timings = {}
+    results = retriever.search("tenant-a", "経費", n_results=2, timings=timings)
+    assert results == ["経費精算のルール 版1", "出張の申請手順"]
+    assert {"embed_ms", "vector_ms", "keyword_ms", "mmr_ms", "total_ms"} <= set(timings)
+
+    monkeypatch.setattr(rag_kernel, "RAG_MMR_ENABLED", False)
+    assert retriever.search("tenant-a", "経費", n_results=2) == ["経費精算のルール 版1", "経費精算のルール 版2"]
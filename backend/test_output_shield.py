@@ -0,0 +1,61 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from output_shield import OutputShield, compile_pii_shield
+from policy_store import load_policies
+
+POLICIES = load_policies(Path(__file__).parent / "policies.yaml")
+
+
+def _stream(shield, chunks):
+    out = [shield.feed(c) for c in chunks]
+    out.append(shield.flush())
+    return out
+
+
+def test_entities_split_across_chunks_are_masked():
+    text = "担当の山田さんに連絡してください。電話は090-1234-5678、メールは taro.yamada@example.co.jp です。住所は東京都港区芝公園4-2-8です。"
+    # One character per chunk: every entity is split over chunk boundaries
+    out = _stream(OutputShield(compile_pii_shield(POLICIES)), list(text))
+    masked = "".join(out)
+    assert "山*さん" in masked
+    assert "[REDACTED_DIRECT_ID]" in masked and "090-1234-5678" not in masked and "example" not in masked
+    assert "東" in masked and "港区" not in masked
+    # Released incrementally, not at the end
+    assert sum(len(o) for o in out[:len(text) // 2]) > 0
+
+
+def test_street_and_block_number_are_masked_with_the_address():
+    shield = OutputShield(compile_pii_shield(POLICIES))
+    for address in ["東京都港区六本木1-2-3", "大阪府大阪市北区梅田1丁目2番3号", "神奈川県横浜市中区山下町"]:
+        masked = "".join(_stream(shield, [f"住所は{address}です。"]))
+        assert masked == f"住所は{address[0]}{'*' * (len(address) - 1)}です。"
+
+
+def test_streaming_does_not_hold_back_the_whole_reply():
+    shield = OutputShield(compile_pii_shield(POLICIES), carry_chars=16)
+    released = shield.feed("経費精算の締め日は原則として毎月25日です")
+    assert released and len(shield.buffer) <= 16
+    assert shield.feed("。次の").endswith("。")
+    assert shield.flush() == "次の"
+
+
+def test_category_replace_terms_and_echo_back():
+    policies = {"safety": {"pii_shield": {"code_names": {
+        "mask_strategy": "category_replace",
+        "categories": {"project": "[PROJECT_NAME]"},
+        "terms": {"project": ["Project Falcon"]},
+    }}}}
+    shield = OutputShield(compile_pii_shield(policies))
+    assert "".join(_stream(shield, ["About project fal", "con: launch in May"])) == "About [PROJECT_NAME]: launch in May"
+    assert shield.stats() == {"project": 1}
+
+    policies["safety"]["pii_shield"]["echo_pii_back"] = True
+    assert compile_pii_shield(policies) == []
+
+
+def test_numbers_that_are_not_pii_pass_through():
+    text = "2025年の予算は12345678円、カード番号 4111 1111 1111 1112 は無効です。"
+    assert "".join(_stream(OutputShield(compile_pii_shield(POLICIES)), [text[:20], text[20:]])) == text
@@ -0,0 +1,75 @@
+import asyncio
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from pii_sidecar import PiiSidecarClient, PiiSidecarServer, decode_response, encode_response
+
+
+def _fake_analyzer(batches):
+    def analyze(texts):
+        batches.append(list(texts))
+        time.sleep(0.02)
+        return [
+            {"pii_detected": "@" in t, "detected_types": ["EMAIL_ADDRESS", "CUSTOM_ID"] if "@" in t else []}
+            for t in texts
+        ]
+    return analyze
+
+
+def _start_server(server):
+    ready = threading.Event()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=lambda: loop.run_until_complete(server.serve(ready)), daemon=True)
+    thread.start()
+    assert ready.wait(5)
+    return loop
+
+
+def test_response_roundtrip_keeps_unknown_types():
+    results = [{"pii_detected": True, "detected_types": ["PERSON", "phone", "CUSTOM_ID"]},
+               {"pii_detected": False, "detected_types": []}]
+    assert decode_response(encode_response(results)[4:]) == results
+
+
+def test_concurrent_requests_are_batched_over_reused_connections():
+    batches = []
+    socket_path = str(Path(tempfile.mkdtemp()) / "pii.sock")
+    _start_server(PiiSidecarServer(socket_path, _fake_analyzer(batches), batch_window_ms=20))
+    client = PiiSidecarClient(socket_path, pool_size=4)
+
+    texts = [f"mail{i}@example.com" if i % 2 else f"text {i}" for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda t: client.analyze([t])[0], texts))
+
+    assert [r["pii_detected"] for r in results] == [i % 2 == 1 for i in range(8)]
+    assert results[1]["detected_types"] == ["EMAIL_ADDRESS", "CUSTOM_ID"]
+    # Requests from different connections shared analyzer passes
+    assert len(batches) < len(texts)
+    # Connections went back to the pool (at most pool_size kept)
+    assert 0 < client._pool.qsize() <= 4
+    before = client._pool.qsize()
+    assert client.analyze(["again"]) == [{"pii_detected": False, "detected_types": []}]
+    assert client._pool.qsize() == before
+
+
+def test_unreachable_sidecar_is_marked_down():
+    client = PiiSidecarClient(str(Path(tempfile.mkdtemp()) / "missing.sock"), retry_seconds=60)
+    with pytest.raises(OSError):
+        client.analyze(["090-1234-5678"])
+    with pytest.raises(ConnectionError, match="marked down"):
+        client.analyze(["090-1234-5678"])
+
+
+def test_detect_pii_falls_back_to_regex_without_loading_presidio(monkeypatch):
+    import governance_kernel
+    monkeypatch.setattr(governance_kernel, "PII_CLIENT", PiiSidecarClient(str(Path(tempfile.mkdtemp()) / "missing.sock")))
+    monkeypatch.setattr(governance_kernel, "_get_analyzer_engine", lambda: pytest.fail("spaCy loaded in the API worker"))
+    assert governance_kernel.detect_pii("連絡先は taro@example.com です") == {"pii_detected": True, "detected_types": ["email"]}
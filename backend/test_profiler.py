@@ -0,0 +1,42 @@
+import hashlib
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from profiler import Profiler
+
+
+def _busy_work(seconds: float):
+    deadline = time.perf_counter() + seconds
+    x = b"x"
+    while time.perf_counter() < deadline:
+        x = hashlib.sha256(x).digest()
+
+
+def test_samples_are_aggregated_under_the_final_mode():
+    profiler = Profiler(enabled=True, interval_ms=2)
+    session = profiler.start("/tenants/{tenant_id}/chat", "header")
+    session.mode = "HEAVY"
+    _busy_work(0.2)
+    profiler.stop(session)
+
+    [profile] = profiler.summary()["profiles"]
+    assert (profile["route"], profile["mode"], profile["requests"]) == ("/tenants/{tenant_id}/chat", "HEAVY", 1)
+    assert profile["stack_samples"] > 0
+    collapsed = profiler.collapsed(mode="HEAVY")
+    assert "_busy_work" in collapsed
+    stack, count = collapsed.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0 and ";" in stack
+    assert profiler.collapsed(mode="FAST") == ""
+
+
+def test_concurrent_profiles_are_bounded():
+    profiler = Profiler(enabled=True, max_active=1)
+    first = profiler.start("/a", "sampled")
+    assert profiler.start("/b", "sampled") is None
+    assert profiler.summary()["skipped_busy"] == 1
+    profiler.stop(first)
+    profiler.reset()
+    assert profiler.summary()["profiles"] == []
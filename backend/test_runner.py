@@ -1,14 +1,18 @@
-"""Simple smoke runner to exercise the /chat endpoint using TestClient."""
+"""Simple smoke runner to exercise the /tenants/{tenant_id}/chat endpoint using TestClient."""
+import json
+
 from fastapi.testclient import TestClient
 from main import app
 
 
 def run_smoke():
-    client = TestClient(app)
-    payload = {"user_id": "tester", "message": "これはテストです。株価について教えてください。"}
-    resp = client.post("/chat", json=payload)
-    print("status_code:", resp.status_code)
-    print(resp.json())
+    # The context manager runs the startup event (policies, DB seed, RAG)
+    with TestClient(app) as client:
+        client.post("/auth/mock-login", json={"user_id": "user-1", "tenant_id": "tenant-a"})
+        resp = client.post("/tenants/tenant-a/chat", data={"message": "これはテストです。株価について教えてください。"})
+        print("status_code:", resp.status_code)
+        for line in resp.text.splitlines():
+            print(json.loads(line))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import sessions
+from sessions import SessionNotFoundError, SessionStore, add_attachment, history_text, record_turn, select_attachments
+
+
+def test_history_rolls_into_bounded_summary(monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_HISTORY_TOKENS", 100)
+    monkeypatch.setattr(sessions, "SESSION_SUMMARY_TOKENS", 150)
+    store = SessionStore(None, memory_bytes=1 << 20, disk_bytes=0)
+    session = store.create("tenant-a", "user-1")
+    for i in range(20):
+        record_turn(session, f"質問{i} " + "あ" * 30, f"回答{i} " + "い" * 30, {"pii_detected": i == 3, "detected_types": ["email"] if i == 3 else []}, [f"doc{i}"])
+
+    assert session["turn_count"] == 20
+    assert session["turns"][-1]["user"].startswith("質問19")
+    assert sum(sessions.estimate_tokens(t["user"] + t["assistant"]) for t in session["turns"]) <= 100
+    assert sessions.estimate_tokens("\n".join(session["summary"])) <= 150
+    # Oldest summary lines are dropped first
+    assert "質問0 " not in history_text(session) and "質問17" in history_text(session)
+    assert session["pii"] == {"pii_detected": True, "detected_types": ["email"]}
+    assert session["context_docs"] == ["doc19"]
+
+
+def test_store_evicts_to_disk_reloads_and_checks_owner(tmp_path):
+    store = SessionStore(tmp_path, memory_bytes=3000, disk_bytes=1 << 20)
+    first = store.create("tenant-a", "user-1")
+    att_id = add_attachment(first, "a.txt", "ab" * 32, "本文" * 500, {"pii_detected": False, "detected_types": []})
+    store.save(first)
+    second = store.create("tenant-a", "user-1")
+    # The first session no longer fits in memory next to the second one, but is still on disk
+    assert first["session_id"] not in store._memory
+    loaded = store.get(first["session_id"], "tenant-a", "user-1")
+    assert [i for i, _ in select_attachments(loaded)] == [att_id]
+    with pytest.raises(KeyError):
+        select_attachments(loaded, ["unknown"])
+
+    with pytest.raises(SessionNotFoundError):
+        store.get(first["session_id"], "tenant-a", "user-2")
+    with pytest.raises(SessionNotFoundError):
+        store.get("../etc", "tenant-a", "user-1")
+
+    # Another worker sharing the directory sees the update
+    other = SessionStore(tmp_path, memory_bytes=1 << 20, disk_bytes=1 << 20)
+    other.get(second["session_id"], "tenant-a", "user-1")
+    record_turn(second, "q", "a", {"pii_detected": False, "detected_types": []}, [])
+    store.save(second)
+    assert other.get(second["session_id"], "tenant-a", "user-1")["turn_count"] == 1
+
+    store.delete(second["session_id"], "tenant-a", "user-1")
+    with pytest.raises(SessionNotFoundError):
+        other.get(second["session_id"], "tenant-a", "user-1")
+
+
+def test_disk_budget_evicts_least_recently_used(tmp_path):
+    store = SessionStore(tmp_path, memory_bytes=0, disk_bytes=800)
+    ids = [store.create("tenant-a", "user-1")["session_id"] for _ in range(5)]
+    assert store.stats()["disk_bytes"] <= 800
+    with pytest.raises(SessionNotFoundError):
+        store.get(ids[0], "tenant-a", "user-1")
+    store.get(ids[-1], "tenant-a", "user-1")
+
+
+def test_disk_budget_covers_every_worker(tmp_path):
+    workers = [SessionStore(tmp_path, memory_bytes=0, disk_bytes=800, rescan_seconds=0) for _ in range(2)]
+    for i in range(6):
+        workers[i % 2].create("tenant-a", "user-1")
+    assert sum(p.stat().st_size for p in tmp_path.glob("*.json")) <= 800
+
+
+def test_concurrent_saves_of_one_session_use_separate_temp_files(tmp_path):
+    workers = [SessionStore(tmp_path, memory_bytes=0, disk_bytes=1 << 20) for _ in range(4)]
+    session = workers[0].create("tenant-a", "user-1")
+
+    def save_many(store, n):
+        for i in range(20):
+            store.save({**session, "turn_count": n * 100 + i})
+
+    threads = [threading.Thread(target=save_many, args=(store, n)) for n, store in enumerate(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert list(tmp_path.glob("*.tmp")) == []
+    assert workers[0].get(session["session_id"], "tenant-a", "user-1")["turn_count"] % 100 == 19
@@ -0,0 +1,80 @@
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from metrics import SINGLEFLIGHT_CALLS
+from singleflight import SingleFlight, content_key
+
+
+def test_concurrent_threads_share_one_call():
+    flight = SingleFlight("test-threads")
+    calls = []
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return [1.0, 2.0]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(flight.do, content_key("same question"), work) for _ in range(4)]
+        while SINGLEFLIGHT_CALLS.value(("test-threads", "coalesced")) < 3:
+            time.sleep(0.01)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert calls == [1]
+    assert all(r == [1.0, 2.0] for r in results)
+    assert SINGLEFLIGHT_CALLS.value(("test-threads", "leader")) == 1
+    # Finished calls are not cached
+    assert flight.do(content_key("same question"), lambda: "again") == "again"
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight("test-errors")
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.05)
+        raise ValueError("embedder down")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "k", fail)
+        started.wait(5)
+        follower = pool.submit(flight.do, "k", lambda: "not run")
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+
+
+def test_async_waiter_takes_over_when_leader_is_cancelled():
+    async def run():
+        flight = SingleFlight("test-async")
+        runs = []
+
+        async def work(name):
+            runs.append(name)
+            await asyncio.sleep(0.05)
+            return name
+
+        leader = asyncio.create_task(flight.do_async("file", lambda: work("leader")))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do_async("file", lambda: work("follower")))
+        other = asyncio.create_task(flight.do_async("file", lambda: work("other")))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(follower, other)
+        return runs, results, leader.cancelled()
+
+    runs, results, cancelled = asyncio.run(run())
+    assert cancelled
+    assert runs == ["leader", "follower"]
+    assert results == ["follower", "follower"]
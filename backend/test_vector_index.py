@@ -0,0 +1,221 @@
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import vector_index
+from vector_index import MmapVectorStore
+
+
+def _vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def _exact_top(vectors, query, k):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return list(np.argsort(-(unit @ (query / np.linalg.norm(query))))[:k])
+
+
+def _add(store, tenant, vectors, start=0):
+    ids = [f"c{i}" for i in range(start, start + len(vectors))]
+    store.add_documents(tenant, [f"doc {i}" for i in range(start, start + len(vectors))],
+                        [{"n": i} for i in range(start, start + len(vectors))], ids, vectors.tolist())
+    return ids
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_exact_top_k_and_persistence(tmp_path, dtype):
+    vectors = _vectors(500)
+    store = MmapVectorStore(str(tmp_path), dtype=dtype)
+    _add(store, "t", vectors)
+    query = _vectors(1, seed=1)[0]
+
+    result = store.search_similarity("t", query.tolist(), 10, include_embeddings=True)
+    expected = [f"c{i}" for i in _exact_top(vectors, query, 10)]
+    if dtype == "float32":
+        assert result["ids"][0] == expected
+    else:
+        assert len(set(result["ids"][0]) & set(expected)) >= 9
+    assert result["documents"][0][0] == "doc " + result["ids"][0][0][1:]
+    assert result["metadatas"][0][0] == {"n": int(result["ids"][0][0][1:])}
+    assert len(result["embeddings"][0][0]) == 32
+
+    reopened = MmapVectorStore(str(tmp_path), dtype=dtype)
+    assert reopened.count("t") == 500
+    assert reopened.search_similarity("t", query.tolist(), 10)["ids"] == result["ids"]
+    assert reopened.search_similarity("other", query.tolist(), 10)["ids"] == [[]]
+
+
+def test_upsert_delete_and_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_COMPACT_MIN_DEAD", 10)
+    store = MmapVectorStore(str(tmp_path))
+    vectors = _vectors(40)
+    ids = _add(store, "t", vectors)
+
+    # Re-adding an id replaces its row; deleted ids are never returned
+    store.add_documents("t", ["new c0"], [{}], ["c0"], [(-vectors[0]).tolist()])
+    assert store.get_documents("t", ["c0"]) == {"c0": {"document": "new c0", "metadata": {}}}
+    store.delete_documents("t", ids[1:5])
+    assert store.count("t") == 36
+    hits = store.search_similarity("t", vectors[1].tolist(), 40)["ids"][0]
+    assert not set(hits) & set(ids[1:5]) and len(hits) == 36
+
+    generation = store.stats("t")["generation"]
+    store.delete_documents("t", ids[5:20])  # 20 of 41 rows dead -> compaction
+    stats = store.stats("t")
+    assert stats["generation"] != generation and stats["rows"] == stats["live_rows"] == 21
+    assert sorted(MmapVectorStore(str(tmp_path)).list_ids("t")) == sorted([ids[0]] + ids[20:])
+    assert store.get_documents("t", ["c0"])["c0"]["document"] == "new c0"
+
+
+def test_torn_write_is_discarded_on_load(tmp_path):
+    store = MmapVectorStore(str(tmp_path))
+    _add(store, "t", _vectors(5))
+    gen_dir = store._index("t").gen_dir
+    # Simulate a crash after the vector append but before / during the sidecar write
+    with open(gen_dir / "vectors.bin", "ab") as f:
+        f.write(np.zeros(32, dtype=np.float32).tobytes())
+    with open(gen_dir / "rows.jsonl", "ab") as f:
+        f.write(b'{"id": "c5", "docu')
+
+    reopened = MmapVectorStore(str(tmp_path))
+    assert reopened.count("t") == 5
+    _add(reopened, "t", _vectors(1, seed=3), start=5)
+    assert reopened.count("t") == 6
+    assert MmapVectorStore(str(tmp_path)).get_documents("t", ["c5"])["c5"]["document"] == "doc 5"
+
+
+def test_two_stage_search_matches_exact_and_rebuilds_prefix(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_RERANK_MIN", 50)
+    # Leading dimensions carry most of the signal, as in Matryoshka embeddings
+    vectors = _vectors(2000, dim=64) * np.geomspace(4.0, 0.25, 64)[None, :].astype(np.float32)
+    exact = MmapVectorStore(str(tmp_path / "exact"))
+    two_stage = MmapVectorStore(str(tmp_path / "two_stage"), coarse_dim=16)
+    _add(exact, "t", vectors)
+    _add(two_stage, "t", vectors)
+    assert two_stage.stats("t")["coarse_dim"] == 16
+
+    queries = _vectors(20, dim=64, seed=7) * np.geomspace(4.0, 0.25, 64)[None, :].astype(np.float32)
+    hits = 0
+    for q in queries:
+        expected = exact.search_similarity("t", q.tolist(), 10)["ids"][0]
+        hits += len(set(expected) & set(two_stage.search_similarity("t", q.tolist(), 10)["ids"][0]))
+    assert hits / (len(queries) * 10) >= 0.9
+
+    # Turning the prefix on for an existing index builds it from the stored vectors
+    rebuilt = MmapVectorStore(str(tmp_path / "exact"), coarse_dim=16)
+    assert rebuilt.stats("t")["coarse_dim"] == 16
+    assert (tmp_path / "exact" / "t" / rebuilt.stats("t")["generation"] / "coarse.bin").stat().st_size == 2000 * 16 * 4
+    assert rebuilt.search_similarity("t", queries[0].tolist(), 10)["ids"] == two_stage.search_similarity("t", queries[0].tolist(), 10)["ids"]
+    assert MmapVectorStore(str(tmp_path / "exact")).stats("t")["coarse_dim"] == 0
+
+
+@pytest.mark.parametrize("coarse_dim", [0, 8])
+def test_search_is_consistent_while_deletes_compact(tmp_path, monkeypatch, coarse_dim):
+    monkeypatch.setattr(vector_index, "VECTOR_COMPACT_MIN_DEAD", 5)
+    monkeypatch.setattr(vector_index, "VECTOR_RERANK_MIN", 20)
+    store = MmapVectorStore(str(tmp_path), coarse_dim=coarse_dim)
+    vectors = _vectors(600)
+    _add(store, "t", vectors)
+    errors, stop = [], threading.Event()
+
+    def searcher(seed):
+        query = _vectors(1, seed=seed)[0].tolist()
+        while not stop.is_set():
+            try:
+                result = store.search_similarity("t", query, 10)
+                for chunk_id, doc, meta in zip(result["ids"][0], result["documents"][0], result["metadatas"][0]):
+                    # id, document and metadata must come from the same row
+                    assert doc == "doc " + chunk_id[1:] and meta == {"n": int(chunk_id[1:])}
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=searcher, args=(seed,)) for seed in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        # Every delete triggers a compaction that renumbers the rows
+        for start in range(0, 500, 10):
+            store.delete_documents("t", [f"c{i}" for i in range(start, start + 10)])
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    assert errors == []
+    assert store.count("t") == 100
+
+
+def test_workers_see_each_others_writes_and_compactions(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_COMPACT_MIN_DEAD", 10)
+    # Two stores on one directory stand in for two uvicorn workers
+    a, b = MmapVectorStore(str(tmp_path)), MmapVectorStore(str(tmp_path))
+    vectors = _vectors(40)
+    assert b.count("t") == 0
+    ids = _add(a, "t", vectors[:20])
+    assert b.count("t") == 20
+    assert b.search_similarity("t", vectors[3].tolist(), 1)["ids"] == [["c3"]]
+
+    # b appends after a: rows keep their numbering in both
+    _add(b, "t", vectors[20:], start=20)
+    ids += [f"c{i}" for i in range(20, 40)]
+    assert a.search_similarity("t", vectors[30].tolist(), 1)["ids"] == [["c30"]]
+    assert a.get_embeddings("t", ["c30"]) == b.get_embeddings("t", ["c30"])
+
+    # a's deletes compact into a new generation; b reloads it before reading or writing
+    generation = b.stats("t")["generation"]
+    a.delete_documents("t", ids[:20])
+    assert a.stats("t")["generation"] != generation
+    assert b.stats("t")["generation"] == a.stats("t")["generation"]
+    assert sorted(b.list_ids("t")) == sorted(ids[20:])
+    assert b.search_similarity("t", vectors[3].tolist(), 20)["ids"][0] and "c3" not in b.list_ids("t")
+    b.add_documents("t", ["again"], [{}], ["c3"], [vectors[3].tolist()])
+    assert a.get_documents("t", ["c3"]) == {"c3": {"document": "again", "metadata": {}}}
+    assert a.count("t") == b.count("t") == 21
+
+
+def _append_from_process(root, worker, batches):
+    store = MmapVectorStore(root)
+    for n in range(batches):
+        chunk_ids = [f"w{worker}-{n}-{i}" for i in range(5)]
+        rows = _vectors(5, seed=worker * 1000 + n)
+        store.add_documents("t", [f"doc {i}" for i in chunk_ids], [{"worker": worker} for _ in chunk_ids],
+                            chunk_ids, rows.tolist())
+
+
+@pytest.mark.skipif(vector_index.fcntl is None, reason="no cross-process file lock on this platform")
+def test_concurrent_appends_from_processes_keep_rows_aligned(tmp_path):
+    import multiprocessing
+
+    processes = [multiprocessing.get_context("fork").Process(target=_append_from_process, args=(str(tmp_path), w, 30))
+                 for w in range(3)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert [p.exitcode for p in processes] == [0, 0, 0]
+
+    store = MmapVectorStore(str(tmp_path))
+    assert store.count("t") == 3 * 30 * 5
+    # Every row's vector belongs to its own sidecar line
+    for worker, n in [(0, 0), (1, 17), (2, 29)]:
+        chunk_ids = [f"w{worker}-{n}-{i}" for i in range(5)]
+        stored = np.array([store.get_embeddings("t", chunk_ids)[i] for i in chunk_ids])
+        expected = _vectors(5, seed=worker * 1000 + n)
+        assert np.allclose(stored, expected / np.linalg.norm(expected, axis=1, keepdims=True), atol=1e-6)
+
+
+def test_incomplete_backend_fails_at_construction():
+    class NoSearch(vector_index.VectorStore):
+        def add_documents(self, tenant_id, documents, metadatas, ids, embeddings): pass
+        def delete_documents(self, tenant_id, ids): pass
+        def count(self, tenant_id): return 0
+        def list_ids(self, tenant_id): return []
+        def get_documents(self, tenant_id, ids): return {}
+        def get_embeddings(self, tenant_id, ids): return {}
+
+    with pytest.raises(TypeError, match="search_similarity"):
+        NoSearch()
@@ -0,0 +1,618 @@
+"""
+Vector store interface and a built-in embedded backend.
+
+VectorStore is what HybridRetriever talks to. Two implementations:
+- rag_kernel.ChromaVectorStore: chromadb.PersistentClient (HNSW, the original backend)
+- MmapVectorStore (this module): exact search over a memory-mapped NumPy matrix,
+  no extra dependency, meant for tenants with up to a few hundred thousand chunks.
+
+Selected with RAG_VECTOR_BACKEND=chroma|mmap (see rag_kernel.create_vector_store).
+
+On-disk layout of MmapVectorStore, one directory per tenant:
+
+    <root>/<tenant>/CURRENT          name of the live generation directory
+    <root>/<tenant>/gen-000001/
+        meta.json                    {"dim", "dtype"}
+        vectors.bin                  row-major float32 or int8 matrix (unit-normalized rows)
+        scales.bin                   float32 per-row scale (int8 only)
+        coarse.bin                   float32 first RAG_VECTOR_COARSE_DIM dims, re-normalized (optional)
+        rows.jsonl                   sidecar: {"id", "document", "metadata"} per row, {"delete": id} tombstones
+
+Writes are append-only: a re-added id gets a new row and the old row becomes dead,
+deletes append a tombstone. The vectors are flushed before the sidecar line, so the
+sidecar is the commit point and a torn write is trimmed on the next load.
+When dead rows exceed RAG_VECTOR_COMPACT_RATIO the live rows are copied into a new
+generation directory and CURRENT is switched atomically.
+
+Several uvicorn workers can share one index directory. Writes (appends, tombstones,
+compaction) hold an exclusive flock on <root>/<tenant>/LOCK, reads a shared one, and
+every operation first catches up with what the other workers wrote: a CURRENT that
+names another generation reloads the index, a longer sidecar replays the new lines.
+All workers must run with the same RAG_VECTOR_COARSE_DIM (restart them together to
+change it). Without fcntl (Windows) there is no cross-process lock: run one worker.
+
+Two-stage search (RAG_VECTOR_COARSE_DIM > 0): Matryoshka-style embeddings such as
+text-embedding-004 keep most of their ranking quality in the leading dimensions, so
+the first pass scans only the coarse prefix matrix and the second pass re-ranks the
+best RAG_VECTOR_RERANK_FACTOR * k candidates with the full vectors. The full matrix
+stays memory-mapped and only the re-ranked rows are paged in.
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+if os.path.exists("/app/data"):
+    # Docker環境 (永続ボリューム)
+    _DEFAULT_INDEX_DIR = "/app/data/vector_index"
+else:
+    # ローカル開発環境
+    _DEFAULT_INDEX_DIR = "./vector_index"
+
+VECTOR_INDEX_DIR = os.getenv("RAG_VECTOR_INDEX_DIR", _DEFAULT_INDEX_DIR)
+# float32 = exact scores; int8 = 4x smaller matrix and page cache, recall@10 ~0.98, each scan dequantizes (slower)
+VECTOR_DTYPE = os.getenv("RAG_VECTOR_DTYPE", "float32")
+# Compact when at least this fraction of the rows (and COMPACT_MIN_DEAD rows) are dead
+VECTOR_COMPACT_RATIO = float(os.getenv("RAG_VECTOR_COMPACT_RATIO", "0.3"))
+VECTOR_COMPACT_MIN_DEAD = int(os.getenv("RAG_VECTOR_COMPACT_MIN_DEAD", "256"))
+# Two-stage search: 0 = exact single-stage scan, e.g. 128 / 256 = scan a truncated prefix first
+VECTOR_COARSE_DIM = int(os.getenv("RAG_VECTOR_COARSE_DIM", "0"))
+# Candidates re-ranked with full vectors: max(k * RERANK_FACTOR, RERANK_MIN)
+VECTOR_RERANK_FACTOR = int(os.getenv("RAG_VECTOR_RERANK_FACTOR", "10"))
+VECTOR_RERANK_MIN = int(os.getenv("RAG_VECTOR_RERANK_MIN", "100"))
+# Rows scored per matrix-vector product (bounds the temporary float32 copy for int8)
+SCAN_BLOCK_ROWS = 65536
+
+
+class VectorStore(ABC):
+    """
+    Per-tenant vector storage used by HybridRetriever. ids are unique per tenant and
+    add_documents is an upsert, so replaying a journaled write is harmless.
+    """
+
+    @abstractmethod
+    def add_documents(self, tenant_id: str, documents: List[str], metadatas: List[Dict[str, Any]],
+                      ids: List[str], embeddings: List[List[float]]):
+        ...
+
+    @abstractmethod
+    def delete_documents(self, tenant_id: str, ids: List[str]):
+        ...
+
+    @abstractmethod
+    def count(self, tenant_id: str) -> int:
+        ...
+
+    @abstractmethod
+    def list_ids(self, tenant_id: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    def get_documents(self, tenant_id: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """id -> {"document", "metadata"} for the given ids."""
+
+    @abstractmethod
+    def get_embeddings(self, tenant_id: str, ids: List[str]) -> Dict[str, List[float]]:
+        """id -> stored embedding for the given ids."""
+
+    @abstractmethod
+    def search_similarity(self, tenant_id: str, query_embedding: List[float], n_results: int = 5,
+                          include_embeddings: bool = False) -> Dict[str, Any]:
+        """
+        Chroma-style result for a single query:
+        {"ids": [[...]], "documents": [[...]], "metadatas": [[...]], "distances": [[...]], "embeddings": [[...]]}
+        """
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class _TenantIndex:
+    def __init__(self, root: Path, dtype: str, coarse_dim: int = 0):
+        self.root = root
+        self.default_dtype = dtype
+        self.configured_coarse_dim = coarse_dim
+        self.lock = threading.RLock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(self.root / "LOCK", "a+b")
+        self._lock_depth = 0
+        with self.lock, self._file_lock(exclusive=True):
+            self._load()
+
+    # --- Cross-process locking ---
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """flock on <tenant>/LOCK, shared with the other workers. Re-entrant; the caller holds self.lock."""
+        if self._lock_depth == 0 and fcntl is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0 and fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _synced(self, exclusive: bool = False):
+        """self.lock + the file lock, with this process caught up with the other workers' writes."""
+        with self.lock, self._file_lock(exclusive):
+            self._refresh()
+            yield
+
+    def _refresh(self):
+        try:
+            current = (self.root / "CURRENT").read_text().strip()
+        except OSError:
+            current = self.gen_dir.name
+        path = self.gen_dir / "rows.jsonl"
+        size = path.stat().st_size if current == self.gen_dir.name and path.exists() else 0
+        if current != self.gen_dir.name or (self.dim is None and size > self._sidecar_size):
+            # Compacted by another worker (or its first rows set the dimension)
+            self._load()
+        elif size > self._sidecar_size:
+            self._replay_sidecar(self._sidecar_size)
+            self._mark_live()
+
+    # --- Loading ---
+
+    def _load(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        current = self.root / "CURRENT"
+        if current.exists():
+            self.gen_dir = self.root / current.read_text().strip()
+        else:
+            self.gen_dir = self._new_generation(1)
+            self._set_current(self.gen_dir)
+
+        meta_path = self.gen_dir / "meta.json"
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        self.dim: Optional[int] = meta.get("dim")
+        self.dtype: str = meta.get("dtype", self.default_dtype)
+        self.coarse_dim: int = meta.get("coarse_dim", 0)
+
+        self.ids: List[str] = []            # row -> id
+        self.offsets: List[int] = []        # row -> byte offset of its sidecar line
+        self.id_to_row: Dict[str, int] = {}
+        self._sidecar_size = 0              # bytes of rows.jsonl replayed so far
+        self._replay_sidecar()
+
+        # A vector written without its sidecar line (crash in between) is discarded
+        vector_rows = self._file_rows("vectors.bin", self._row_bytes())
+        if vector_rows > len(self.ids):
+            self._truncate("vectors.bin", len(self.ids) * self._row_bytes())
+            if self.dtype == "int8":
+                self._truncate("scales.bin", len(self.ids) * 4)
+
+        self._mark_live()
+        self._matrix = None
+        self._scales = None
+        self._coarse = None
+        self._mapped_rows = -1
+        self._sync_coarse()
+
+    def _effective_coarse_dim(self) -> int:
+        if self.dim and 0 < self.configured_coarse_dim < self.dim:
+            return self.configured_coarse_dim
+        return 0
+
+    def _sync_coarse(self):
+        """(Re)builds coarse.bin from the full vectors when the configured prefix size changed or rows are missing."""
+        wanted = self._effective_coarse_dim()
+        path = self.gen_dir / "coarse.bin"
+        if wanted == self.coarse_dim and (not wanted or self._file_rows("coarse.bin", wanted * 4) == len(self.ids)):
+            if wanted:
+                self._truncate("coarse.bin", len(self.ids) * wanted * 4)
+            return
+        self.coarse_dim = 0
+        self._mapped_rows = -1
+        if path.exists():
+            path.unlink()
+        if wanted and self.ids:
+            with open(path, "wb") as f:
+                for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+                    rows = range(start, min(start + SCAN_BLOCK_ROWS, len(self.ids)))
+                    f.write(self._encode_coarse(self._decode(rows), wanted))
+        self.coarse_dim = wanted
+        self._write_meta(self.gen_dir)
+        self._mapped_rows = -1
+
+    def _mark_live(self):
+        self.live = np.zeros(len(self.ids), dtype=bool)
+        if self.id_to_row:
+            self.live[list(self.id_to_row.values())] = True
+
+    def _replay_sidecar(self, start: int = 0):
+        path = self.gen_dir / "rows.jsonl"
+        if not path.exists():
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("no line end")
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line (writers hold the file lock, so this is a crash): drop it and everything after
+                    f.close()
+                    self._truncate("rows.jsonl", offset)
+                    break
+                if "delete" in record:
+                    self.id_to_row.pop(record["delete"], None)
+                else:
+                    self.id_to_row[record["id"]] = len(self.ids)
+                    self.ids.append(record["id"])
+                    self.offsets.append(offset)
+                offset += len(line)
+        self._sidecar_size = offset
+
+    def _new_generation(self, number: int) -> Path:
+        gen_dir = self.root / f"gen-{number:06d}"
+        if gen_dir.exists():
+            shutil.rmtree(gen_dir)
+        gen_dir.mkdir()
+        return gen_dir
+
+    def _set_current(self, gen_dir: Path):
+        tmp = self.root / "CURRENT.tmp"
+        tmp.write_text(gen_dir.name)
+        os.replace(tmp, self.root / "CURRENT")
+
+    def _write_meta(self, gen_dir: Path):
+        (gen_dir / "meta.json").write_text(json.dumps({"dim": self.dim, "dtype": self.dtype, "coarse_dim": self.coarse_dim}))
+
+    def _row_bytes(self) -> int:
+        if not self.dim:
+            return 0
+        return self.dim * (1 if self.dtype == "int8" else 4)
+
+    def _file_rows(self, name: str, row_bytes: int) -> int:
+        path = self.gen_dir / name
+        if not row_bytes or not path.exists():
+            return 0
+        return path.stat().st_size // row_bytes
+
+    def _truncate(self, name: str, size: int):
+        with open(self.gen_dir / name, "r+b") as f:
+            f.truncate(size)
+
+    # --- Matrix access ---
+
+    def _mapped(self):
+        """(matrix, scales, coarse) memory maps over the current rows, re-opened after appends."""
+        n = len(self.ids)
+        if self._mapped_rows != n:
+            self._matrix, self._scales, self._coarse = None, None, None
+            if n > 0:
+                np_dtype = np.int8 if self.dtype == "int8" else np.float32
+                self._matrix = np.memmap(self.gen_dir / "vectors.bin", dtype=np_dtype, mode="r", shape=(n, self.dim))
+                if self.dtype == "int8":
+                    self._scales = np.memmap(self.gen_dir / "scales.bin", dtype=np.float32, mode="r", shape=(n,))
+                if self.coarse_dim:
+                    self._coarse = np.memmap(self.gen_dir / "coarse.bin", dtype=np.float32, mode="r", shape=(n, self.coarse_dim))
+            self._mapped_rows = n
+        return self._matrix, self._scales, self._coarse
+
+    @staticmethod
+    def _encode_coarse(vectors: np.ndarray, coarse_dim: int) -> bytes:
+        return _unit_rows(np.asarray(vectors, dtype=np.float32)[:, :coarse_dim]).astype(np.float32).tobytes()
+
+    def _encode(self, vectors: np.ndarray):
+        """Unit-normalized rows as (bytes of the matrix rows, bytes of the scales or None)."""
+        unit = _unit_rows(vectors.astype(np.float32))
+        if self.dtype != "int8":
+            return unit.astype(np.float32).tobytes(), None
+        scales = np.abs(unit).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(unit / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized.tobytes(), scales.astype(np.float32).tobytes()
+
+    def _decode(self, rows: Sequence[int]) -> np.ndarray:
+        matrix, scales, _ = self._mapped()
+        return self._decode_rows(matrix, scales, rows)
+
+    @staticmethod
+    def _decode_rows(matrix, scales, rows: Sequence[int]) -> np.ndarray:
+        out = np.asarray(matrix[list(rows)], dtype=np.float32)
+        if scales is not None:
+            out = out * np.asarray(scales[list(rows)])[:, None]
+        return out
+
+    def _read_records(self, rows: Sequence[int]) -> List[Dict[str, Any]]:
+        with open(self.gen_dir / "rows.jsonl", "rb") as f:
+            return self._read_lines(f, self.offsets, rows)
+
+    @staticmethod
+    def _read_lines(f, offsets: List[int], rows: Sequence[int]) -> List[Dict[str, Any]]:
+        records = []
+        for row in rows:
+            f.seek(offsets[row])
+            records.append(json.loads(f.readline()))
+        return records
+
+    # --- Writes ---
+
+    def append(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("embeddings must be a list of equal-length vectors, one per id")
+        with self._synced(exclusive=True):
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self.coarse_dim = self._effective_coarse_dim()
+                self._write_meta(self.gen_dir)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+
+            matrix_bytes, scale_bytes = self._encode(vectors)
+            with open(self.gen_dir / "vectors.bin", "ab") as f:
+                f.write(matrix_bytes)
+            if scale_bytes is not None:
+                with open(self.gen_dir / "scales.bin", "ab") as f:
+                    f.write(scale_bytes)
+            if self.coarse_dim:
+                with open(self.gen_dir / "coarse.bin", "ab") as f:
+                    f.write(self._encode_coarse(vectors, self.coarse_dim))
+
+            path = self.gen_dir / "rows.jsonl"
+            offset = self._sidecar_size
+            lines = []
+            for chunk_id, doc, meta in zip(ids, documents, metadatas):
+                line = (json.dumps({"id": chunk_id, "document": doc, "metadata": meta or {}}, ensure_ascii=False) + "\n").encode("utf-8")
+                lines.append(line)
+            with open(path, "ab") as f:
+                f.write(b"".join(lines))
+            self._sidecar_size += sum(map(len, lines))
+
+            new_live = np.ones(len(ids), dtype=bool)
+            for n, (chunk_id, line) in enumerate(zip(ids, lines)):
+                old = self.id_to_row.get(chunk_id)
+                if old is not None:
+                    if old >= len(self.live):
+                        new_live[old - len(self.live)] = False  # duplicate id inside this batch
+                    else:
+                        self.live[old] = False
+                self.id_to_row[chunk_id] = len(self.ids)
+                self.ids.append(chunk_id)
+                self.offsets.append(offset)
+                offset += len(line)
+            self.live = np.concatenate([self.live, new_live])
+            self._maybe_compact()
+
+    def delete(self, ids: Sequence[str]):
+        with self._synced(exclusive=True):
+            present = [i for i in dict.fromkeys(ids) if i in self.id_to_row]
+            if not present:
+                return
+            tombstones = b"".join((json.dumps({"delete": i}, ensure_ascii=False) + "\n").encode("utf-8") for i in present)
+            with open(self.gen_dir / "rows.jsonl", "ab") as f:
+                f.write(tombstones)
+            self._sidecar_size += len(tombstones)
+            for chunk_id in present:
+                self.live[self.id_to_row.pop(chunk_id)] = False
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        dead = len(self.ids) - len(self.id_to_row)
+        if dead >= VECTOR_COMPACT_MIN_DEAD and dead >= VECTOR_COMPACT_RATIO * len(self.ids):
+            self.compact()
+
+    def compact(self):
+        """Copies the live rows into a new generation and switches CURRENT to it."""
+        with self._synced(exclusive=True):
+            rows = sorted(self.id_to_row.values())
+            number = int(self.gen_dir.name.split("-")[1]) + 1
+            new_dir = self._new_generation(number)
+            if self.dim is not None:
+                self._write_meta(new_dir)
+            if rows:
+                matrix, scales, coarse = self._mapped()
+                with open(new_dir / "vectors.bin", "wb") as f:
+                    for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+                        f.write(np.asarray(matrix[rows[start:start + SCAN_BLOCK_ROWS]]).tobytes())
+                if coarse is not None:
+                    with open(new_dir / "coarse.bin", "wb") as f:
+                        for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+                            f.write(np.asarray(coarse[rows[start:start + SCAN_BLOCK_ROWS]]).tobytes())
+                if self.dtype == "int8":
+                    with open(new_dir / "scales.bin", "wb") as f:
+                        f.write(np.asarray(scales[rows]).tobytes())
+            with open(new_dir / "rows.jsonl", "wb") as dst:
+                if rows:
+                    with open(self.gen_dir / "rows.jsonl", "rb") as src:
+                        for row in rows:
+                            src.seek(self.offsets[row])
+                            dst.write(src.readline())
+
+            old_dir = self.gen_dir
+            self._set_current(new_dir)
+            self._matrix, self._scales = None, None
+            self._load()
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    # --- Reads ---
+
+    def _scan(self, matrix, q: np.ndarray, scales=None) -> np.ndarray:
+        """Scores of every row: one BLAS matrix-vector product per block of rows."""
+        n = matrix.shape[0]
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            block = matrix[start:start + SCAN_BLOCK_ROWS]
+            if scales is not None:
+                scores[start:start + len(block)] = (block.astype(np.float32) @ q) * scales[start:start + len(block)]
+            else:
+                scores[start:start + len(block)] = block @ q
+        return scores
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def _snapshot(self):
+        """
+        What a search reads, all from one generation: live mask, memory maps, sidecar offsets
+        and an open sidecar handle. The scan runs without the lock, and a compaction in the
+        meantime switches self.* to a new generation with renumbered rows; the snapshot keeps
+        using the old files (maps and open handles stay valid after the directory is removed).
+        Appends only extend the old offsets list, so the rows in the snapshot keep their offsets.
+        """
+        with self._synced():
+            live = self.live.copy()
+            matrix, scales, coarse = self._mapped()
+            rows_file = open(self.gen_dir / "rows.jsonl", "rb") if live.any() else None
+            return live, matrix, scales, coarse, self.offsets, rows_file
+
+    def search(self, query: Sequence[float], k: int, include_embeddings: bool) -> Dict[str, Any]:
+        live, matrix, scales, coarse, offsets, rows_file = self._snapshot()
+        if rows_file is None or k <= 0:
+            if rows_file is not None:
+                rows_file.close()
+            return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]], "embeddings": [[]]}
+        with rows_file:
+            return self._search_snapshot(query, k, include_embeddings, live, matrix, scales, coarse, offsets, rows_file)
+
+    def _search_snapshot(self, query, k, include_embeddings, live, matrix, scales, coarse, offsets, rows_file) -> Dict[str, Any]:
+        q = np.asarray(query, dtype=np.float32)
+        if q.shape[0] != matrix.shape[1]:
+            raise ValueError(f"query dimension {q.shape[0]} does not match index dimension {matrix.shape[1]}")
+        q = q / (np.linalg.norm(q) or 1.0)
+        k = min(k, int(live.sum()))
+
+        pool = max(k * VECTOR_RERANK_FACTOR, VECTOR_RERANK_MIN)
+        if coarse is not None and pool < live.sum():
+            # 1st pass: truncated prefix; 2nd pass: full vectors for the best `pool` rows only
+            q_coarse = q[:coarse.shape[1]] / (np.linalg.norm(q[:coarse.shape[1]]) or 1.0)
+            coarse_scores = self._scan(coarse, q_coarse)
+            coarse_scores[~live] = -np.inf
+            candidates = np.sort(np.argpartition(-coarse_scores, pool - 1)[:pool])
+            full = self._decode_rows(matrix, scales, candidates)
+            candidate_scores = full @ q
+            order = self._top(candidate_scores, k)
+            top = candidates[order]
+            top_scores = candidate_scores[order]
+        else:
+            scores = self._scan(matrix, q, scales)
+            scores[~live] = -np.inf
+            top = self._top(scores, k)
+            top_scores = scores[top]
+
+        records = self._read_lines(rows_file, offsets, top)
+        vectors = self._decode_rows(matrix, scales, top) if include_embeddings else None
+        result = {
+            "ids": [[r["id"] for r in records]],
+            "documents": [[r["document"] for r in records]],
+            "metadatas": [[r["metadata"] for r in records]],
+            # Cosine distance, like a Chroma collection with hnsw:space=cosine
+            "distances": [[float(1.0 - score) for score in top_scores]],
+        }
+        if include_embeddings:
+            result["embeddings"] = [[v.tolist() for v in vectors]]
+        return result
+
+    def count(self) -> int:
+        with self._synced():
+            return len(self.id_to_row)
+
+    def list_ids(self) -> List[str]:
+        with self._synced():
+            return list(self.id_to_row)
+
+    def get(self, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        with self._synced():
+            rows = [self.id_to_row[i] for i in ids if i in self.id_to_row]
+            return {r["id"]: r for r in self._read_records(rows)}
+
+    def get_vectors(self, ids: Sequence[str]) -> Dict[str, List[float]]:
+        with self._synced():
+            present = [i for i in ids if i in self.id_to_row]
+            if not present:
+                return {}
+            vectors = self._decode([self.id_to_row[i] for i in present])
+            return {chunk_id: v.tolist() for chunk_id, v in zip(present, vectors)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._synced():
+            return {
+                "dim": self.dim,
+                "dtype": self.dtype,
+                "coarse_dim": self.coarse_dim,
+                "rows": len(self.ids),
+                "live_rows": len(self.id_to_row),
+                "generation": self.gen_dir.name,
+                "bytes": sum(p.stat().st_size for p in self.gen_dir.iterdir()),
+            }
+
+
+class MmapVectorStore(VectorStore):
+    def __init__(self, root: str = VECTOR_INDEX_DIR, dtype: str = VECTOR_DTYPE, coarse_dim: int = VECTOR_COARSE_DIM):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported RAG_VECTOR_DTYPE: {dtype}")
+        self.root = Path(root)
+        self.dtype = dtype
+        self.coarse_dim = coarse_dim
+        self._indexes: Dict[str, _TenantIndex] = {}
+        self._lock = threading.Lock()
+
+    def _index(self, tenant_id: str) -> _TenantIndex:
+        with self._lock:
+            index = self._indexes.get(tenant_id)
+            if index is None:
+                safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", tenant_id)
+                index = _TenantIndex(self.root / safe_name, self.dtype, self.coarse_dim)
+                self._indexes[tenant_id] = index
+            return index
+
+    def add_documents(self, tenant_id, documents, metadatas, ids, embeddings):
+        if ids:
+            self._index(tenant_id).append(list(ids), list(documents), list(metadatas), embeddings)
+
+    def delete_documents(self, tenant_id, ids):
+        if ids:
+            self._index(tenant_id).delete(ids)
+
+    def count(self, tenant_id):
+        return self._index(tenant_id).count()
+
+    def list_ids(self, tenant_id):
+        return self._index(tenant_id).list_ids()
+
+    def get_documents(self, tenant_id, ids):
+        if not ids:
+            return {}
+        return {
+            chunk_id: {"document": r["document"], "metadata": r["metadata"]}
+            for chunk_id, r in self._index(tenant_id).get(ids).items()
+        }
+
+    def get_embeddings(self, tenant_id, ids):
+        if not ids:
+            return {}
+        return self._index(tenant_id).get_vectors(ids)
+
+    def search_similarity(self, tenant_id, query_embedding, n_results=5, include_embeddings=False):
+        return self._index(tenant_id).search(query_embedding, n_results, include_embeddings)
+
+    def compact(self, tenant_id: str):
+        self._index(tenant_id).compact()
+
+    def stats(self, tenant_id: str) -> Dict[str, Any]:
+        return self._index(tenant_id).stats()
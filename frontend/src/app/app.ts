@@ -70,6 +70,7 @@ export class App implements OnInit {
   selectedFiles: File[] = [];
   viewMode: 'chat' | 'knowledge' = 'chat';
   knowledgeDocs: any[] = [];
+  knowledgeNextCursor: string | null = null;
   displayedColumns: string[] = ['filename', 'id'];
 
   removeFile(fileToRemove: File): void {
@@ -192,10 +193,11 @@ export class App implements OnInit {
     }
   }
 
-  fetchKnowledgeBase() {
-    this.chat.getKnowledgeList().subscribe({
-      next: (data) => {
-        this.knowledgeDocs = data;
+  fetchKnowledgeBase(loadMore = false) {
+    this.chat.getKnowledgeList(loadMore ? this.knowledgeNextCursor : null).subscribe({
+      next: (page) => {
+        this.knowledgeDocs = loadMore ? [...this.knowledgeDocs, ...page.items] : page.items;
+        this.knowledgeNextCursor = page.next_cursor;
       },
       error: (e) => this.showError('Failed to fetch knowledge base')
     });
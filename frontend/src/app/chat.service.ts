@@ -149,9 +149,13 @@ export class ChatService {
     return this.http.get<any>(`${this.baseUrl}/tenants/${this.currentTenantId}/policies`, { withCredentials: true });
   }
 
-  getKnowledgeList() {
+  getKnowledgeList(cursor: string | null = null, limit = 50) {
     if (!this.currentTenantId) return throwError(() => new Error('Not logged in'));
-    return this.http.get<any[]>(`${this.baseUrl}/tenants/${this.currentTenantId}/knowledge`, { withCredentials: true });
+    const params: any = { limit };
+    if (cursor) params.cursor = cursor;
+    return this.http.get<{ items: any[]; next_cursor: string | null }>(
+      `${this.baseUrl}/tenants/${this.currentTenantId}/knowledge`, { params, withCredentials: true }
+    );
   }
 
   ingestFile(file: File) {